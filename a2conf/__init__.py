@@ -2,8 +2,25 @@
 
 import re
 import sys
+import asyncio
+import functools
+import threading
 import os
 import glob
+import mmap
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import ParseCache
+from .stats import LoadStats, FileStats, GlobStats
+from .query import Selector, SelectorError, compile_selector
+from .resolve import EffectiveConfig, ServerScope, expand
+from .view import ConditionalView, conditions, module_id, parse_version
+from .frozen import FrozenTree, FrozenNode, FrozenError, freeze
+from .diff import Change, digest, diff
+from .validate import Finding, StatCache, validate
+from .locate import LocationIndex, parse_locations, top_nodes
 
 class MyException(Exception):
     pass
@@ -14,95 +31,664 @@ class VhostNotFound(MyException):
 class ArgumentError(MyException):
     pass
 
+class LoadCancelled(MyException):
+    pass
+
+# Line kinds returned by tokenize()
+BLANK = 0
+COMMENT = 1
+DIRECTIVE = 2
+OPEN = 3
+CLOSE = 4
+
+# One pass over line: closing tag, opening tag or directive (or nothing, for comments and blank lines)
+_line_re = re.compile(r"""[ \t]*(?:
+    <(?P<close>/[^ >]*)                     # </VirtualHost>
+    |<(?P<section>[^ >]*)(?P<sargs>[^#]*)   # <VirtualHost *:80>, <IfVersion >= 2.4> (up to last > before #)
+    |(?P<cmd>[^ \t#]+)[ \t]*(?P<args>[^#]*)  # ServerName example.com
+)?""", re.VERBOSE)
+
+# change it when tokenize() output changes, it invalidates ParseCache entries
+PARSER_VERSION = 6
+
+_include_cmds = frozenset(['include', 'includeoptional'])
+_hostname_cmds = frozenset(['servername', 'serveralias'])
+
+
+def tokenize(raw):
+    """ Classify config line and split it to fields in one pass
+
+    :param raw: config line
+    :return: tuple (kind, section, cmd, args), kind is one of BLANK, COMMENT, DIRECTIVE, OPEN, CLOSE
+    """
+    if not raw:
+        return (BLANK, None, None, None)
+
+    # section and cmd names repeat a lot, so they are interned
+    m = _line_re.match(raw)
+    if m.group('close') is not None:
+        return (CLOSE, sys.intern(m.group('close')), None, None)
+    if m.group('section') is not None:
+        sargs = m.group('sargs')
+        end = sargs.rfind('>')
+        return (OPEN, sys.intern(m.group('section')), None, (sargs[:end] if end >= 0 else sargs).strip())
+    if m.group('cmd') is not None:
+        return (DIRECTIVE, None, sys.intern(m.group('cmd')), m.group('args').strip())
+    if '#' in raw:
+        return (COMMENT, None, None, None)
+    return (BLANK, None, None, None)
+
+
+# token of last record of file which ends with blank lines
+_TAIL = (BLANK, None, None, None)
+
+
+def read_records(fh, comments=True):
+    """ Read and tokenize config file, yield (line, raw, token) for every non-blank line (raw keeps indentation)
+
+    Line ending with backslash is continued on next line (as in apache): raw has all lines of it, token is for
+    joined line. If file ends with blank lines, last record is (line of last one, '', BLANK token).
+    :param comments: if False, comment-only lines are skipped
+    """
+    line = end = 0
+    lines = enumerate(fh, 1)
+    for line, raw in lines:
+        raw = raw.rstrip()
+        if raw:
+            logical = raw
+            end = line
+            if raw[-1] == '\\':
+                raw, logical = _continued(raw, lines, '\n')
+                end += raw.count('\n')
+            if comments or logical.lstrip()[:1] != '#':
+                yield (line, raw, tokenize(logical))
+    if line > end:
+        yield (line, '', _TAIL)
+
+
+def _continued(raw, lines, newline):
+    """ Read continuation lines of raw (str or bytes, ends with backslash) from lines iterator
+
+    :return: (all lines joined with newline, logical line without backslashes and newlines)
+    """
+    backslash = raw[-1:]
+    parts = [raw]
+    logical = [raw[:-1]]
+    for _, raw in lines:
+        raw = raw.rstrip()
+        parts.append(raw)
+        if raw[-1:] != backslash:
+            logical.append(raw)
+            break
+        logical.append(raw[:-1])
+    return newline.join(parts), raw[:0].join(logical)
+
+
+def read_text_records(filename, comments=True):
+    """ Return (file_stat, generator of read_records()) for file opened in text mode. File is closed when
+    generator is exhausted. """
+    fh = open(filename)
+    try:
+        stat = file_stat(os.fstat(fh.fileno()))
+    except BaseException:
+        fh.close()
+        raise
+    return stat, _closing(fh, read_records(fh, comments))
+
+
+def _closing(fh, records):
+    with fh:
+        for record in records:
+            yield record
+
+
+def read_mmap_records(filename, comments=True, encoding='utf-8'):
+    """ Same as read_text_records(), but file is memory-mapped and scanned for line ends in bytes
+
+    Only lines which are kept are decoded, so with comments=False comment-only lines (and their continuation
+    lines) are never decoded.
+    """
+    fh = open(filename, 'rb')
+    try:
+        stat = file_stat(os.fstat(fh.fileno()))
+        if not stat[1]:
+            # empty file can not be mapped
+            return stat, _closing(fh, ())
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except BaseException:
+        fh.close()
+        raise
+    return stat, _mmap_records(fh, mm, comments, encoding)
+
+
+def _mmap_lines(mm, block=1 << 20):
+    """ Yield (line, bytes) for every line in mapping, without trailing whitespace
+
+    Mapping is split to lines by blocks of about block bytes, so only one block is copied at a time.
+    """
+    size = len(mm)
+    pos = 0
+    line = 0
+    while pos < size:
+        end = mm.rfind(b'\n', pos, pos + block) + 1 if pos + block < size else size
+        if end <= pos:
+            # very long line
+            end = mm.find(b'\n', pos) + 1 or size
+        lines = mm[pos:end].split(b'\n')
+        if end < size or not lines[-1]:
+            # text after last newline in block (empty, or next block starts with it)
+            lines.pop()
+        for raw in lines:
+            line += 1
+            yield line, raw.rstrip()
+        pos = end
+
+
+def _mmap_records(fh, mm, comments, encoding):
+    with fh, mm:
+        line = end = 0
+        lines = _mmap_lines(mm)
+        for line, raw in lines:
+            if not raw:
+                continue
+            end = line
+            logical = None
+            if raw[-1:] == b'\\':
+                raw, logical = _continued(raw, lines, b'\n')
+                end += raw.count(b'\n')
+            if not comments and (logical or raw).lstrip()[:1] == b'#':
+                continue
+            raw = raw.decode(encoding)
+            yield (line, raw, tokenize(raw if logical is None else logical.decode(encoding)))
+        if line > end:
+            yield (line, '', _TAIL)
+
+
+def _counted(records, fs):
+    """ Pass records through, count lines and nodes in FileStats """
+    for record in records:
+        kind = record[2][0]
+        if kind != BLANK:
+            # blank lines at end of file are not counted
+            fs.lines = record[0]
+            if kind != CLOSE:
+                fs.nodes += 1
+        yield record
+
+
+def file_stat(st):
+    """ Return (inode, size, mtime_ns) from os.stat() result, to find changed files """
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def read_stat_records(filename, cache=None, reader=None, comments=True):
+    """ Return (file_stat, records) for file, use ParseCache if given. File is stat'ed before reading.
+
+    :param reader: read_text_records (default) or read_mmap_records
+    :param comments: if False, comment-only lines are skipped
+    """
+    reader = reader or read_text_records
+    if cache is None:
+        stat, records = reader(filename, comments)
+        return stat, list(records)
+
+    key = cache.key(filename, PARSER_VERSION if comments else (PARSER_VERSION, 'nocomments'))
+    records = cache.get(key)
+    if records is None:
+        records = list(reader(filename, comments)[1])
+        cache.put(key, records)
+    return key[1:4], records
+
+
+def load_records(filename, cache=None):
+    """ Return list of read_records() for file, use ParseCache if given """
+    return read_stat_records(filename, cache)[1]
+
+
+def include_files(filename, pattern):
+    """ Return sorted list of files for Include/IncludeOptional pattern in filename (as apache does) """
+    fullpath = os.path.join(os.path.dirname(filename), pattern)
+    if os.path.isdir(fullpath):
+        fullpath = os.path.join(fullpath, '*')
+    return sorted(glob.glob(fullpath))
+
+
+class LoadedFile(object):
+    """ Config file loaded by read_file() """
+    __slots__ = ('path', 'stat', 'include', 'includes', 'nodes', 'tail')
+
+    def __init__(self, path, stat, include=None):
+        self.path = path
+        self.stat = stat # file_stat() when file was read
+        self.include = include # Include node, which included this file (None for main file)
+        self.includes = list() # Include nodes in this file
+        self.nodes = None # nodes this file added to content of Include node parent
+        self.tail = 0 # number of blank lines at end of file
+
+
+class FileIndex(object):
+    """ All files loaded into tree by read_file() and Include nodes which loaded them """
+    def __init__(self):
+        self.main = None # LoadedFile of main config file
+        self.files = dict() # path -> list of LoadedFile (file may be included more then once)
+        # id(Include node) -> (Include node, its parent when loaded, list of LoadedFile in include order)
+        self.includes = dict()
+        self.dirty = set() # paths of files changed after load
+        self.stats = None # LoadStats, if read_file() was called with stats
+        self.reader = read_text_records # or read_mmap_records
+        self.comments = True # False if comment-only lines were skipped
+        self.cancel = None # threading.Event, load stops with LoadCancelled when it is set
+
+    def add(self, loaded):
+        self.files.setdefault(loaded.path, list()).append(loaded)
+
+    def remove(self, loaded):
+        """ Forget file and all files included from it """
+        same = self.files.get(loaded.path, ())
+        if loaded in same:
+            same.remove(loaded)
+            if not same:
+                del self.files[loaded.path]
+        for include in loaded.includes:
+            entry = self.includes.pop(id(include), None)
+            if entry:
+                for sub in entry[2]:
+                    self.remove(sub)
+
+    def paths(self):
+        return list(self.files)
+
+    def update_stat(self, path):
+        """ Update stat of file after it's written, so reload() will not read it again """
+        stat = file_stat(os.stat(path))
+        for loaded in self.files.get(path, ()):
+            loaded.stat = stat
+
+
+def write_atomic(filename, data):
+    """ Write data to file via temporary file in same directory, fsync and rename """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    prefix = '.' + os.path.basename(filename) + '.'
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        st = None
+        # new file: kernel applies umask of process to mode
+        while True:
+            tmp = os.path.join(dirname, prefix + os.urandom(6).hex())
+            try:
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+                break
+            except FileExistsError:
+                continue
+    else:
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix=prefix)
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        if st is not None:
+            os.chmod(tmp, st.st_mode & 0o7777)
+            try:
+                os.chown(tmp, st.st_uid, st.st_gid)
+            except OSError:
+                pass
+        os.replace(tmp, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def get_suffix(raw):
+    """ Return comment at end of raw line (with all spaces before it), '' if no comment or None if no raw """
+    if not raw:
+        return None
+    raw = raw.lstrip()
+    pos = raw.find('#')
+    if pos < 0:
+        return ''
+    return raw[len(raw[:pos].rstrip()):]
+
+
+def get_name(raw):
+    """ Guess node name from raw line: ServerName or <VirtualHost> """
+    if not raw:
+        return '#root'
+    name = raw.strip().split(' ', 1)[0]
+    if name.startswith('<') and not name.endswith('>'):
+        name += '>'
+    return name
+
+
+_readers = {
+    'text': read_text_records,
+    'mmap': read_mmap_records,
+}
+
+
+class _Unset(object):
+    """ Marks lazy attributes which are not calculated yet. Pickled and copied by reference, so copies of nodes
+    have same marker. """
+    __slots__ = ()
+
+    def __reduce__(self):
+        return '_UNSET'
+
+    def __repr__(self):
+        return '_UNSET'
+
+
+_UNSET = _Unset()
+
+# results of walk() visitors: do not visit content of node, stop walk
+SKIP = 'skip'
+STOP = 'stop'
+
+
 class Node(object):
-    def __init__(self, read=None, raw=None, parent=None, name=None, suffix=None, path=None, line=None, includes=True):
+    __slots__ = ('raw', 'parent', '_content', '_section', '_cmd', '_args', '_suffix', '_name', 'last_child',
+                 'includes', 'path', 'line', '_names', '_gap', '_close', '_modified', '_memo')
+
+    # indentation for dump(), same for all nodes
+    prefix = ' '*4
+
+    def __init__(self, read=None, raw=None, parent=None, name=None, suffix=None, path=None, line=None, includes=True,
+                 token=None, cache=None, parallel=None, stats=None, reader=None, comments=True):
         self.raw = raw
         self.parent = parent
-        self.content = list() # children
-        self.prefix = ' '*4
-        self.section = None # Section e.g. "VirtualHost" or None
-        self.cmd = None # Command, e.g. "ServerName"
-        self.args = None # Args to section (VirtualHost), e.g. "*:80" or
-        self.suffix = None
+        self._content = None # children, list is created only when first child is added
         self.last_child = None
         self.includes = includes
 
         self.path = path # Filename
         self.line = line # line in file
+        self._names = None # lowercase name -> children index, built on first lookup
+        self._gap = 0 # number of blank lines before node in file
+        self._close = None # (line, raw, gap) of closing tag of section in file
+        self._modified = False # True if cmd, section, args or suffix changed after node is created
+        # dict of data calculated from node and its content, dropped when it's changed, and rarely set data
+        # (hostname index of vhosts in content, FileIndex of root), so it does not take slot in every node
+        self._memo = None
 
-        if self.raw:
-            match = re.search(r'(\s*#.*)$',self.raw)
-            if match:
-                self.suffix = match.group(0)
-            else:
-                self.suffix = ''
+        if token is None:
+            token = tokenize(raw)
 
-        if name:
-            self.name = name
-        else:
-            if self.raw:
-                # guess name, ServerName or <VirtualHost>
-                self.name = self.raw.strip().split(' ')[0]
-                if self.name.startswith('<') and not self.name.endswith('>'):
-                    self.name += '>'
-            else:
-                self.name = '#root'
-
-        if self.is_open():
-            m = re.match('[ \t]*<([^ >]+)([^>]*)', self.raw)
-            self.section = m.group(1)
-            self.args = m.group(2).strip()
-        elif self.is_close():
-            m = re.match('[ \t]*<(/[^ >]+)([^>]*)', self.raw)
-            self.section = m.group(1)
-        elif self.raw:
-            cmdline = self.raw.split('#')[0].strip()
-
-            if cmdline:
-                m = re.match('[ \t]*([^ \t]+)[ \t]*([^#]*)', cmdline)
-                if m is None:
-                    print("Cannot parse", repr(cmdline))
-                    assert(False)
-                else:
-                    # parsed well
-                    self.cmd = m.group(1)
-                    self.args = m.group(2).strip()
+        # section e.g. "VirtualHost" or None, cmd e.g. "ServerName" or None
+        # args to section or cmd, e.g. "*:80" or "example.com"
+        _, self._section, self._cmd, self._args = token
+
+        # name and suffix are calculated from raw only when requested
+        self._name = name or _UNSET
+        self._suffix = _UNSET if suffix is None else suffix
 
         if read:
-            self.read_file(read)
+            self.read_file(read, cache=cache, parallel=parallel, stats=stats, reader=reader, comments=comments)
+
+    @property
+    def name(self):
+        if self._name is _UNSET:
+            self._name = get_name(self.raw)
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._name = value
+        if self.parent is not None:
+            self.parent._names = None
+        self._hostnames_changed()
+
+    @property
+    def section(self):
+        return self._section
+
+    @section.setter
+    def section(self, value):
+        self._section = value
+        self._edited()
+
+    @property
+    def cmd(self):
+        return self._cmd
+
+    @cmd.setter
+    def cmd(self, value):
+        self._cmd = value
+        self._edited()
+
+    @property
+    def args(self):
+        return self._args
+
+    @args.setter
+    def args(self, value):
+        self._args = value
+        self._hostnames_changed()
+        self._edited()
+
+    @property
+    def suffix(self):
+        if self._suffix is _UNSET:
+            self._suffix = get_suffix(self.raw)
+        return self._suffix
+
+    @suffix.setter
+    def suffix(self, value):
+        self._suffix = value
+        self._edited()
+
+    @property
+    def content(self):
+        """ list of children, empty list for nodes without children """
+        if self._content is None:
+            self._content = list()
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+        for c in value or ():
+            c.parent = self
+        self._content_replaced()
+        self._changed()
+
+    def _content_replaced(self):
+        """ Drop indexes after whole content list is replaced """
+        self._vhosts = None
+        self._names = None
+        if self.parent is not None and self.parent._vhosts is not None and self.is_vhost():
+            self.parent._vhosts = None
+
+    @property
+    def _vhosts(self):
+        """ Hostname index for yield_vhost() (in _memo), built on first lookup """
+        return self._memo.get('vhosts') if self._memo else None
+
+    @_vhosts.setter
+    def _vhosts(self, value):
+        self._set_memo('vhosts', value)
+
+    @property
+    def _files(self):
+        """ FileIndex (in _memo), only for node which did read_file() """
+        return self._memo.get('files') if self._memo else None
+
+    @_files.setter
+    def _files(self, value):
+        self._set_memo('files', value)
+
+    def _set_memo(self, key, value):
+        if value is not None:
+            if self._memo is None:
+                self._memo = dict()
+            self._memo[key] = value
+        elif self._memo:
+            self._memo.pop(key, None)
+
+    def get_root(self):
+        """ Return top node of tree """
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        return root
+
+    def _edited(self):
+        """ Called after own line of node is changed """
+        self._modified = True
+        self._changed()
+
+    def _changed(self):
+        """ Called after node (or its content) is changed: drop memoized data, mark file of node as dirty """
+        root = self._invalidate()
+        if self.path is not None and root._files is not None:
+            root._files.dirty.add(self.path)
+
+    def _invalidate(self):
+        """ Drop memoized data which depends on this node: digests of node and its ancestors, effective config of
+        vhost which contains it or server scope of root, if node is not in vhost (or vhost has Define).
+
+        :return: root
+        """
+        node = self
+        vhost = None
+        while True:
+            if node._memo:
+                node._memo.pop('digest', None)
+            if vhost is None and node._section is not None and node._section.lower() == 'virtualhost':
+                vhost = node
+            if node.parent is None:
+                break
+            node = node.parent
+
+        if vhost is not None:
+            if vhost._memo:
+                vhost._memo.pop('effective', None)
+            # Define in vhost is not scoped by vhost
+            server = node._memo.get('server') if node._memo else None
+            if server is not None and server.depends(vhost):
+                node._memo.pop('server')
+        elif node._memo:
+            node._memo.pop('server', None)
+        if node._memo:
+            node._memo.pop('views', None)
+            locations = node._memo.get('locations')
+            if locations is not None:
+                locations.forget(self.path)
+        return node
+
+    def _forget_locations(self, paths):
+        """ Nodes of files in paths are changed, drop their (file, line) index (for root) """
+        locations = self._memo.get('locations') if self._memo else None
+        if locations is not None:
+            for path in paths:
+                locations.forget(path)
+
+    def _adopt(self, children):
+        """ New children (with all their content) belong to file of this node """
+        stack = list(children)
+        while stack:
+            child = stack.pop()
+            if child.path != self.path:
+                child.path = self.path
+                if child._content:
+                    stack.extend(child._content)
+
+    def get_vhost(self):
+        """ Return vhost which contains this node (or node itself, if it's vhost) or None """
+        node = self
+        while node is not None:
+            if node._section is not None and node._section.lower() == 'virtualhost':
+                return node
+            node = node.parent
+        return None
+
+    def is_vhost(self):
+        """ Return True if this node is <VirtualHost> section """
+        return self.name.lower() == '<virtualhost>'
+
+    def hostnames(self):
+        """ Return list of all hostnames of vhost: ServerName and all ServerAlias """
+        names = list()
+        servername = self.first('ServerName')
+        if servername is not None:
+            names.append(servername.args)
+
+        for alias in self.children('ServerAlias'):
+            names.extend(alias.args.split())
+        return names
+
+    def _hostnames_changed(self):
+        """ Drop hostname index if this node is ServerName/ServerAlias of indexed vhost """
+        vhost = self.parent
+        if vhost is None or vhost.parent is None or vhost.parent._vhosts is None:
+            return
+        if self.name.lower() in _hostname_cmds:
+            vhost.parent._vhosts = None
+
+    def _index_vhost(self, vhost):
+        """ Add vhost (appended to content) to hostname index """
+        for hostname in vhost.hostnames():
+            vhosts = self._vhosts.setdefault(hostname.lower(), list())
+            if not vhosts or vhosts[-1] is not vhost:
+                vhosts.append(vhost)
+
+    def _added(self, children, appended=True):
+        """ Update parent links and indexes after children are added to content """
+        if self._names is not None and not appended:
+            self._names = None
+        for child in children:
+            child.parent = self
+            if self._names is not None:
+                self._names.setdefault(child.name.lower(), list()).append(child)
+            if self._vhosts is not None and child.is_vhost():
+                if appended:
+                    self._index_vhost(child)
+                else:
+                    # order of vhosts changed, rebuild index on next lookup
+                    self._vhosts = None
+            child._hostnames_changed()
+
+    def _removed(self, child):
+        """ Update indexes after child is removed from content """
+        if self._names is not None:
+            named = self._names.get(child.name.lower())
+            if named and child in named:
+                named.remove(child)
+        if self._vhosts is not None and child.is_vhost():
+            for hostname in child.hostnames():
+                vhosts = self._vhosts.get(hostname.lower())
+                if vhosts and child in vhosts:
+                    vhosts.remove(child)
+        child._hostnames_changed()
 
     def __repr__(self):
         return("Node:{!r}".format(self.name))
 
     def is_open(self):
         """ Return True if this node opens section, e.g <VirtualHost> or <IfModule>"""
-        if self.raw is None:
-            return False
-
-        if re.match('^[ \t]*<(?!/)', self.raw):
-            return True
-        return False
+        return self.section is not None and not self.section.startswith('/')
 
     def is_close(self):
         """ Return True if this node closes section"""
-        if self.raw is None:
-            return False
-
-        if re.match('[ \t]*</', self.raw):
-            return True
-        return False
+        return self.section is not None and self.section.startswith('/')
 
     def add(self, child):
         """ Append child to node """
         assert(isinstance(child, Node))
 
-        if self.content is None:
-            self.content = list()
-        self.content.append(child)
+        if self._content is None:
+            self._content = list()
+        self._content.append(child)
         self.last_child = child
+        self._adopt([child])
+        self._added([child])
+        self._changed()
 
     def add_raw(self, raw):
-        sl = Node(raw, parent=self)
+        sl = Node(raw=raw, parent=self)
         self.add(sl)
 
     def insert(self, child, after=None):        
@@ -129,8 +715,11 @@ class Node(object):
         
         child = [ Node(raw=x) if isinstance(x, str) else x for x in child]
 
-        if not self.content:
-            self.content = child
+        if not self._content:
+            self._adopt(child)
+            self._content = child
+            self._added(child)
+            self._changed()
             return child[0]
         
         ## get default index
@@ -141,12 +730,21 @@ class Node(object):
 
         if after:
             for after_item in reversed(after):
-                idx = get_index(self.content, after_item)
+                idx = get_index(self._content, after_item)
                 if idx:
                     # self.content.insert(idx, child)
-                    self.content[idx:idx] = child
+                    # new nodes belong to file of anchor (as in Batch)
+                    anchor = self._content[idx-1]
+                    anchor._adopt(child)
+                    appended = idx == len(self._content)
+                    self._content[idx:idx] = child
+                    self._added(child, appended=appended)
+                    anchor._changed()
                     return child[0]        
-        self.content.extend(child)
+        self._adopt(child)
+        self._content.extend(child)
+        self._added(child)
+        self._changed()
         return child[0]
 
 
@@ -159,31 +757,112 @@ class Node(object):
         return "</{}>".format(self.section)
 
     def filter(self, regex):
+        """ Delete all nodes (at any depth) which line matches regex (case-insensitive), with their content """
+        match = re.compile(regex, re.IGNORECASE).match
+        paths = set() # files of deleted nodes
+        root = None
+        # parents are taken from stack, not from node.parent (it's not set for nodes added to content list directly)
+        stack = [ self ] if self._content else []
+        while stack:
+            parent = stack.pop()
+            kept = list()
+            for c in parent._content:
+                if match(c.raw.lstrip()):
+                    paths.add(c.path)
+                    continue
+                kept.append(c)
+                if c._content:
+                    stack.append(c)
+            if len(kept) != len(parent._content):
+                parent._content = kept
+                parent._content_replaced()
+                root = parent._invalidate()
 
-        def ff(regex, c):
-            # print "FF", c, c.raw
-            if c.section:
-                # print "SECTION", c
-                c.filter(regex)
-            return not re.match(regex, c.raw, re.IGNORECASE)
+        if root is not None:
+            paths.discard(None)
+            root._forget_locations(paths)
+            if root._files is not None:
+                root._files.dirty.update(paths)
 
-        self.content = [ c for c in self.content if ff(regex, c) ]
 
+    def named(self, name):
+        """ Return list of direct children with this name (case-insensitive), in document order.
+
+        Uses index, which is built on first call and updated when content is changed via add(), insert(),
+        delete(), extend() or filter(). Returned list must not be modified.
+        """
+        if not self._content:
+            return ()
+        if self._names is None:
+            self._names = dict()
+            for c in self._content:
+                self._names.setdefault(c.name.lower(), list()).append(c)
+        return self._names.get(name.lower(), ())
 
     def children(self, name=None, recursive=False):
-        if self.content:
-            for c in self.content:
-                if name:
-                    # filter by cmd/section
-                    if c.name.lower() == name.lower():
-                        yield c
-                else:
-                    # print "YIELD", c, repr(c.raw), c.name
+        if name and not recursive:
+            # copy, so caller can delete nodes while iterating
+            return iter(tuple(self.named(name)))
+        return self._children(name, recursive)
+
+    def _children(self, name, recursive):
+        name = name.lower() if name else None
+        stack = [ iter(self._content or ()) ]
+        while stack:
+            for c in stack[-1]:
+                if name is None or c.name.lower() == name:
                     yield c
+                if recursive and c._content:
+                    stack.append(iter(c._content))
+                    break
+            else:
+                stack.pop()
 
-                if recursive and c.content:
-                    for subc in c.children(name=name, recursive=recursive):
-                        yield subc
+    def traverse(self, depth=0, end=True):
+        """ Generator of (event, node, depth) for all content of node (not node itself), depth first, without recursion
+
+        event is 'start' (before content of node) or 'end' (after content, only if end=True). depth of content of
+        this node is depth, of their content depth+1 and so on. Send SKIP (generator.send()) in response to 'start' to
+        skip content of node, then there is no 'end' for this node.
+        """
+        stack = [ (iter(self._content or ()), depth, None) ]
+        while stack:
+            content, d, parent = stack[-1]
+            for c in content:
+                skip = yield ('start', c, d)
+                if skip == SKIP:
+                    continue
+                if c._content:
+                    stack.append((iter(c._content), d + 1, c))
+                    break
+                if end:
+                    yield ('end', c, d)
+            else:
+                stack.pop()
+                if end and parent is not None:
+                    yield ('end', parent, d - 1)
+
+    def walk(self, pre=None, post=None, depth=0):
+        """ Visit all content of node depth first, without recursion (deep nesting is not limited by recursion limit)
+
+        :param pre: pre(node, depth) is called before content of node. If it returns SKIP, content of node and post()
+            for node are skipped. If it returns STOP, walk ends.
+        :param post: post(node, depth) is called after content of node. If it returns STOP, walk ends.
+        :param depth: depth of content of this node
+        :return: True if walk was stopped
+        """
+        walker = self.traverse(depth, end=post is not None)
+        result = None
+        while True:
+            try:
+                event, node, d = walker.send(result)
+            except StopIteration:
+                return False
+            visitor = pre if event == 'start' else post
+            result = visitor(node, d) if visitor is not None else None
+            if result == STOP:
+                walker.close()
+                return True
 
     def first(self, name, recursive=False):
         """ Wrapper for children to get only first element or None
@@ -191,120 +870,478 @@ class Node(object):
         :param recursive:
         :return: Element or None
         """
+        if not recursive:
+            named = self.named(name)
+            return named[0] if named else None
         try:
             return next(self.children(name, recursive=recursive))
         except StopIteration:
             return None
 
+    def select(self, selector):
+        """ Return generator of nodes matching selector, in document order
+
+        :param selector: e.g. '//VirtualHost[args~=":443"][ServerName=example.com]//SSLCertificateFile',
+            see Selector. Compiled selectors are cached.
+        """
+        return compile_selector(selector).select(self)
+
+    def select_first(self, selector):
+        """ Return first node matching selector or None """
+        return compile_selector(selector).first(self)
+
     def extend(self, n):
         # for c in n.content:
         #     self.content.append(c)
-        self.content.extend(n.content)
+        if n._content:
+            self.content.extend(n._content)
+            self._adopt(n._content)
+            self._added(n._content)
+            self._changed()
 
-    def read_file(self, filename):
+    def read_file(self, filename, cache=None, parallel=None, stats=None, reader=None, comments=True, cancel=None):
+        """ Read config file and all included files
 
-        # read file
+        Files included by Include/IncludeOptional are read in sorted order (as apache does) and their nodes are
+        placed right after Include node.
+        :param cache: ParseCache or cache directory. Files with matching cache entry are not parsed again.
+        :param parallel: number of threads (or concurrent.futures Executor) to read and tokenize files
+            of one Include concurrently. Nodes are created in same order as without it.
+        :param stats: True or LoadStats to collect per-file and glob statistics, see load_stats()
+        :param reader: 'text' (default) or 'mmap' to memory-map files and decode only lines which are kept
+            (or function like read_text_records())
+        :param comments: if False, comment-only lines are skipped (and such tree can not be saved)
+        :param cancel: threading.Event, if it is set, LoadCancelled is raised before next file is read
+        """
+        if isinstance(cache, str):
+            cache = ParseCache(cache)
+        if stats is True:
+            stats = LoadStats()
+        if self._memo:
+            self._memo.pop('locations', None)
+
+        if parallel is True or (parallel and isinstance(parallel, int)):
+            with ThreadPoolExecutor(None if parallel is True else parallel) as executor:
+                return self.read_file(filename, cache=cache, parallel=executor, stats=stats, reader=reader,
+                                      comments=comments, cancel=cancel)
+
+        self._files = FileIndex()
+        if reader is not None:
+            self._files.reader = _readers[reader] if isinstance(reader, str) else reader
+        self._files.comments = comments
+        self._files.cancel = cancel
+        if stats is None:
+            self._files.main = self._load(filename, None, cache, parallel or None, self._files)
+            return
+
+        self._files.stats = stats
+        start = time.perf_counter()
+        hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+        self._files.main = self._load(filename, None, cache, parallel or None, self._files)
+        stats.time += time.perf_counter() - start
+        if cache:
+            stats.cache_hits += cache.hits - hits
+            stats.cache_misses += cache.misses - misses
+
+    def load_stats(self):
+        """ Return LoadStats of read_file(stats=...) or None """
+        if self._files is None:
+            return None
+        return self._files.stats
+
+    def _load(self, filename, include, cache, executor, files, result=None):
+        """ Read file (or use result of read_stat_records()) into this node, register it in files
+
+        :return: LoadedFile
+        """
+        if files.cancel is not None and files.cancel.is_set():
+            raise LoadCancelled('loading of {} is cancelled'.format(filename))
+
+        # all nodes of file share one path string
+        filename = sys.intern(filename)
+        self.path = filename
+
+        stats = files.stats
+        if stats is None:
+            return self._load_file(filename, include, cache, executor, files, result)
+
+        fs = stats.start_file(filename, None if include is None else include.raw)
+        try:
+            loaded = self._load_file(filename, include, cache, executor, files, result, fs)
+        except OSError as e:
+            stats.end_file(fs, e)
+            raise
+        fs.bytes = loaded.stat[1]
+        stats.end_file(fs)
+        return loaded
+
+    def _load_file(self, filename, include, cache, executor, files, result, fs=None):
+        if result is None and cache is None:
+            # stream file, without list of records
+            stat, stream = files.reader(filename, files.comments)
+            try:
+                loaded = LoadedFile(filename, stat, include)
+                files.add(loaded)
+                records = stream if fs is None else _counted(stream, fs)
+                self._build(filename, records, cache, executor, files, loaded)
+            finally:
+                # close file
+                stream.close()
+        else:
+            stat, records = result or read_stat_records(filename, cache, files.reader, files.comments)
+            loaded = LoadedFile(filename, stat, include)
+            files.add(loaded)
+            if fs is not None:
+                records = _counted(records, fs)
+            self._build(filename, records, cache, executor, files, loaded)
+
+        loaded.nodes = list(self._content or ())
+        return loaded
+
+    def _build(self, filename, records, cache=None, executor=None, files=None, owner=None):
+        """ Create nodes from records of read_records() """
         root = self
         parent = root
-        self.path = filename
+        # new nodes are appended directly, indexes will be built on first lookup
+        self._names = None
+        self._vhosts = None
 
-        line = 0
+        prev_line = 0
+        for line, l, token in records:
+            kind = token[0]
+            gap = line - prev_line - 1
+            prev_line = line
+            if kind == BLANK:
+                # blank lines at end of file
+                if owner is not None:
+                    owner.tail = gap + 1
+                continue
+            if '\n' in l:
+                # continued line
+                prev_line += l.count('\n')
 
-        with open(filename) as fh:
-            for l in fh.readlines():
-                line += 1
-                l = l.strip()
-                if not l:
-                    continue
-                node = Node(raw=l, parent = parent, path = filename, line = line)
-
-                if node.is_open():
-                    parent.add(node)
-                    parent = node
-                elif node.is_close():
-                    # do not add closing tags
-                    # parent.add(node)
+            if kind == CLOSE:
+                # do not add closing tags, but keep them for serialize()
+                if parent is not root:
+                    parent._close = (line, l, gap)
                     parent = parent.parent
-                else:
-                    parent.add(node)
-
-                if self.includes and node.name.lower() in ['include', 'includeoptional']:
-                    basedir = os.path.dirname(filename)
-                    fullpath = os.path.join(basedir, node.args)
-                    if os.path.isdir(fullpath):
-                        fullpath = os.path.join(fullpath, '*')
-                        
-                    include_files = glob.glob(os.path.join(fullpath))
-                    for path in include_files:
-                        try:
-                            sub_node = Node(path)
-                            self.extend(sub_node)
-                        except FileNotFoundError as e:
-                            print("WARN failed to import {} ({})".format(path, l))
-                        #self.content.extend(sub_node.content)
+                continue
+
+            node = Node(None, l, parent, None, None, filename, line, True, token)
+            node._gap = gap
+            if parent._content is None:
+                parent._content = [node]
+            else:
+                parent._content.append(node)
+            parent.last_child = node
+
+            if kind == OPEN:
+                parent = node
+            elif self.includes and kind == DIRECTIVE and token[2].lower() in _include_cmds:
+                self._include(node, parent, cache, executor, files, owner)
+
+    def _include(self, node, parent, cache, executor, files, owner):
+        """ Read files included by Include/IncludeOptional node, add them to parent after node """
+        if files.stats is None:
+            paths = include_files(node.path, node.args)
+        else:
+            start = time.perf_counter()
+            paths = include_files(node.path, node.args)
+            files.stats.add_glob(node, len(paths), time.perf_counter() - start)
+        loaded_files = list()
+        files.includes[id(node)] = (node, parent, loaded_files)
+        owner.includes.append(node)
+
+        if executor is not None:
+            # read and tokenize all files at once, nodes are created here in order
+            futures = [ executor.submit(read_stat_records, path, cache, files.reader, files.comments)
+                        for path in paths ]
+
+        for i, path in enumerate(paths):
+            sub_node = Node()
+            try:
+                result = futures[i].result() if executor is not None else None
+                loaded_files.append(sub_node._load(path, node, cache, executor, files, result))
+            except FileNotFoundError as e:
+                print("WARN failed to import {} ({})".format(path, node.raw))
+                continue
+            if sub_node._content:
+                # not extend(), nodes keep their path
+                parent.content.extend(sub_node._content)
+                for c in sub_node._content:
+                    c.parent = parent
+
+    def loaded_files(self):
+        """ Return list of all files loaded by read_file() (main config and all included files) """
+        if self._files is None:
+            return []
+        return self._files.paths()
+
+    def reload(self, cache=None):
+        """ Re-read only files which are added, removed or modified since read_file() (or last reload())
+
+        Include patterns are expanded again, files are checked by inode, size and mtime. Nodes of changed files
+        are replaced in place, nodes of other files are not touched. If main config file is changed, it is
+        read again with all includes.
+        :return: list of changed (added, removed or modified) files
+        """
+        files = self._files
+        if files is None:
+            raise MyException('reload() needs node loaded with read_file()')
+        if isinstance(cache, str):
+            cache = ParseCache(cache)
+
+        if file_stat(os.stat(self.path)) != files.main.stat:
+            self.content = None
+            self.read_file(self.path, cache=cache, stats=files.stats, reader=files.reader, comments=files.comments)
+            return [self.path]
+
+        changed = list()
+        # id(parent) -> (parent, {id(Include node): (old nodes, new nodes)})
+        replace = dict()
+
+        for include, parent, loaded_files in list(files.includes.values()):
+            if id(include) not in files.includes:
+                # file with this include is removed or changed
+                continue
+
+            old = dict((loaded.path, loaded) for loaded in loaded_files)
+            new_files = list()
+            modified = False
+
+            for path in include_files(include.path, include.args):
+                loaded = old.pop(path, None)
+                if loaded is not None:
+                    try:
+                        stat = file_stat(os.stat(path))
+                    except OSError:
+                        stat = None
+                    if stat == loaded.stat:
+                        new_files.append(loaded)
+                        continue
+                    files.remove(loaded)
+
+                modified = True
+                changed.append(path)
+                sub_node = Node()
+                try:
+                    new_files.append(sub_node._load(path, include, cache, None, files))
+                except FileNotFoundError as e:
+                    print("WARN failed to import {} ({})".format(path, include.raw))
+
+            for loaded in old.values():
+                modified = True
+                changed.append(loaded.path)
+                files.remove(loaded)
+
+            if modified:
+                files.includes[id(include)] = (include, parent, new_files)
+                old_nodes = [ n for loaded in loaded_files for n in loaded.nodes ]
+                new_nodes = [ n for loaded in new_files for n in loaded.nodes ]
+                # not include.parent: Include node may be deleted, its files are still in parent
+                replace.setdefault(id(parent), (parent, dict()))[1][id(include)] = (old_nodes, new_nodes)
+
+        for parent, runs in replace.values():
+            parent._replace_runs(runs)
+        self._forget_locations(changed)
 
+        return changed
+
+    def _replace_runs(self, runs):
+        """ Replace nodes of included files in content in one pass
+
+        :param runs: id(Include node) -> (old nodes, new nodes). New nodes are placed after Include node
+            (or where first old node was, if Include node was deleted)
+        """
+        owner = dict()
+        for include_id, (old_nodes, new_nodes) in runs.items():
+            for n in old_nodes:
+                owner[id(n)] = include_id
+
+        content = list()
+        added = list()
+        placed = set()
+        for c in self._content or ():
+            include_id = owner.get(id(c))
+            if include_id is None:
+                content.append(c)
+                include_id = id(c) if id(c) in runs else None
+            if include_id is not None and include_id not in placed:
+                placed.add(include_id)
+                content.extend(runs[include_id][1])
+                added.extend(runs[include_id][1])
+
+        # not content setter: reload does not make files dirty
+        self._content = content
+        self._content_replaced()
+        self._added(added, appended=False)
+        self._invalidate()
+
+    def watch(self, interval=1, callback=None, stop=None, cache=None):
+        """ Poll files every interval seconds and reload() changed files
+
+        :param callback: called as callback(node, changed_files) after each reload with changes
+        :param stop: threading.Event, watch() returns when it is set. Without it, watch() runs forever.
+        """
+        while stop is None or not stop.is_set():
+            changed = self.reload(cache=cache)
+            if changed and callback is not None:
+                callback(self, changed)
+            if stop is not None:
+                stop.wait(interval)
+            else:
+                time.sleep(interval)
 
     def save_file(self):
+        """ Save file of this node (with changes and with all other nodes of this file) """
+        root = self.get_root()
+        if root._files is not None and self.path in root._files.files:
+            root.save_all([self.path])
+            return
         parent = self.parent
         parent.write_file(parent.path)
 
+    def dirty_files(self):
+        """ Return list of files changed after read_file() """
+        if self._files is None:
+            return []
+        return sorted(self._files.dirty)
+
+    def file_nodes(self, path):
+        """ Return list of top-level nodes of loaded file (nodes of other files are not included) """
+        if path == self.path:
+            top = self._content or ()
+        else:
+            loaded = self._files.files.get(path)
+            if not loaded:
+                return []
+            entry = self._files.includes.get(id(loaded[0].include))
+            if entry is None:
+                return [ n for n in loaded[0].nodes if n.path == path and n.parent is not None ]
+            # nodes of included file are in content of Include node parent, with nodes inserted or replaced after load
+            return top_nodes(entry[1]._content or [], loaded[0].nodes, path)
+        return [ n for n in top if n.path == path and n.parent is not None ]
+
+    def save_all(self, paths=None):
+        """ Write all dirty files (or only files in paths). Unchanged files are not touched.
+
+        Each file is written atomically (temporary file, fsync, rename).
+        :return: list of written files
+        """
+        files = self._files
+        if files is None:
+            raise MyException('save_all() needs node loaded with read_file()')
+        if not files.comments:
+            raise MyException('config is loaded with comments=False, saving it would drop comments')
+        if paths is None:
+            paths = sorted(files.dirty)
+
+        written = list()
+        for path in paths:
+            if path in files.files:
+                data = ''.join(node.serialize(path) for node in self.file_nodes(path))
+                write_atomic(path, data + '\n' * files.files[path][0].tail)
+                files.update_stat(path)
+                written.append(path)
+            files.dirty.discard(path)
+        return written
+
     def write_file(self, filename):
-        if filename != '-':        
-            with open(filename, 'w') as fh:
-                self.dump(fh)
+        if filename != '-':
+            write_atomic(filename, self.serialize())
         else:
-            self.dump()
+            sys.stdout.write(self.serialize())
 
     def vdump(self, depth=0):
-        newdepth = depth + 1
-        if self.content:
-            for d in self.content:
-                if d.is_open():
-                    print(self.prefix*depth + d.get_opentag())
-                    # print "# dump", d.section, "depth", newdepth
-                    d.vdump(newdepth)
-                    print(self.prefix*depth + d.get_closetag())
-                else:
-                    print(self.prefix*depth + str(d))
-        else:
-            # print "NOCONTENT:", self.raw # NOCONTENT
-            pass
+        def pre(node, d):
+            print(self.prefix*d + (node.get_opentag() if node.is_open() else str(node)))
 
+        def post(node, d):
+            if node.is_open():
+                print(self.prefix*d + node.get_closetag())
 
+        self.walk(pre, post, depth)
 
-    def dump(self, fh=sys.stdout, depth=0):
+    def dump(self, fh=sys.stdout, depth=0, path=None):
+        """ Write node and its content in unified format. If path is set, only nodes from this file are written. """
+        write = fh.write
+        prefix = self.prefix
 
-        if self.cmd:
-            fh.write("{}{} {}{}\n".format(self.prefix*depth, self.cmd, self.args, self.suffix))
-        elif self.section:
-            # last section element should have depth-1
-            if self.section.startswith('/'):
-                line_depth = depth-1
-            else:
-                line_depth = depth
+        def pre(node, d):
+            if path is not None and node.path != path:
+                return SKIP
+            write(node.format_line(d))
+
+        def post(node, d):
+            if node._section:
+                write("{}</{}>\n".format(prefix*d, node._section))
+
+        write(self.format_line(depth))
+        # only root node has cmd=None, section=None but has children
+        self.walk(pre, post, depth + 1 if self._section else depth)
+        if self._section:
+            post(self, depth)
+
+    def format_line(self, depth=0):
+        """ Return own line of node in unified format (as dump() writes it) """
+        if self._cmd:
+            return "{}{} {}{}\n".format(self.prefix*depth, self._cmd, self._args, self.suffix)
+        if self._section:
+            if self._args:
+                return "{}<{} {}>{}\n".format(self.prefix*depth, self._section, self._args, self.suffix)
+            return "{}<{}>{}\n".format(self.prefix*depth, self._section, self.suffix)
+        if self.suffix is not None:
+            return self.prefix*depth + self.suffix + '\n'
+        if self.raw is not None:
+            return '\n'
+        return ''
+
+    def serialize(self, path=None, depth=0):
+        """ Return config text of node with all its content, keeping original text of unchanged lines
+
+        Nodes read from file and not changed are written as they are in file (with indentation, blank lines
+        and closing tags), only new or changed nodes are formatted as in dump(). If path is set, only nodes from this
+        file are written.
+        """
+        out = list()
+        append = out.append
+        prefix = self.prefix
+        # (node, depth, True if closing tag of section)
+        stack = [(self, depth, False)]
+        while stack:
+            node, depth, closing = stack.pop()
+
+            if closing:
+                close = node._close
+                if close is not None and not node._modified:
+                    append('\n' * close[2] + close[1] + '\n')
+                else:
+                    append("{}</{}>\n".format(prefix*depth, node._section))
+                continue
 
-            if self.args:
-                fh.write("{}<{} {}>{}\n".format(self.prefix*line_depth, self.section, self.args, self.suffix))
+            if node._gap:
+                append('\n' * node._gap)
+            if node.line is not None and not node._modified:
+                append(node.raw + '\n')
             else:
-                fh.write("{}<{}>{}\n".format(self.prefix*line_depth, self.section, self.suffix))
+                append(node.format_line(depth))
 
-            if self.children:
-                for d in self.content:
-                    d.dump(fh, depth+1)
-                fh.write("{}</{}>\n".format(self.prefix*line_depth, self.section))
-        else:
-            # neither cmd, nor section            
-            if self.suffix is not None:
-                fh.write(self.prefix*depth + self.suffix + '\n')
+            if node._section:
+                stack.append((node, depth, True))
+                child_depth = depth + 1
             else:
-                if self.raw is not None:
-                    fh.write('\n')
-            
-            # only root node has cmd=None, section=None but has children
-            if self.children:
-                for d in self.content:
-                    d.dump(fh, depth)
-        return
+                # root
+                child_depth = depth
+
+            if node._content:
+                for c in reversed(node._content):
+                    if path is None or c.path == path:
+                        stack.append((c, child_depth, False))
+
+        if self._files is not None and self._files.main is not None and path in (None, self.path):
+            # root: blank lines at end of main file
+            append('\n' * self._files.main.tail)
+        return ''.join(out)
 
     def __str__(self):
         if self.name is not None:
@@ -314,29 +1351,394 @@ class Node(object):
 
     def delete(self):
         """ Delete myself from parent content """
+        self._changed()
         self.parent.content.remove(self)
+        self.parent._removed(self)
+        self.parent = None
 
     def yield_vhost(self, hostname, arg=None):
+        """ Yield all vhosts (direct children) with hostname in ServerName/ServerAlias
 
-        def get_all_hostnames(vhost):
-            names = list()
-            try:
-                servername = next(vhost.children('ServerName')).args
-                names.append(servername)
-            except StopIteration:
-                pass
+        Hostnames are matched case-insensitive via index, which is built on first lookup
+        and updated by add(), insert(), delete() and edits of ServerName/ServerAlias nodes.
+        :param hostname: e.g. www.example.com
+        :param arg: if set, only vhosts with this string in args (e.g. '*:443')
+        """
+        if self._vhosts is None:
+            self._vhosts = dict()
+            for vhost in self.children('<VirtualHost>'):
+                self._index_vhost(vhost)
 
-            for alias in vhost.children('ServerAlias'):
-                names.extend(alias.args.split(' '))
-            return names
-        
-        for vhost in self.children('<VirtualHost>'):
+        for vhost in tuple(self._vhosts.get(hostname.lower(), ())):
             if arg and not arg in vhost.args:
                 continue
-            if hostname in get_all_hostnames(vhost):
-                yield vhost
-        # raise VhostNotFound('Vhost args: {} host: {} not found'.format(arg, hostname))
+            yield vhost
 
     def find_vhost(self, hostname, arg=None):
-        return next(self.yield_vhost(hostname=hostname, arg=arg))
+        for vhost in self.yield_vhost(hostname=hostname, arg=arg):
+            return vhost
+        raise VhostNotFound('Vhost args: {} host: {} not found'.format(arg, hostname))
+
+    def effective(self, vhost, env=None):
+        """ Return EffectiveConfig of vhost in this root: server level directives overridden by vhost level ones
+
+        Result is memoized until vhost or server level directives are changed.
+        :param vhost: vhost node or hostname (see find_vhost())
+        :param env: dict of environment variables for ${VAR} which are not Define'd, e.g. APACHE_LOG_DIR
+        """
+        if isinstance(vhost, str):
+            vhost = self.find_vhost(vhost)
+
+        server = self._server_scope()
+        if vhost._memo is None:
+            vhost._memo = dict()
+        cached = vhost._memo.get('effective')
+        if cached is not None and cached[0] is server and cached[1] == env:
+            return cached[2]
+        config = EffectiveConfig(vhost, server, env)
+        vhost._memo['effective'] = (server, dict(env) if env else env, config)
+        return config
+
+    def locate(self, path, line):
+        """ Return node on line of file path (or innermost section which contains line), or None (for root)
+
+        Uses (file, line) index, which is built on first call and updated (only for changed files) on next call after
+        tree is changed. Lookup is binary search.
+        """
+        if self._memo is None:
+            self._memo = dict()
+        locations = self._memo.get('locations')
+        if locations is None:
+            locations = self._memo['locations'] = LocationIndex(self)
+        return locations.find(path, line)
+
+    def locate_message(self, text):
+        """ Return list of (path, line, node) for each 'line N of PATH' in text, e.g. in apachectl configtest output:
+        'AH00526: Syntax error on line 12 of /etc/apache2/sites-enabled/example.conf:' """
+        return [ (path, line, self.locate(path, line)) for path, line in parse_locations(text) ]
+
+    def _server_scope(self):
+        """ Return memoized ServerScope of this root """
+        if self._memo is None:
+            self._memo = dict()
+        server = self._memo.get('server')
+        if server is None:
+            server = self._memo['server'] = ServerScope(self)
+        return server
+
+    def validate(self, env=None, server_root=None, workers=16, stats=None):
+        """ Check that SSL certificates and keys, DocumentRoot and log directories exist and are accessible (in thread
+        pool) and that there are no duplicate ServerName/ServerAlias in vhosts with same address.
+
+        :param env: dict for ${VAR} which are not Define'd, e.g. APACHE_LOG_DIR
+        :return: list of Finding (code, message, node, path, line)
+        """
+        return validate(self, env=env, server_root=server_root, workers=workers, stats=stats)
+
+    def view(self, modules=None, defines=None, version=None):
+        """ Return ConditionalView of this tree: only active <IfModule>, <IfDefine> and <IfVersion> sections
+
+        Views are cached until tree is changed.
+        :param modules: names of loaded modules ('ssl', 'mod_ssl.c' or 'ssl_module'), by default modules from
+            LoadModule directives which are not in inactive sections
+        :param defines: names defined before Define directives (as with -D), UnDefine and Define in active sections
+            change them in document order
+        :param version: apache version (e.g. '2.4.41'), if None all <IfVersion> sections are active
+        """
+        if self._memo is None:
+            self._memo = dict()
+        if modules is not None:
+            modules = frozenset(module_id(m) for m in modules)
+        defines = frozenset(defines or ())
+        version = None if version is None else parse_version(version)
+
+        views = self._memo.setdefault('views', dict())
+        key = (modules, defines, version)
+        view = views.get(key)
+        if view is None:
+            loaded, defined = conditions(self, modules, defines, version)
+            view = views[key] = ConditionalView(self, loaded, defined, version, views)
+        return view
+
+    def digest(self):
+        """ Return hash (bytes) of node and all its content, comments and formatting are ignored. Hashes are
+        memoized per node until node or its content is changed. """
+        return digest(self)
+
+    def diff(self, other):
+        """ Return list of Change (added, removed or modified nodes) from this node to other, e.g. from loaded
+        config to new one. Subtrees with same digest are skipped. """
+        return diff(self, other)
+
+    def freeze(self):
+        """ Return FrozenTree: read-only copy of this node and its content in one compact buffer """
+        return freeze(self)
+
+    def batch(self):
+        """ Return new Batch, e.g. with root.batch() as b: ... """
+        return Batch()
+
+
+class _BatchOps(object):
+    """ Queued changes of one content list """
+    __slots__ = ('parent', 'removed', 'inserts')
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.removed = dict() # id(node) -> None (delete) or list of new nodes (replace)
+        self.inserts = list() # (list of anchors, list of new nodes)
+
+
+class Batch(object):
+    """ Collect inserts, deletes and replacements of many nodes and apply them in one pass per content list
+
+    Nothing is changed until apply() (called at end of with block, if there was no exception), so it's safe
+    to queue changes while iterating children() in any way. insert() finds anchors same way as Node.insert(),
+    but in content as it was before apply().
+    """
+    def __init__(self):
+        self._ops = dict() # id(parent) -> _BatchOps
+        self.summary = None # result of last apply()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.apply()
+
+    @staticmethod
+    def _nodes(child):
+        if isinstance(child, (str, Node)):
+            child = [child]
+        return [ Node(raw=x) if isinstance(x, str) else x for x in child ]
+
+    def _parent_ops(self, parent):
+        ops = self._ops.get(id(parent))
+        if ops is None:
+            ops = self._ops[id(parent)] = _BatchOps(parent)
+        return ops
+
+    def _remove(self, node, replacement):
+        if node.parent is None:
+            raise ArgumentError('{!r} has no parent'.format(node))
+        ops = self._parent_ops(node.parent)
+        if id(node) in ops.removed:
+            raise ArgumentError('{!r} is already deleted or replaced in this batch'.format(node))
+        ops.removed[id(node)] = replacement
+
+    def insert(self, parent, child, after=None):
+        """ Queue parent.insert(child, after), return first new node """
+        nodes = self._nodes(child)
+        if isinstance(after, (str, Node)):
+            after = [after]
+        self._parent_ops(parent).inserts.append((after or (), nodes))
+        return nodes[0]
+
+    def delete(self, node):
+        """ Queue node.delete() """
+        self._remove(node, None)
+
+    def replace(self, node, child):
+        """ Queue replacement of node with child (raw line, Node or list of them), return first new node """
+        nodes = self._nodes(child)
+        self._remove(node, nodes)
+        return nodes[0]
+
+    def apply(self):
+        """ Apply all queued changes
+
+        :return: dict with number of inserted, deleted and replaced nodes, number of changed content lists
+            (parents) and list of changed files
+        """
+        summary = dict(inserted=0, deleted=0, replaced=0, parents=0, files=set())
+        ops_list = list(self._ops.values())
+        self._ops = dict()
+        for ops in ops_list:
+            self._apply(ops, summary)
+        summary['files'] = sorted(summary['files'])
+        self.summary = summary
+        return summary
+
+    def _apply(self, ops, summary):
+        parent = ops.parent
+        content = parent._content or []
+        removed = ops.removed
+
+        # anchor names are resolved to last node with this name via name index, then all anchors are found in one pass
+        inserts = list()
+        anchor_ids = set()
+        for after, nodes in ops.inserts:
+            anchors = list()
+            for a in after:
+                if not isinstance(a, Node):
+                    named = parent.named(a)
+                    if not named:
+                        continue
+                    a = named[-1]
+                anchors.append(a)
+                anchor_ids.add(id(a))
+            inserts.append((anchors, nodes))
+        positions = dict() # id(node) -> index in content
+        if anchor_ids:
+            for i, c in enumerate(content):
+                if id(c) in anchor_ids:
+                    positions[id(c)] = i
+
+        after_index = dict() # index in content -> new nodes to insert after it
+        tail = list()
+        for anchors, nodes in inserts:
+            idx = None
+            for a in reversed(anchors):
+                idx = positions.get(id(a))
+                if idx is not None:
+                    break
+            # new nodes belong to file of anchor
+            if idx is None:
+                parent._adopt(nodes)
+                tail.extend(nodes)
+            else:
+                content[idx]._adopt(nodes)
+                after_index.setdefault(idx, list()).extend(nodes)
+            summary['inserted'] += len(nodes)
+
+        paths = set() # changed files
+        if removed or after_index:
+            new_content = list()
+            added = list()
+            for i, c in enumerate(content):
+                replacement = removed.get(id(c), False) if removed else False
+                if replacement is False:
+                    new_content.append(c)
+                else:
+                    paths.add(c.path)
+                    c.parent = None
+                    if replacement is None:
+                        summary['deleted'] += 1
+                    else:
+                        c._adopt(replacement)
+                        new_content.extend(replacement)
+                        added.extend(replacement)
+                        summary['replaced'] += 1
+                if i in after_index:
+                    new_content.extend(after_index[i])
+                    added.extend(after_index[i])
+            new_content.extend(tail)
+            added.extend(tail)
+            parent._content = new_content
+            # indexes are rebuilt on next lookup
+            parent._content_replaced()
+            parent._added(added)
+        else:
+            # only appended, indexes are updated
+            added = tail
+            if parent._content is None:
+                parent._content = list()
+            parent._content.extend(tail)
+            parent._added(tail)
+        if tail:
+            parent.last_child = tail[-1]
+
+        paths.update(n.path for n in added)
+        paths.discard(None)
+        root = parent._invalidate()
+        root._forget_locations(paths)
+        if root._files is not None:
+            root._files.dirty.update(paths)
+        summary['files'].update(paths)
+        summary['parents'] += 1
+
+def iterparse(filename, includes=True, comments=False, parent=None):
+    """ Stream config file line by line (following includes) without building tree
+
+    Yields (event, node) tuples. event is 'start' (section opened), 'end' (section closed, node is same as in 'start'),
+    'directive' or 'comment' (only if comments=True). Nodes are not added to any tree: node.parent is enclosing
+    section node (or parent), and section nodes have no content. Memory use does not depend on config size.
+    """
+    filename = sys.intern(filename)
+    stack = [parent]
+    with open(filename) as fh:
+        for line, raw, token in read_records(fh):
+            kind = token[0]
+
+            if kind == CLOSE:
+                if len(stack) > 1:
+                    yield ('end', stack.pop())
+                continue
+
+            if kind == BLANK:
+                continue
+            if kind == COMMENT:
+                if comments:
+                    yield ('comment', Node(None, raw, stack[-1], None, None, filename, line, True, token))
+                continue
+
+            node = Node(None, raw, stack[-1], None, None, filename, line, True, token)
+            if kind == OPEN:
+                yield ('start', node)
+                stack.append(node)
+                continue
+
+            yield ('directive', node)
+            if includes and token[2].lower() in _include_cmds:
+                for path in include_files(filename, node.args):
+                    try:
+                        for event in iterparse(path, includes=includes, comments=comments, parent=stack[-1]):
+                            yield event
+                    except FileNotFoundError as e:
+                        print("WARN failed to import {} ({})".format(path, raw))
+
+    # sections not closed in this file
+    while len(stack) > 1:
+        yield ('end', stack.pop())
+
+
+def iter_vhosts(filename, includes=True):
+    """ Stream config file, yield each <VirtualHost> node with all its content, one at a time
+
+    Only one vhost is in memory at a time (unless caller keeps references).
+    """
+    vhost = None
+    for event, node in iterparse(filename, includes=includes, comments=True):
+        if vhost is None:
+            if event == 'start' and node.is_vhost():
+                vhost = node
+        elif event == 'end':
+            if node is vhost:
+                yield vhost
+                vhost = None
+        else:
+            node.parent.add(node)
+
+
+async def aload(filename, includes=True, executor=None, **kwargs):
+    """ Load config like Node(filename) in executor thread, without blocking event loop
+
+    If awaiting task is cancelled, loading thread stops before next file.
+    :param executor: concurrent.futures Executor (default executor of loop if None)
+    :param kwargs: other arguments for read_file(), e.g. cache or reader
+    :return: root Node
+    """
+    cancel = threading.Event()
+    root = Node(includes=includes)
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(executor, functools.partial(root.read_file, filename, cancel=cancel, **kwargs))
+    except asyncio.CancelledError:
+        cancel.set()
+        raise
+    return root
+
+
+async def aload_many(filenames, limit=8, return_exceptions=False, **kwargs):
+    """ Load many independent configs with aload(), at most limit at same time
+
+    :return: list of root Nodes in same order as filenames (or exceptions, if return_exceptions is True)
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def load(filename):
+        async with semaphore:
+            return await aload(filename, **kwargs)
 
+    return await asyncio.gather(*[ load(filename) for filename in filenames ], return_exceptions=return_exceptions)
@@ -0,0 +1,119 @@
+import os
+import sys
+import marshal
+import hashlib
+
+
+class ParseCache(object):
+    """ On-disk cache of tokenized config files
+
+    Each config file has one entry in cache directory, entry is valid while path, inode, size, mtime_ns
+    and parser version of file are same. When total size of entries exceeds max_size, least recently
+    used entries are removed.
+    """
+
+    # python specific, because marshal format may change between python versions
+    tag = '{}-{}'.format(sys.implementation.cache_tag, marshal.version)
+
+    def __init__(self, path, max_size=64*1024*1024):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None # total size of entries, calculated on first store()
+        os.makedirs(path, exist_ok=True)
+
+    def entry(self, filename):
+        """ Return path to cache entry for config file """
+        name = hashlib.sha1(os.path.abspath(filename).encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.path, name + '.cache')
+
+    def key(self, filename, version):
+        """ Stat config file and return key for get()/put(). Call it before reading file. """
+        st = os.stat(filename)
+        return (os.path.abspath(filename), st.st_ino, st.st_size, st.st_mtime_ns, version, self.tag)
+
+    def get(self, key):
+        """ Return cached records for key or None """
+        entry = self.entry(key[0])
+        try:
+            with open(entry, 'rb') as fh:
+                stored_key, records = marshal.loads(fh.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+
+        if stored_key != key:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            # for LRU eviction
+            os.utime(entry)
+        except OSError:
+            pass
+        return records
+
+    def put(self, key, records):
+        """ Store records for key (as returned by key()) """
+        entry = self.entry(key[0])
+        if self._size is None:
+            self._size = self.size()
+
+        try:
+            self._size -= os.path.getsize(entry)
+        except OSError:
+            pass
+
+        tmp = '{}.{}.tmp'.format(entry, os.getpid())
+        try:
+            with open(tmp, 'wb') as fh:
+                fh.write(marshal.dumps((key, records)))
+            os.replace(tmp, entry)
+        except OSError:
+            # cache is optional, config is parsed anyway
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+
+        self._size += os.path.getsize(entry)
+        if self._size > self.max_size:
+            self.evict()
+
+    def _entries(self):
+        for name in os.listdir(self.path):
+            if name.endswith('.cache'):
+                entry = os.path.join(self.path, name)
+                try:
+                    st = os.stat(entry)
+                except OSError:
+                    continue
+                yield entry, st
+
+    def size(self):
+        """ Total size of cache entries in bytes """
+        return sum(st.st_size for entry, st in self._entries())
+
+    def evict(self, max_size=None):
+        """ Remove least recently used entries until total size is not over max_size """
+        if max_size is None:
+            max_size = self.max_size
+
+        entries = sorted(self._entries(), key=lambda e: e[1].st_mtime_ns)
+        size = sum(st.st_size for entry, st in entries)
+        for entry, st in entries:
+            if size <= max_size:
+                break
+            try:
+                os.unlink(entry)
+            except OSError:
+                continue
+            size -= st.st_size
+        self._size = size
+
+    def clear(self):
+        """ Remove all entries """
+        self.evict(0)
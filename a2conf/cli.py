@@ -0,0 +1,237 @@
+"""
+a2conf command line tool: load config once and answer queries
+
+a2conf /etc/apache2/apache2.conf find_vhost example.com
+a2conf /etc/apache2/apache2.conf children DocumentRoot --vhost example.com
+a2conf /etc/apache2/apache2.conf set DocumentRoot /srv/example --vhost example.com --save
+
+In batch mode each line of stdin is JSON request, each line of stdout is JSON response (in same order):
+{"id": 1, "cmd": "first", "name": "DocumentRoot", "vhost": "example.com"}
+{"id": 1, "result": {"name": "DocumentRoot", "args": "/var/www/example", "path": "...", "line": 7}}
+"""
+import sys
+import json
+import inspect
+import argparse
+
+from . import Node, ParseCache, MyException
+
+# positional arguments of commands in command line mode
+COMMANDS = {
+    'find_vhost': ('hostname', 'arg'),
+    'vhosts': (),
+    'children': ('name',),
+    'first': ('name',),
+    'select': ('selector',),
+    'dump': (),
+    'effective': ('hostname',),
+    'set': ('name', 'args'),
+    'insert': ('raw', 'after'),
+    'delete': ('name',),
+    'save': (),
+    'reload': (),
+    'validate': (),
+}
+
+MUTATIONS = frozenset(['set', 'insert', 'delete'])
+
+
+class CLIError(MyException):
+    pass
+
+
+def node_info(node):
+    if node is None:
+        return None
+    return dict(name=node.name, args=node.args, path=node.path, line=node.line)
+
+
+def section_dump(node):
+    """ Same as examples/ex1_dump.py: dict of sections ('VirtualHost *:80') and directives """
+    data = dict()
+    for ch in node.children():
+        if ch.section and not ch.section.startswith('/'):
+            key = ch.section + ' ' + ch.args if ch.args else ch.section
+            data[key] = section_dump(ch)
+        elif ch.cmd:
+            data[ch.cmd] = ch.args
+    return data
+
+
+class Session(object):
+    """ Loaded config and commands on it. Each do_<cmd> method is command, its arguments are request fields.
+
+    Most commands work on target node: root, vhost (by hostname) and/or first node matching selector in it.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def handle(self, request):
+        """ Run one request (dict with 'cmd' and arguments), return result (JSON-serializable) """
+        request = dict(request)
+        request.pop('id', None)
+        cmd = request.pop('cmd', None)
+        method = getattr(self, 'do_' + cmd, None) if isinstance(cmd, str) else None
+        if method is None:
+            raise CLIError('unknown command {!r}'.format(cmd))
+        try:
+            inspect.signature(method).bind(**request)
+        except TypeError as e:
+            raise CLIError('{}: {}'.format(cmd, e))
+        return method(**request)
+
+    def _target(self, vhost=None, target=None):
+        node = self.root
+        if vhost is not None:
+            node = node.find_vhost(vhost)
+        if target is not None:
+            found = node.select_first(target)
+            if found is None:
+                raise CLIError('nothing matches {!r}'.format(target))
+            node = found
+        return node
+
+    def do_find_vhost(self, hostname, arg=None):
+        vhost = self.root.find_vhost(hostname, arg)
+        info = node_info(vhost)
+        info['hostnames'] = vhost.hostnames()
+        return info
+
+    def do_vhosts(self):
+        result = list()
+        for vhost in self.root.select('//VirtualHost'):
+            info = node_info(vhost)
+            info['hostnames'] = vhost.hostnames()
+            result.append(info)
+        return result
+
+    def do_children(self, name=None, recursive=False, vhost=None, target=None):
+        return [ node_info(c) for c in self._target(vhost, target).children(name, recursive=recursive) ]
+
+    def do_first(self, name, recursive=False, vhost=None, target=None):
+        return node_info(self._target(vhost, target).first(name, recursive=recursive))
+
+    def do_select(self, selector, vhost=None, target=None):
+        return [ node_info(c) for c in self._target(vhost, target).select(selector) ]
+
+    def do_dump(self, vhost=None, target=None):
+        return section_dump(self._target(vhost, target))
+
+    def do_effective(self, hostname, env=None):
+        return self.root.effective(hostname, env=env).as_dict()
+
+    def do_set(self, name, args, vhost=None, target=None):
+        """ Set args of first directive with name in target, add directive if there is no such one """
+        node = self._target(vhost, target)
+        child = node.first(name)
+        if child is None:
+            child = node.insert('{} {}'.format(name, args))
+        else:
+            child.args = args
+        return node_info(child)
+
+    def do_insert(self, raw, after=None, vhost=None, target=None):
+        return node_info(self._target(vhost, target).insert(raw, after=after))
+
+    def do_delete(self, name=None, vhost=None, target=None):
+        """ Delete all children with name from target, or target itself if name is not given """
+        node = self._target(vhost, target)
+        if name is None:
+            if node is self.root:
+                raise CLIError('can not delete root')
+            node.delete()
+            return 1
+        deleted = 0
+        for child in node.children(name):
+            child.delete()
+            deleted += 1
+        return deleted
+
+    def do_validate(self, env=None, server_root=None):
+        return [ f.as_dict() for f in self.root.validate(env=env, server_root=server_root) ]
+
+    def do_save(self):
+        return self.root.save_all()
+
+    def do_reload(self):
+        return self.root.reload()
+
+
+def run_batch(session, stdin, stdout):
+    """ Read JSON requests from stdin (one per line), write JSON responses to stdout. Errors do not stop it. """
+    for line in stdin:
+        if not line.strip():
+            continue
+        response = dict()
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise CLIError('request must be JSON object')
+            response['id'] = request.get('id')
+            response['result'] = session.handle(request)
+        except Exception as e:
+            # any error (e.g. field of wrong type) is response to this request, next requests are answered
+            response['error'] = '{}: {}'.format(type(e).__name__, e)
+        stdout.write(json.dumps(response) + '\n')
+        stdout.flush()
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description='apache2 config query tool')
+    parser.add_argument('config', help='main config file, e.g. /etc/apache2/apache2.conf')
+    parser.add_argument('command', nargs='?', choices=sorted(COMMANDS), help='command (omit with --batch)')
+    parser.add_argument('params', nargs='*', help='arguments of command')
+    parser.add_argument('--batch', default=False, action='store_true',
+                        help='read JSON requests from stdin, write JSON responses to stdout')
+    parser.add_argument('--vhost', help='run command in vhost with this hostname')
+    parser.add_argument('--target', help='run command in first node matching selector')
+    parser.add_argument('-r', '--recursive', default=False, action='store_true', help='for children and first')
+    parser.add_argument('--save', default=False, action='store_true', help='save changed files after command')
+    parser.add_argument('--no-includes', dest='includes', default=True, action='store_false',
+                        help='do not follow Include directives')
+    parser.add_argument('--cache', metavar='DIR', help='use parse cache in this directory')
+    return parser.parse_args(argv)
+
+
+def main(argv=None, stdin=None, stdout=None):
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    args = get_args(argv)
+
+    cache = ParseCache(args.cache) if args.cache else None
+    root = Node(args.config, includes=args.includes, cache=cache)
+    session = Session(root)
+
+    if args.batch:
+        run_batch(session, stdin, stdout)
+        return 0
+
+    if args.command is None:
+        print('command or --batch is required', file=sys.stderr)
+        return 2
+
+    names = COMMANDS[args.command]
+    if len(args.params) > len(names):
+        print('too many arguments for {}'.format(args.command), file=sys.stderr)
+        return 2
+    request = dict(zip(names, args.params))
+    request['cmd'] = args.command
+    for option in ('vhost', 'target'):
+        if getattr(args, option) is not None:
+            request[option] = getattr(args, option)
+    if args.recursive:
+        request['recursive'] = True
+
+    try:
+        result = session.handle(request)
+        if args.save and args.command in MUTATIONS:
+            root.save_all()
+    except (MyException, ValueError) as e:
+        print('{}: {}'.format(type(e).__name__, e), file=sys.stderr)
+        return 1
+    stdout.write(json.dumps(result, indent=4) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import hashlib
+
+DIGEST_SIZE = 16
+
+
+def line_key(node):
+    """ Return normalized line of directive or section ('servername example.com', '<virtualhost> *:80'),
+    None for comments """
+    if node._section is not None:
+        return '<{}> {}'.format(node._section.lower(), node._args or '')
+    if node._cmd is not None:
+        return '{} {}'.format(node._cmd.lower(), node._args or '')
+    if node.parent is None:
+        return '#root'
+    return None
+
+
+def digest(node):
+    """ Return hash of node and all its content (comments, blank lines and formatting are not part of it)
+
+    Hash of each node is memoized (in _memo of node) until node or any of its descendants is changed, so after
+    change only hashes of changed nodes and their ancestors are calculated again.
+    """
+    memo = node._memo
+    if memo and 'digest' in memo:
+        return memo['digest']
+
+    # post-order without recursion: (node, True) after all its content is hashed
+    stack = [ (node, False) ]
+    while stack:
+        n, ready = stack.pop()
+        if not ready:
+            stack.append((n, True))
+            for c in n._content or ():
+                if c._memo is None or 'digest' not in c._memo:
+                    if c._section is not None or c._cmd is not None:
+                        stack.append((c, False))
+            continue
+        h = hashlib.blake2b(line_key(n).encode('utf-8', 'surrogateescape') + b'\0', digest_size=DIGEST_SIZE)
+        for c in n._content or ():
+            if c._section is not None or c._cmd is not None:
+                h.update(c._memo['digest'])
+        if n._memo is None:
+            n._memo = dict()
+        n._memo['digest'] = h.digest()
+    return node._memo['digest']
+
+
+def _match_key(node):
+    """ Key to pair changed sections: name and args, vhosts also by ServerName """
+    key = line_key(node)
+    if node._section is not None and node._section.lower() == 'virtualhost':
+        servername = node.first('ServerName')
+        key = (key, servername.args.lower() if servername is not None else None)
+    return key
+
+
+class Change(object):
+    """ One difference between two trees
+
+    kind is 'added' (new is set), 'removed' (old is set) or 'modified' (own line of node is changed, both are set).
+    Changes inside sections with same line are reported for their content, not for section itself.
+    """
+    __slots__ = ('kind', 'old', 'new')
+
+    def __init__(self, kind, old=None, new=None):
+        self.kind = kind
+        self.old = old
+        self.new = new
+
+    @property
+    def node(self):
+        """ New node, old one for removed """
+        return self.old if self.new is None else self.new
+
+    @property
+    def path(self):
+        return self.node.path
+
+    @property
+    def line(self):
+        return self.node.line
+
+    @property
+    def vhost(self):
+        """ Vhost which is changed (node itself or its enclosing vhost), or None """
+        return self.node.get_vhost()
+
+    def __repr__(self):
+        node = self.node
+        return '<Change {} {!r} {}:{}>'.format(self.kind, line_key(node), node.path, node.line)
+
+
+def diff(old, new):
+    """ Return list of Change from old to new tree
+
+    Subtrees with same digest are skipped without walking them, so on cached hashes cost depends on size of change,
+    not on size of tree. Children are paired by hash first (so moved nodes are not changes), then changed sections
+    by name and args (vhosts also by ServerName), then nodes which are only ones with their name on both sides are
+    'modified', all others are 'removed' and 'added'.
+    """
+    changes = list()
+    if digest(old) == digest(new):
+        return changes
+    if line_key(old) != line_key(new):
+        changes.append(Change('modified', old, new))
+
+    stack = [ (old, new) ]
+    while stack:
+        o, n = stack.pop()
+        pairs = list() # (old, new) sections to compare content
+        old_children = [ c for c in o._content or () if c._section is not None or c._cmd is not None ]
+        new_children = [ c for c in n._content or () if c._section is not None or c._cmd is not None ]
+
+        # same subtrees: common head and tail first, then anywhere
+        head = 0
+        while head < min(len(old_children), len(new_children)) and \
+                digest(old_children[head]) == digest(new_children[head]):
+            head += 1
+        tail = 0
+        while tail < min(len(old_children), len(new_children)) - head and \
+                digest(old_children[-1 - tail]) == digest(new_children[-1 - tail]):
+            tail += 1
+        old_children = old_children[head:len(old_children) - tail]
+        new_children = new_children[head:len(new_children) - tail]
+
+        same = dict()
+        for c in old_children:
+            same.setdefault(digest(c), list()).append(c)
+        new_rest = list()
+        for c in new_children:
+            matched = same.get(digest(c))
+            if matched:
+                matched.pop(0)
+            else:
+                new_rest.append(c)
+        # old nodes left in same are not matched
+        unmatched = set(id(c) for nodes in same.values() for c in nodes)
+        old_rest = [ c for c in old_children if id(c) in unmatched ]
+        if not new_rest and not old_rest:
+            continue
+
+        # changed sections with same line
+        keyed = dict()
+        for c in old_rest:
+            if c._section is not None:
+                keyed.setdefault(_match_key(c), list()).append(c)
+        rest = new_rest
+        new_rest = list()
+        for c in rest:
+            matched = keyed.get(_match_key(c)) if c._section is not None else None
+            if matched:
+                pairs.append((matched.pop(0), c))
+            else:
+                new_rest.append(c)
+        paired = set(id(oc) for oc, nc in pairs)
+        old_rest = [ c for c in old_rest if id(c) not in paired ]
+
+        # only node with this name on both sides
+        old_names = dict()
+        for c in old_rest:
+            old_names.setdefault(c.name.lower(), list()).append(c)
+        new_names = dict()
+        for c in new_rest:
+            new_names.setdefault(c.name.lower(), list()).append(c)
+        modified = set()
+        for name, nodes in new_names.items():
+            if len(nodes) == 1 and len(old_names.get(name, ())) == 1:
+                oc, nc = old_names[name][0], nodes[0]
+                modified.add(id(oc))
+                modified.add(id(nc))
+                changes.append(Change('modified', oc, nc))
+                if oc._content or nc._content:
+                    pairs.append((oc, nc))
+
+        for c in old_rest:
+            if id(c) not in modified:
+                changes.append(Change('removed', old=c))
+        for c in new_rest:
+            if id(c) not in modified:
+                changes.append(Change('added', new=c))
+
+        stack.extend(reversed(pairs))
+    return changes
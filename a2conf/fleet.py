@@ -0,0 +1,201 @@
+"""
+Run same analysis over many exported apache config trees in process pool
+
+from a2conf.fleet import run_fleet
+
+def audit(root):
+    # runs in worker process, must be module level function and return picklable value
+    return [ vh.first('ServerName').args for vh in root.select('//VirtualHost[!SSLEngine]') ]
+
+report = run_fleet(['/backup/web1/etc/apache2', '/backup/web2.tar.gz'], audit, workers=8, timeout=60)
+"""
+import os
+import time
+import signal
+import tarfile
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import Node
+
+# names of main config file, tried in this order
+MAIN_NAMES = ('apache2.conf', 'httpd.conf')
+
+_tar_suffixes = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+class FleetTimeout(Exception):
+    pass
+
+
+class FleetResult(object):
+    """ Result of analysis of one config root """
+    __slots__ = ('root', 'value', 'error', 'elapsed', 'tree')
+
+    def __init__(self, root, value=None, error=None, elapsed=None, tree=None):
+        self.root = root # directory, tar archive or config file
+        self.value = value # what analysis function returned
+        self.error = error # text of exception (with traceback), if failed
+        self.elapsed = elapsed # seconds in worker
+        self.tree = tree # root Node, only with return_tree=True
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<FleetResult {} {}>'.format(self.root, 'ok' if self.ok else 'error')
+
+
+class FleetReport(object):
+    """ Aggregated results of run_fleet() """
+    def __init__(self, value=None):
+        self.results = dict() # root -> value
+        self.errors = dict() # root -> error text
+        self.value = value # result of combine()
+
+    def __repr__(self):
+        return '<FleetReport {} ok {} errors>'.format(len(self.results), len(self.errors))
+
+
+def is_archive(path):
+    return os.path.isfile(path) and path.endswith(_tar_suffixes)
+
+
+def find_main(path, names=MAIN_NAMES):
+    """ Return main config file for config root: file itself, or shallowest file with one of names in directory """
+    if os.path.isfile(path):
+        return path
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for name in names:
+            if name in filenames:
+                return os.path.join(dirpath, name)
+    raise FileNotFoundError('no {} in {}'.format(' or '.join(names), path))
+
+
+def _inside(name):
+    """ True if relative path name (in archive) does not go outside of archive root """
+    name = os.path.normpath(name)
+    return not os.path.isabs(name) and name.split(os.sep)[0] != '..'
+
+
+def _safe_members(tar):
+    """ Regular files, directories and links inside archive only (links by their target too) """
+    for member in tar.getmembers():
+        if not _inside(member.name):
+            continue
+        if member.issym():
+            if os.path.isabs(member.linkname) or \
+                    not _inside(os.path.join(os.path.dirname(member.name), member.linkname)):
+                continue
+        elif member.islnk():
+            if not _inside(member.linkname):
+                continue
+        elif not (member.isfile() or member.isdir()):
+            continue
+        yield member
+
+
+def _data_filter(member, path):
+    """ tarfile 'data' filter (link targets are resolved on disk), members it refuses are skipped """
+    try:
+        return tarfile.data_filter(member, path)
+    except tarfile.FilterError:
+        return None
+
+
+def extract(archive, directory):
+    """ Extract regular files, directories and links from tar archive (no devices, no paths or link targets outside
+    directory, e.g. sites-enabled/*.conf symlinks to ../sites-available) """
+    with tarfile.open(archive) as tar:
+        members = list(_safe_members(tar))
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(directory, members=members, filter=_data_filter)
+        else:
+            tar.extractall(directory, members=members)
+
+
+def _alarm(signum, frame):
+    raise FleetTimeout('timeout')
+
+
+def analyze_root(root, analyze, main=None, timeout=None, return_tree=False, kwargs=None):
+    """ Load one config root and run analyze(node) on it. Runs in worker process, never raises.
+
+    :return: FleetResult
+    """
+    start = time.perf_counter()
+    alarm = timeout and hasattr(signal, 'setitimer')
+    if alarm:
+        old = signal.signal(signal.SIGALRM, _alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with tempfile.TemporaryDirectory(prefix='a2conf-fleet-') as tmp:
+            path = root
+            if is_archive(root):
+                extract(root, tmp)
+                path = tmp
+            filename = os.path.join(path, main) if main else find_main(path)
+            node = Node(filename, **(kwargs or dict()))
+            value = analyze(node)
+        return FleetResult(root, value, elapsed=time.perf_counter() - start, tree=node if return_tree else None)
+    except Exception:
+        return FleetResult(root, error=traceback.format_exc(), elapsed=time.perf_counter() - start)
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old)
+
+
+def iter_fleet(roots, analyze, workers=None, timeout=None, main=None, return_tree=False, executor=None, **kwargs):
+    """ Analyze each config root in process pool, yield FleetResult as soon as each root is done
+
+    :param roots: directories, tar archives or main config files
+    :param analyze: function(root Node) -> picklable value. Must be picklable itself (module level function).
+    :param workers: number of processes (default is number of CPUs)
+    :param timeout: seconds per root (analysis is interrupted by SIGALRM in worker, where available)
+    :param main: path of main config file inside root, by default apache2.conf or httpd.conf is searched
+    :param return_tree: also send loaded tree back (tree is pickled, it's slow for big configs)
+    :param executor: use this executor instead of new ProcessPoolExecutor
+    :param kwargs: other arguments for Node(), e.g. cache or reader
+    """
+    if executor is None:
+        with ProcessPoolExecutor(workers) as executor:
+            for result in iter_fleet(roots, analyze, timeout=timeout, main=main, return_tree=return_tree,
+                                     executor=executor, **kwargs):
+                yield result
+        return
+
+    futures = dict()
+    for root in roots:
+        future = executor.submit(analyze_root, root, analyze, main, timeout, return_tree, kwargs)
+        futures[future] = root
+
+    for future in as_completed(futures):
+        try:
+            yield future.result()
+        except Exception:
+            # worker died or result is not picklable
+            yield FleetResult(futures[future], error=traceback.format_exc())
+
+
+def run_fleet(roots, analyze, combine=None, initial=None, **kwargs):
+    """ Run iter_fleet() and collect results
+
+    :param combine: function(value, root, result value) -> new value, called in this process for each
+        successful root as results arrive, e.g. to count or merge results without keeping them
+    :param initial: initial value for combine
+    :param kwargs: arguments for iter_fleet()
+    :return: FleetReport
+    """
+    report = FleetReport(initial)
+    for result in iter_fleet(roots, analyze, **kwargs):
+        if result.ok:
+            report.results[result.root] = result.value
+            if combine is not None:
+                report.value = combine(report.value, result.root, result.value)
+        else:
+            report.errors[result.root] = result.error
+    return report
@@ -0,0 +1,346 @@
+"""
+Frozen (read-only) tree: whole tree is one buffer of flat int32 arrays and one blob of strings
+
+Freeze tree once before workers are forked (or save it to file and load it in each worker with mmap): there are no
+per-node Python objects, so reading tree does not touch refcounts of shared pages. FrozenNode objects are created
+only when accessed.
+
+tree = root.freeze()
+tree.save('/var/cache/apache.frozen')
+tree = FrozenTree.load('/var/cache/apache.frozen')
+print(tree.root.find_vhost('example.com').first('DocumentRoot').args)
+"""
+import mmap
+import struct
+from array import array
+
+MAGIC = b'A2CFRZ1\0'
+# to detect file written on machine with other byte order
+CHECK = 0x01020304
+# magic, check, nodes, strings, keys, index entries, blob size
+HEADER = struct.Struct('=8s6I')
+
+# kinds of nodes
+OTHER = 0 # root or comment
+DIRECTIVE = 1
+SECTION = 2
+
+# int32 arrays per node, in order of buffer
+NODE_ARRAYS = ('name', 'key', 'args', 'raw', 'path', 'line', 'parent', 'end')
+
+
+class FrozenError(ValueError):
+    pass
+
+
+def freeze(node):
+    """ Return FrozenTree with node and all its content """
+    # nodes in document order (pre-order), parent index, kind
+    nodes = list()
+    parents = list()
+    kinds = list()
+    ends = list()
+    stack = [ (node, -1) ]
+    while stack:
+        n, parent = stack.pop()
+        if n is None:
+            # all content of parent is done
+            ends[parent] = len(nodes)
+            continue
+        i = len(nodes)
+        nodes.append(n)
+        parents.append(parent)
+        ends.append(i + 1)
+        kinds.append(SECTION if n._section is not None else DIRECTIVE if n._cmd is not None else OTHER)
+        if n._content:
+            stack.append((None, i))
+            stack.extend((c, i) for c in reversed(n._content))
+
+    # lowercase names go first in string table, so they are found without decoding other strings
+    keys = dict()
+    for n in nodes:
+        keys.setdefault(n.name.lower(), len(keys))
+    strings = dict(keys)
+
+    def sid(s):
+        if s is None:
+            return -1
+        i = strings.get(s)
+        if i is None:
+            i = strings[s] = len(strings)
+        return i
+
+    arrays = dict((a, array('i')) for a in NODE_ARRAYS)
+    for n in nodes:
+        arrays['name'].append(sid(n.name))
+        arrays['key'].append(keys[n.name.lower()])
+        arrays['args'].append(sid(n._args))
+        arrays['raw'].append(sid(n.raw))
+        arrays['path'].append(sid(n.path))
+        arrays['line'].append(-1 if n.line is None else n.line)
+    arrays['parent'].extend(parents)
+    arrays['end'].extend(ends)
+
+    # hostname index of vhosts in content of node, sorted by hostname (then in document order)
+    index = list()
+    position = dict((id(n), i) for i, n in enumerate(nodes))
+    for vhost in node.children('<VirtualHost>'):
+        seen = set()
+        for hostname in vhost.hostnames():
+            hostname = hostname.lower()
+            if hostname not in seen:
+                seen.add(hostname)
+                index.append((hostname, position[id(vhost)]))
+    index.sort()
+    hosts = array('i', [ sid(h) for h, i in index ])
+    vhosts = array('i', [ i for h, i in index ])
+
+    offsets = array('i', [0])
+    blob = list()
+    size = 0
+    for s in strings:
+        b = s.encode('utf-8', 'surrogateescape')
+        blob.append(b)
+        size += len(b)
+        offsets.append(size)
+    blob = b''.join(blob)
+
+    out = [ HEADER.pack(MAGIC, CHECK, len(nodes), len(strings), len(keys), len(index), len(blob)) ]
+    out.extend(arrays[a].tobytes() for a in NODE_ARRAYS)
+    out.append(offsets.tobytes())
+    out.append(hosts.tobytes())
+    out.append(vhosts.tobytes())
+    out.append(array('B', kinds).tobytes())
+    out.append(blob)
+    return FrozenTree(b''.join(out))
+
+
+class FrozenTree(object):
+    """ Immutable tree in one buffer (bytes or read-only mmap), use freeze() or Node.freeze() to create it """
+
+    def __init__(self, data, mm=None):
+        self._mmap = mm
+        self._view = memoryview(data)
+        if len(data) < HEADER.size:
+            raise FrozenError('frozen tree is too short')
+        magic, check, nodes, nstrings, nkeys, nindex, blob = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise FrozenError('not a frozen a2conf tree')
+        if check != CHECK:
+            raise FrozenError('frozen tree has other byte order')
+        if len(data) != HEADER.size + 4 * (len(NODE_ARRAYS) * nodes + nstrings + 1 + 2 * nindex) + nodes + blob:
+            raise FrozenError('frozen tree has wrong size')
+
+        self.size = nodes
+        self._nkeys = nkeys
+        pos = HEADER.size
+        sizes = [ nodes ] * len(NODE_ARRAYS) + [ nstrings + 1, nindex, nindex ]
+        names = [ '_' + a for a in NODE_ARRAYS ] + [ '_offsets', '_hosts', '_vhosts' ]
+        for name, count in zip(names, sizes):
+            setattr(self, name, self._view[pos:pos + 4 * count].cast('i'))
+            pos += 4 * count
+        self._kind = self._view[pos:pos + nodes]
+        pos += nodes
+        self._blob = self._view[pos:pos + blob]
+
+        self._strings = dict() # decoded strings, filled on access
+        self._keys = None # lowercase name -> key id, built on first lookup by name
+
+    @classmethod
+    def load(cls, filename):
+        """ Load frozen tree saved by save(), file is mapped to memory (shared by all processes which load it) """
+        with open(filename, 'rb') as fh:
+            mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(mm, mm)
+        except FrozenError:
+            mm.close()
+            raise
+
+    def save(self, filename):
+        with open(filename, 'wb') as fh:
+            fh.write(self._view)
+
+    def tobytes(self):
+        return self._view.tobytes()
+
+    def close(self):
+        """ Release buffer (and mmap), nodes of this tree must not be used after it """
+        for name in ('_name', '_key', '_args', '_raw', '_path', '_line', '_parent', '_end', '_offsets', '_hosts',
+                     '_vhosts', '_kind', '_blob', '_view'):
+            getattr(self, name).release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def root(self):
+        return FrozenNode(self, 0)
+
+    def node(self, i):
+        return FrozenNode(self, i)
+
+    def string(self, i):
+        """ Return string by id, None for -1 """
+        if i < 0:
+            return None
+        s = self._strings.get(i)
+        if s is None:
+            s = self._strings[i] = str(self._blob[self._offsets[i]:self._offsets[i + 1]], 'utf-8', 'surrogateescape')
+        return s
+
+    def key(self, name):
+        """ Return id of lowercase name or None if there are no nodes with this name """
+        if self._keys is None:
+            self._keys = dict((self.string(i), i) for i in range(self._nkeys))
+        return self._keys.get(name.lower())
+
+    def iter_children(self, i, key=None, recursive=False):
+        """ Yield indexes of content of node i (with key, if given), in document order """
+        end = self._end[i]
+        keys = self._key
+        j = i + 1
+        if recursive:
+            # descendants are next nodes up to end of subtree
+            while j < end:
+                if key is None or keys[j] == key:
+                    yield j
+                j += 1
+            return
+        ends = self._end
+        while j < end:
+            if key is None or keys[j] == key:
+                yield j
+            j = ends[j]
+
+    def vhost_index(self, hostname):
+        """ Return indexes of vhosts in content of root with hostname (binary search), in document order """
+        hostname = hostname.lower()
+        hosts = self._hosts
+        lo, hi = 0, len(hosts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.string(hosts[mid]) < hostname:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = list()
+        while lo < len(hosts) and self.string(hosts[lo]) == hostname:
+            found.append(self._vhosts[lo])
+            lo += 1
+        return found
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return '<FrozenTree {} nodes>'.format(self.size)
+
+
+class FrozenNode(object):
+    """ Read-only node of FrozenTree, same query API as Node: children(), first(), yield_vhost(), find_vhost() """
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def name(self):
+        return self.tree.string(self.tree._name[self.index])
+
+    @property
+    def section(self):
+        if self.tree._kind[self.index] != SECTION:
+            return None
+        name = self.name
+        return name[1:-1] if name.endswith('>') else name[1:]
+
+    @property
+    def cmd(self):
+        return self.name if self.tree._kind[self.index] == DIRECTIVE else None
+
+    @property
+    def args(self):
+        return self.tree.string(self.tree._args[self.index])
+
+    @property
+    def raw(self):
+        return self.tree.string(self.tree._raw[self.index])
+
+    @property
+    def path(self):
+        return self.tree.string(self.tree._path[self.index])
+
+    @property
+    def line(self):
+        line = self.tree._line[self.index]
+        return None if line < 0 else line
+
+    @property
+    def parent(self):
+        parent = self.tree._parent[self.index]
+        return None if parent < 0 else FrozenNode(self.tree, parent)
+
+    @property
+    def content(self):
+        return list(self.children())
+
+    def children(self, name=None, recursive=False):
+        tree = self.tree
+        key = None
+        if name:
+            key = tree.key(name)
+            if key is None:
+                return
+        for i in tree.iter_children(self.index, key, recursive):
+            yield FrozenNode(tree, i)
+
+    def first(self, name, recursive=False):
+        return next(self.children(name, recursive), None)
+
+    def is_vhost(self):
+        return self.name.lower() == '<virtualhost>'
+
+    def hostnames(self):
+        names = list()
+        servername = self.first('ServerName')
+        if servername is not None:
+            names.append(servername.args)
+        for alias in self.children('ServerAlias'):
+            names.extend(alias.args.split())
+        return names
+
+    def yield_vhost(self, hostname, arg=None):
+        """ Yield vhosts (direct children) with hostname in ServerName/ServerAlias, uses index for root of tree """
+        if self.index == 0:
+            vhosts = (FrozenNode(self.tree, i) for i in self.tree.vhost_index(hostname))
+        else:
+            hostname = hostname.lower()
+            vhosts = (vhost for vhost in self.children('<VirtualHost>')
+                      if hostname in (h.lower() for h in vhost.hostnames()))
+        for vhost in vhosts:
+            if arg and arg not in vhost.args:
+                continue
+            yield vhost
+
+    def find_vhost(self, hostname, arg=None):
+        from . import VhostNotFound
+        for vhost in self.yield_vhost(hostname, arg):
+            return vhost
+        raise VhostNotFound('Vhost args: {} host: {} not found'.format(arg, hostname))
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenNode) and other.tree is self.tree and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self):
+        return "FrozenNode:{!r}".format(self.name)
@@ -0,0 +1,175 @@
+import os
+import re
+from bisect import bisect_left, bisect_right
+
+# "Syntax error on line 123 of /etc/apache2/sites-enabled/foo.conf:"
+_location_re = re.compile(r'line (\d+) of (\S+?):?(?=\s|$)')
+
+
+def abspath(path):
+    return os.path.normpath(os.path.abspath(path))
+
+
+def end_line(node):
+    """ Last line of node in its file: line of closing tag of section, last line of continued directive """
+    if node._close is not None:
+        return node._close[0]
+    if node.raw and '\n' in node.raw:
+        return node.line + node.raw.count('\n')
+    return node.line
+
+
+def parse_locations(text):
+    """ Return list of (path, line) for each 'line N of PATH' in text (e.g. apachectl configtest output) """
+    return [ (m.group(2), int(m.group(1))) for m in _location_re.finditer(text) ]
+
+
+def top_nodes(content, nodes, path):
+    """ Return nodes of file path in content: from first to last of nodes (top-level nodes of file when it was loaded)
+    which are still in content, and nodes of file around them (inserted later) """
+    start = end = None
+    for node in nodes:
+        try:
+            start = content.index(node)
+        except ValueError:
+            continue
+        break
+    if start is None:
+        # all loaded nodes are deleted
+        return [ c for c in content if c.path == path ]
+    for node in reversed(nodes):
+        try:
+            end = content.index(node, start) + 1
+        except ValueError:
+            continue
+        break
+    while start > 0 and content[start - 1].path == path:
+        start -= 1
+    while end < len(content) and content[end].path == path:
+        end += 1
+    return [ c for c in content[start:end] if c.path == path ]
+
+
+class FileLocations(object):
+    """ Nodes of one file, sorted by line """
+    __slots__ = ('lines', 'nodes')
+
+    def __init__(self, nodes):
+        nodes.sort(key=lambda n: n.line)
+        self.lines = [ n.line for n in nodes ]
+        self.nodes = nodes
+
+    def find(self, line):
+        """ Return node on line or innermost section of this file which contains line, or None """
+        i = bisect_right(self.lines, line) - 1
+        if i < 0:
+            return None
+        # first of nodes on same line (if file is included more than once)
+        node = self.nodes[bisect_left(self.lines, self.lines[i])]
+        path = node.path
+        while node is not None:
+            if node.path == path and node.line is not None and node.line <= line <= end_line(node):
+                return node
+            node = node.parent
+        return None
+
+
+class LocationIndex(object):
+    """ (file, line) -> node index of tree, kept in memo of root
+
+    Index of file is dropped when nodes of file are changed (see forget()) and built again on next lookup. Only nodes
+    of such files are visited (found from parents where files were loaded), not whole tree.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.files = dict() # absolute path -> FileLocations
+        self.stale = set() # absolute paths to index again
+        self._abspaths = dict() # path of node -> absolute path
+        self._build(None)
+
+    def _abspath(self, path):
+        key = self._abspaths.get(path)
+        if key is None:
+            key = self._abspaths[path] = abspath(path)
+        return key
+
+    def _build(self, paths):
+        """ Index nodes of files with these absolute paths (or of all files) """
+        files = self.root._files
+        if paths is None or files is None:
+            self._build_walk(paths)
+            return
+        keys = dict() # absolute path -> path of loaded file
+        for path in files.files:
+            key = self._abspath(path)
+            if key in paths:
+                keys[key] = path
+        for key in paths:
+            nodes = self._file_nodes(files, keys[key]) if key in keys else None
+            if nodes:
+                self.files[key] = FileLocations(nodes)
+            else:
+                self.files.pop(key, None)
+
+    def _file_nodes(self, files, path):
+        """ Return nodes of loaded file: its top-level nodes in content of parent where it was loaded (root for main
+        file, parent of Include node for included one) and content of its sections """
+        found = list()
+        seen = set()
+        for loaded in files.files[path]:
+            if loaded.include is None:
+                parent = self.root
+            else:
+                entry = files.includes.get(id(loaded.include))
+                if entry is None:
+                    continue
+                parent = entry[1]
+            if parent.get_root() is not self.root:
+                # deleted with section of other file
+                continue
+
+            stack = [ c for c in top_nodes(parent._content or [], loaded.nodes or (), path) if id(c) not in seen ]
+            seen.update(id(c) for c in stack)
+            while stack:
+                node = stack.pop()
+                if node.line is not None:
+                    found.append(node)
+                if node._content:
+                    stack.extend(c for c in node._content if c.path == path)
+        return found
+
+    def _build_walk(self, paths):
+        """ Index nodes of files with these absolute paths (or of all files) in one walk over tree """
+        found = dict()
+        for node in self.root.children(recursive=True):
+            if node.line is None or node.path is None:
+                continue
+            key = self._abspath(node.path)
+            if paths is None or key in paths:
+                found.setdefault(key, list()).append(node)
+        for key in found if paths is None else paths:
+            if key in found:
+                self.files[key] = FileLocations(found[key])
+            else:
+                self.files.pop(key, None)
+
+    def forget(self, path):
+        """ Nodes of file path are changed """
+        if path is not None:
+            self.stale.add(abspath(path))
+
+    def find(self, path, line):
+        key = abspath(path)
+        if self.stale:
+            self._build(self.stale)
+            self.stale = set()
+        locations = self.files.get(key)
+        if locations is None:
+            return None
+        node = locations.find(line)
+        if node is not None and node.get_root() is not self.root:
+            # removed with section of other file, e.g. with <VirtualHost> which had Include in it
+            self._build({key})
+            locations = self.files.get(key)
+            node = locations.find(line) if locations is not None else None
+        return node
@@ -0,0 +1,237 @@
+import re
+import functools
+
+
+class SelectorError(ValueError):
+    pass
+
+
+# one token of selector: separator, step name or predicate
+_token_re = re.compile(r"""\s*(?:
+    (?P<sep>//|/)
+    |(?P<name>\*|<?[A-Za-z_][\w.:-]*>?)
+    |\[\s*(?P<neg>!)?\s*(?P<key>[A-Za-z_][\w.:-]*)\s*
+        (?:(?P<op>[~^$!]?=)\s*(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<bare>[^\]]*?))\s*)?\]
+)""", re.VERBOSE)
+
+
+def _words_equal(args, value):
+    return args == value or value in args.split()
+
+
+# all comparisons are case-insensitive, args and value are lowercase
+_ops = {
+    '=': _words_equal,
+    '!=': lambda args, value: not _words_equal(args, value),
+    '~=': lambda args, value: value in args,
+    '^=': lambda args, value: args.startswith(value),
+    '$=': lambda args, value: args.endswith(value),
+}
+
+
+def _names(name):
+    """ Return node names (lowercase) matched by name in selector: VirtualHost matches '<virtualhost>' too """
+    name = name.lower()
+    if name.startswith('<'):
+        return (name if name.endswith('>') else name + '>',)
+    return (name, '<' + name + '>')
+
+
+class Predicate(object):
+    """ [args op value], [Child op value], [Child] or [!Child] """
+    __slots__ = ('key', 'names', 'op', 'value', 'negate')
+
+    def __init__(self, key, op=None, value=None, negate=False):
+        self.key = key.lower()
+        self.names = None if self.key == 'args' else _names(key)
+        self.op = _ops[op] if op else None
+        self.value = None if value is None else value.lower()
+        self.negate = negate
+
+    def test(self, args):
+        if self.op is None:
+            return True
+        return self.op((args or '').lower(), self.value)
+
+    def match(self, node):
+        if self.names is None:
+            found = self.test(node.args)
+        else:
+            found = any(self.test(c.args) for name in self.names for c in node.named(name))
+        return found != self.negate
+
+
+class Step(object):
+    """ One step of selector: axis, name and predicates """
+    __slots__ = ('descendant', 'names', 'section', 'cmd', 'predicates')
+
+    def __init__(self, descendant, name, predicates):
+        self.descendant = descendant # True for //, False for /
+        self.names = None if name == '*' else _names(name)
+        # section and directive name to match, without <>
+        self.section = self.names and self.names[-1][1:-1]
+        self.cmd = self.names and (None if name.startswith('<') else self.names[0])
+        self.predicates = predicates
+
+    def match(self, node):
+        """ Test predicates (name is already matched by plan of Selector) """
+        for p in self.predicates:
+            if not p.match(node):
+                return False
+        return True
+
+    def candidates(self, node):
+        """ Children of node which may match this (child axis) step. Uses name index of node. """
+        if self.names is None:
+            return node._content or ()
+        found = [ node.named(name) for name in self.names ]
+        found = [ f for f in found if f ]
+        if len(found) == 1:
+            return found[0]
+        if not found:
+            return ()
+        # same name as section and as directive, keep document order
+        return [ c for c in node._content if c.name.lower() in self.names ]
+
+
+class Selector(object):
+    """ Compiled selector, use compile_selector() to get it
+
+    Selector is path of steps separated by '/' (child) or '//' (any descendant), e.g.
+    '//VirtualHost[args~=":443"][ServerName=example.com]//SSLCertificateFile'. Step is name of directive or section
+    ('VirtualHost' or '<VirtualHost>') or '*' with optional predicates:
+    [args op value] - test args of node itself
+    [Name op value] - node has child Name with matching args, [Name] - has child Name, [!Name] - has no such child
+    op is '=' (whole args or any word of args), '!=', '~=' (contains), '^=' (starts with) or '$=' (ends with),
+    all comparisons are case-insensitive. Selector without leading separator starts from children of node.
+    """
+    def __init__(self, selector):
+        self.selector = selector
+        self.steps = list()
+        # evaluation plan, filled on demand and reused by all select() calls:
+        # state (tuple of indexes of steps, which children of node can match) -> (section name -> steps,
+        # directive name -> steps, steps for any name, states to keep)
+        self._plans = dict()
+        # (state, matched step indexes) -> (is result, state for children)
+        self._transitions = dict()
+
+        pos = 0
+        descendant = False
+        expect_name = True
+        step = None
+        while pos < len(selector):
+            m = _token_re.match(selector, pos)
+            if m is None or m.end() == pos:
+                if not selector[pos:].strip():
+                    break
+                raise SelectorError('bad selector {!r} at position {}'.format(selector, pos))
+            pos = m.end()
+            if m.group('sep'):
+                if expect_name and self.steps:
+                    raise SelectorError('step name expected in {!r} at position {}'.format(selector, m.start()))
+                descendant = m.group('sep') == '//'
+                expect_name = True
+            elif m.group('name'):
+                if not expect_name:
+                    raise SelectorError('separator expected in {!r} at position {}'.format(selector, m.start()))
+                step = Step(descendant, m.group('name'), list())
+                self.steps.append(step)
+                expect_name = False
+            elif m.group('key'):
+                if step is None or expect_name:
+                    raise SelectorError('predicate without step in {!r} at position {}'.format(selector, m.start()))
+                value = m.group('dq')
+                if value is None:
+                    value = m.group('sq')
+                if value is None:
+                    value = m.group('bare')
+                if m.group('op') and m.group('neg'):
+                    raise SelectorError('[!Name] can not have value in {!r}'.format(selector))
+                step.predicates.append(Predicate(m.group('key'), m.group('op'), value, bool(m.group('neg'))))
+            else:
+                break
+
+        if not self.steps or expect_name:
+            raise SelectorError('incomplete selector {!r}'.format(selector))
+
+    def select(self, node):
+        """ Yield nodes under node matching selector, in document order, in one walk over tree """
+        steps = self.steps
+        last = len(steps) - 1
+        plans = self._plans
+        transitions = self._transitions
+
+        stack = [ (node, (0,)) ]
+        while stack:
+            parent, state = stack.pop()
+            plan = plans.get(state)
+            if plan is None:
+                plan = plans[state] = self._plan(state)
+            sections, cmds, anyname, keep = plan
+
+            if len(state) == 1 and not keep:
+                children = steps[state[0]].candidates(parent)
+            else:
+                children = parent._content or ()
+
+            pending = list()
+            for c in children:
+                if c._section is not None:
+                    tests = sections.get(c._section.lower(), anyname)
+                elif c._cmd is not None:
+                    tests = cmds.get(c._cmd.lower(), anyname)
+                else:
+                    # comment
+                    continue
+                matched = tuple(i for i, step in tests if step.match(c)) if tests else None
+                if matched:
+                    key = (state, matched)
+                    t = transitions.get(key)
+                    if t is None:
+                        substate = set(keep)
+                        substate.update(i + 1 for i in matched if i < last)
+                        t = transitions[key] = (last in matched, tuple(sorted(substate)))
+                    result, substate = t
+                    if result:
+                        # yield before its children, but after previous siblings and their subtrees
+                        pending.append((c, None))
+                else:
+                    substate = keep
+                if substate and c._content:
+                    pending.append((c, substate))
+
+            # depth first: subtree of node is processed before its next sibling
+            pending.reverse()
+            stack.extend(pending)
+
+            while stack and stack[-1][1] is None:
+                yield stack.pop()[0]
+
+    def _plan(self, state):
+        anyname = [ (i, self.steps[i]) for i in state if self.steps[i].names is None ]
+        sections = dict()
+        cmds = dict()
+        for i in state:
+            step = self.steps[i]
+            if step.names is not None:
+                sections.setdefault(step.section, list()).append((i, step))
+                if step.cmd:
+                    cmds.setdefault(step.cmd, list()).append((i, step))
+        # steps for any name are tested too, in order of state
+        for tests in list(sections.values()) + list(cmds.values()):
+            tests.extend(anyname)
+            tests.sort(key=lambda t: t[0])
+        return sections, cmds, anyname, tuple(i for i in state if self.steps[i].descendant)
+
+    def first(self, node):
+        """ Return first node matching selector or None """
+        return next(self.select(node), None)
+
+    def __repr__(self):
+        return 'Selector({!r})'.format(self.selector)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_selector(selector):
+    """ Return Selector for selector string, compiled selectors are cached """
+    return Selector(selector)
@@ -0,0 +1,131 @@
+import re
+
+# sections which apply only to some requests (or are other vhosts), their directives are not server/vhost level
+CONTEXT_SECTIONS = frozenset(['virtualhost', 'directory', 'directorymatch', 'location', 'locationmatch', 'files',
+                              'filesmatch', 'proxy', 'proxymatch', 'if', 'elseif', 'else', 'limit', 'limitexcept'])
+
+# not directives of scope, they only change Define'd variables
+DEFINE_DIRECTIVES = frozenset(['define', 'undefine'])
+
+_var_re = re.compile(r'\$\{([^}]+)\}')
+
+
+def expand(value, defines, env=None):
+    """ Replace ${VAR} in value with Define'd variable, then with environment variable, unknown variables are kept """
+    if not value or '${' not in value:
+        return value
+    value = _var_re.sub(lambda m: defines.get(m.group(1), m.group(0)), value)
+    if env and '${' in value:
+        value = _var_re.sub(lambda m: env.get(m.group(1), m.group(0)), value)
+    return value
+
+
+def scope_directives(node):
+    """ Yield directives of node in document order, including ones in nested <IfModule>, <IfDefine> and other
+    sections which are not in CONTEXT_SECTIONS """
+    stack = [ iter(node._content or ()) ]
+    while stack:
+        for c in stack[-1]:
+            if c._section is not None:
+                if c._section.lower() not in CONTEXT_SECTIONS and c._content:
+                    stack.append(iter(c._content))
+                    break
+            elif c._cmd is not None:
+                yield c
+        else:
+            stack.pop()
+
+
+def define_directives(node):
+    """ Yield (node, vhost) for each Define and UnDefine in content of node (at any depth) in document order, vhost is
+    <VirtualHost> which contains directive or None """
+    stack = [ (iter(node._content or ()), None) ]
+    while stack:
+        children, vhost = stack[-1]
+        for c in children:
+            if c._section is not None:
+                if c._content:
+                    stack.append((iter(c._content), c if c._section.lower() == 'virtualhost' else vhost))
+                    break
+            elif c._cmd is not None and c._cmd.lower() in DEFINE_DIRECTIVES:
+                yield c, vhost
+        else:
+            stack.pop()
+
+
+class ServerScope(object):
+    """ Server level directives (outside of vhosts) and Define'd variables of whole tree
+
+    Define is not scoped by sections: Define/UnDefine anywhere (in vhosts too) change variables in document order.
+    """
+    def __init__(self, root):
+        self.directives = dict() # lowercase name -> list of nodes
+        for node in scope_directives(root):
+            name = node._cmd.lower()
+            if name not in DEFINE_DIRECTIVES:
+                self.directives.setdefault(name, list()).append(node)
+
+        self.defines = dict()
+        self.vhosts = set() # ids of vhosts with Define/UnDefine
+        for node, vhost in define_directives(root):
+            if vhost is not None:
+                self.vhosts.add(id(vhost))
+            if node._cmd.lower() == 'define':
+                parts = node.args.split(None, 1)
+                if parts:
+                    self.defines[parts[0]] = expand(parts[1], self.defines) if len(parts) > 1 else ''
+            else:
+                self.defines.pop(node.args.strip(), None)
+
+    def depends(self, vhost):
+        """ True if change of vhost content may change defines """
+        return id(vhost) in self.vhosts or any(True for _ in define_directives(vhost))
+
+
+class EffectiveConfig(object):
+    """ Directives in effect for vhost: server level directives, overridden by vhost level directives with same name
+
+    Directive with same name in vhost replaces all server level directives with this name. Args have ${VAR} expanded.
+    """
+    def __init__(self, vhost, server, env=None):
+        self.vhost = vhost
+        self.defines = server.defines
+        self.env = env
+
+        directives = dict(server.directives)
+        local = dict()
+        for node in scope_directives(vhost):
+            name = node._cmd.lower()
+            if name not in DEFINE_DIRECTIVES:
+                local.setdefault(name, list()).append(node)
+        directives.update(local)
+
+        # lowercase name -> list of (node, expanded args)
+        self._directives = dict((name, [ (n, expand(n.args, self.defines, env)) for n in nodes ])
+                                for name, nodes in directives.items())
+
+    def get(self, name, default=None):
+        """ Return expanded args of last directive with this name (it's one in effect) or default """
+        found = self._directives.get(name.lower())
+        return found[-1][1] if found else default
+
+    def getall(self, name):
+        """ Return list of expanded args of all directives with this name """
+        return [ args for node, args in self._directives.get(name.lower(), ()) ]
+
+    def nodes(self, name):
+        """ Return list of nodes of directives with this name (vhost or server level) """
+        return [ node for node, args in self._directives.get(name.lower(), ()) ]
+
+    def names(self):
+        return list(self._directives)
+
+    def __contains__(self, name):
+        return name.lower() in self._directives
+
+    def as_dict(self):
+        """ Return dict: directive name -> list of expanded args """
+        return dict((nodes[0][0].cmd, [ args for node, args in nodes ]) for nodes in self._directives.values())
+
+    def __repr__(self):
+        return '<EffectiveConfig {!r}>'.format(self.vhost.args)
@@ -0,0 +1,113 @@
+import time
+
+
+class FileStats(object):
+    """ Statistics of one loaded config file """
+    __slots__ = ('path', 'include', 'depth', 'bytes', 'lines', 'nodes', 'time', 'total_time', 'error',
+                 '_start', '_child_time')
+
+    def __init__(self, path, include=None, depth=0):
+        self.path = path
+        self.include = include # raw line of Include directive (None for main file)
+        self.depth = depth # include depth, 0 for main file
+        self.bytes = 0
+        self.lines = 0 # number of last non-blank line
+        self.nodes = 0
+        self.time = 0.0 # seconds spent on this file (without included files)
+        self.total_time = 0.0 # seconds spent on this file and all included files
+        self.error = None # exception, if file was not loaded
+        self._start = time.perf_counter()
+        self._child_time = 0.0
+
+    def as_dict(self):
+        d = dict((k, getattr(self, k)) for k in self.__slots__ if not k.startswith('_'))
+        d['error'] = None if self.error is None else str(self.error)
+        return d
+
+    def __repr__(self):
+        return '<FileStats {} {} lines {} nodes {:.6f}s>'.format(self.path, self.lines, self.nodes, self.time)
+
+
+class GlobStats(object):
+    """ Statistics of one Include/IncludeOptional pattern expansion """
+    __slots__ = ('path', 'line', 'pattern', 'depth', 'matches', 'time')
+
+    def __init__(self, path, line, pattern, depth, matches, time):
+        self.path = path # file with Include directive
+        self.line = line
+        self.pattern = pattern
+        self.depth = depth # include depth of file with Include directive
+        self.matches = matches # number of files found
+        self.time = time
+
+    def as_dict(self):
+        return dict((k, getattr(self, k)) for k in self.__slots__)
+
+    def __repr__(self):
+        return '<GlobStats {} {} files {:.6f}s>'.format(self.pattern, self.matches, self.time)
+
+
+class LoadStats(object):
+    """ Statistics collected by Node.read_file(stats=...)
+
+    files and globs are filled in load order. callback (if given) is called with each FileStats and GlobStats
+    as soon as it is complete. With parallel= reading and tokenizing happens in threads, so time of file
+    is mostly time to create nodes.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.files = list() # FileStats of loaded files, including missing ones (with error)
+        self.globs = list() # GlobStats
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.time = 0.0 # total time of read_file()
+        self._stack = list()
+
+    def start_file(self, path, include=None):
+        fs = FileStats(path, include, len(self._stack))
+        self._stack.append(fs)
+        return fs
+
+    def end_file(self, fs, error=None):
+        self._stack.pop()
+        fs.total_time = time.perf_counter() - fs._start
+        fs.time = fs.total_time - fs._child_time
+        fs.error = error
+        if self._stack:
+            self._stack[-1]._child_time += fs.total_time
+        self.files.append(fs)
+        if self.callback:
+            self.callback(fs)
+
+    def add_glob(self, node, matches, elapsed):
+        gs = GlobStats(node.path, node.line, node.args, max(len(self._stack) - 1, 0), matches, elapsed)
+        self.globs.append(gs)
+        if self.callback:
+            self.callback(gs)
+
+    def summary(self):
+        """ Return dict with totals """
+        loaded = [ fs for fs in self.files if fs.error is None ]
+        return dict(
+            files=len(loaded),
+            missing=len(self.files) - len(loaded),
+            bytes=sum(fs.bytes for fs in loaded),
+            lines=sum(fs.lines for fs in loaded),
+            nodes=sum(fs.nodes for fs in loaded),
+            max_depth=max([ fs.depth for fs in loaded ] or [0]),
+            globs=len(self.globs),
+            glob_matches=sum(gs.matches for gs in self.globs),
+            glob_time=sum(gs.time for gs in self.globs),
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses,
+            time=self.time)
+
+    def as_dict(self):
+        """ Return all statistics as dict (e.g. for json.dumps()) """
+        return dict(summary=self.summary(),
+                    files=[ fs.as_dict() for fs in self.files ],
+                    globs=[ gs.as_dict() for gs in self.globs ])
+
+    def slowest(self, n=10):
+        """ Return n FileStats with largest time """
+        return sorted(self.files, key=lambda fs: fs.time, reverse=True)[:n]
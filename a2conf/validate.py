@@ -0,0 +1,197 @@
+"""
+Check that files and directories referenced in config exist, and that hostnames are not duplicated
+
+for finding in root.validate(env={'APACHE_LOG_DIR': '/var/log/apache2'}):
+    print(finding)
+"""
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+from .resolve import expand
+
+# what directive refers to
+FILE = 'file' # readable file
+DIR = 'dir' # readable directory
+LOGDIR = 'logdir' # file in writable directory (directory is checked)
+
+PATH_CHECKS = {
+    'sslcertificatefile': FILE,
+    'sslcertificatekeyfile': FILE,
+    'sslcertificatechainfile': FILE,
+    'sslcacertificatefile': FILE,
+    'documentroot': DIR,
+    'errorlog': LOGDIR,
+    'customlog': LOGDIR,
+    'transferlog': LOGDIR,
+}
+
+
+class Finding(object):
+    """ One problem found by validate()
+
+    code is 'missing', 'not_file', 'not_dir', 'not_readable', 'not_writable', 'error' (other stat error),
+    'undefined' (path has ${VAR} which is not defined) or 'duplicate_hostname'
+    """
+    __slots__ = ('code', 'message', 'node')
+
+    def __init__(self, code, message, node):
+        self.code = code
+        self.message = message
+        self.node = node # directive node where problem is
+
+    @property
+    def path(self):
+        return self.node.path
+
+    @property
+    def line(self):
+        return self.node.line
+
+    def as_dict(self):
+        return dict(code=self.code, message=self.message, path=self.path, line=self.line)
+
+    def __str__(self):
+        return '{}:{}: {}'.format(self.path, self.line, self.message)
+
+    def __repr__(self):
+        return '<Finding {} {}:{}>'.format(self.code, self.path, self.line)
+
+
+class StatCache(object):
+    """ os.stat() results (or exceptions) by path, each path is stat'ed once """
+    def __init__(self):
+        self._stats = dict()
+
+    def stat(self, path):
+        """ Return os.stat_result, or OSError if stat failed """
+        result = self._stats.get(path)
+        if result is None:
+            try:
+                result = os.stat(path)
+            except OSError as e:
+                result = e
+            self._stats[path] = result
+        return result
+
+
+def path_arg(args):
+    """ Return path (first argument, unquoted) from args, None for pipes and syslog """
+    args = args.strip()
+    if args.startswith('"'):
+        end = args.find('"', 1)
+        path = args[1:end] if end > 0 else args[1:]
+    else:
+        path = args.split(None, 1)[0] if args else ''
+    if not path or path.startswith('|') or path.startswith('syslog'):
+        return None
+    return path
+
+
+def check_path(kind, target, stats):
+    """ Return (code, message) of problem with target or None if it's fine """
+    st = stats.stat(target)
+    if isinstance(st, FileNotFoundError):
+        return 'missing', '{} does not exist'.format(target)
+    if isinstance(st, PermissionError):
+        return 'not_readable', '{} is not accessible'.format(target)
+    if isinstance(st, OSError):
+        return 'error', '{}: {}'.format(target, st.strerror)
+
+    if kind == FILE:
+        if not stat.S_ISREG(st.st_mode):
+            return 'not_file', '{} is not a file'.format(target)
+        if not os.access(target, os.R_OK):
+            return 'not_readable', '{} is not readable'.format(target)
+    else:
+        if not stat.S_ISDIR(st.st_mode):
+            return 'not_dir', '{} is not a directory'.format(target)
+        if kind == DIR and not os.access(target, os.R_OK | os.X_OK):
+            return 'not_readable', '{} is not readable'.format(target)
+        if kind == LOGDIR and not os.access(target, os.W_OK | os.X_OK):
+            return 'not_writable', '{} is not writable'.format(target)
+    return None
+
+
+def collect(root, env=None, server_root=None):
+    """ Walk tree once, return (dict (kind, absolute path) -> list of nodes, list of Finding, dict of vhost keys)
+
+    vhost keys: (hostname, vhost address) -> list of (vhost, node of ServerName/ServerAlias)
+    """
+    defines = root._server_scope().defines
+    if server_root is None:
+        node = root.first('ServerRoot')
+        if node is not None:
+            server_root = path_arg(expand(node.args, defines, env))
+        else:
+            server_root = os.path.dirname(root.path or '')
+
+    paths = dict()
+    findings = list()
+    hostnames = dict()
+
+    def pre(node, depth):
+        cmd = node._cmd
+        if cmd is None:
+            return
+        cmd = cmd.lower()
+        kind = PATH_CHECKS.get(cmd)
+        if kind is not None:
+            path = path_arg(expand(node._args or '', defines, env))
+            if path is None:
+                return
+            if '${' in path:
+                findings.append(Finding('undefined', '{} has undefined variable'.format(path), node))
+                return
+            path = os.path.normpath(os.path.join(server_root, path))
+            if kind == LOGDIR:
+                # all logs in same directory are one check
+                path = os.path.dirname(path)
+            paths.setdefault((kind, path), list()).append(node)
+        elif cmd in ('servername', 'serveralias'):
+            vhost = node.parent
+            if vhost is None or vhost._section is None or vhost._section.lower() != 'virtualhost':
+                return
+            address = ' '.join(sorted(vhost.args.lower().split()))
+            names = node.args.split()
+            if cmd == 'servername':
+                names = names[:1]
+            for hostname in names:
+                hosts = hostnames.setdefault((hostname.lower(), address), list())
+                if not hosts or hosts[-1][0] is not vhost:
+                    hosts.append((vhost, node))
+
+    root.walk(pre)
+    return paths, findings, hostnames
+
+
+def validate(root, env=None, server_root=None, workers=16, stats=None):
+    """ Check paths of SSL certificates and keys, DocumentRoot and log directories, and duplicate hostnames
+
+    Paths are collected in one walk over tree, each unique path is checked once, checks run in thread pool
+    (fast on network storage).
+    :param env: dict for ${VAR} which are not Define'd, e.g. APACHE_LOG_DIR
+    :param server_root: directory for relative paths, by default ServerRoot or directory of config file
+    :param workers: number of threads for stat
+    :param stats: StatCache, new one by default (each path is stat'ed once per run)
+    :return: list of Finding, sorted by path and line
+    """
+    stats = stats or StatCache()
+    paths, findings, hostnames = collect(root, env, server_root)
+
+    keys = list(paths)
+    with ThreadPoolExecutor(workers) as executor:
+        results = executor.map(lambda key: check_path(key[0], key[1], stats), keys)
+        for key, problem in zip(keys, results):
+            if problem is not None:
+                for node in paths[key]:
+                    findings.append(Finding(problem[0], '{}: {}'.format(node._cmd, problem[1]), node))
+
+    for (hostname, address), hosts in hostnames.items():
+        first = hosts[0][1]
+        for vhost, node in hosts[1:]:
+            findings.append(Finding('duplicate_hostname', '{} {} is also in vhost at {}:{}'.format(
+                hostname, address, first.path, first.line), node))
+
+    findings.sort(key=lambda f: (f.path or '', f.line or 0))
+    return findings
@@ -0,0 +1,211 @@
+import re
+
+# conditional sections which are evaluated, other <If*> sections (IfFile, IfDirective, IfSection) are always active
+CONDITIONAL_SECTIONS = frozenset(['ifmodule', 'ifdefine', 'ifversion'])
+TRANSPARENT_SECTIONS = frozenset(['iffile', 'ifdirective', 'ifsection'])
+
+_version_re = re.compile(r'^\s*(!)?\s*(==|=|>=|<=|>|<|~)?\s*(.*?)\s*$')
+
+
+def module_id(name):
+    """ Normalize module name: 'mod_ssl.c', 'ssl_module', 'mod_ssl.so' and 'ssl' are all 'ssl' """
+    name = name.strip().lower()
+    name = name.rsplit('/', 1)[-1]
+    if name.startswith('mod_'):
+        name = name[4:]
+    for suffix in ('.c', '.so', '.cpp'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    if name.endswith('_module'):
+        name = name[:-7]
+    return name
+
+
+def parse_version(version):
+    """ Return tuple of ints from '2.4.41' (or tuple) """
+    if isinstance(version, str):
+        return tuple(int(x) for x in re.findall(r'\d+', version))
+    return tuple(version)
+
+
+def _negate(args):
+    args = args.strip()
+    if args.startswith('!'):
+        return True, args[1:].strip()
+    return False, args
+
+
+def is_active(node, modules, defines, version):
+    """ Return True if conditional section is active for these modules, defines and version (None: any version), or
+    node is not conditional section """
+    section = node._section
+    if section is None:
+        return True
+    section = section.lower()
+    if section == 'ifmodule':
+        negate, name = _negate(node.args)
+        return (module_id(name) in modules) != negate
+    if section == 'ifdefine':
+        negate, name = _negate(node.args)
+        return (name in defines) != negate
+    if section == 'ifversion':
+        return _version_match(node.args, version)
+    return True
+
+
+def _version_match(args, version):
+    if version is None:
+        return True
+    m = _version_re.match(args)
+    negate, op, value = m.group(1), m.group(2) or '=', m.group(3)
+    if op == '~' or (value.startswith('/') and value.endswith('/')):
+        text = '.'.join(str(x) for x in version)
+        result = re.search(value.strip('/'), text) is not None
+    else:
+        wanted = parse_version(value)
+        have = version[:len(wanted)]
+        result = {'=': have == wanted, '==': have == wanted, '>': have > wanted, '>=': have >= wanted,
+                  '<': have < wanted, '<=': have <= wanted}[op]
+    return result != bool(negate)
+
+
+def conditions(root, modules=None, defines=(), version=None):
+    """ Return (module ids, define names) as apache has them after reading config
+
+    LoadModule, Define and UnDefine are taken in document order from live content only: each conditional section is
+    evaluated with modules and defines known when it's reached.
+    :param modules: module ids, if given LoadModule directives are not used
+    :param defines: names defined before config is read (as with -D)
+    """
+    loaded = set(modules or ())
+    defined = set(defines)
+    stack = [ iter(root._content or ()) ]
+    while stack:
+        for c in stack[-1]:
+            if c._section is not None:
+                if c._content and is_active(c, loaded, defined, version):
+                    stack.append(iter(c._content))
+                    break
+                continue
+            cmd = c._cmd
+            if cmd is None or not c._args:
+                continue
+            cmd = cmd.lower()
+            if cmd == 'loadmodule' and modules is None:
+                loaded.add(module_id(c._args.split()[0]))
+            elif cmd == 'define':
+                defined.add(c._args.split()[0])
+            elif cmd == 'undefine':
+                defined.discard(c._args.split()[0])
+        else:
+            stack.pop()
+    return frozenset(loaded), frozenset(defined)
+
+
+class ConditionalView(object):
+    """ Tree as apache would see it for given modules, defines and version
+
+    Active <IfModule>, <IfDefine> and <IfVersion> sections are transparent (their content is seen as content of
+    their parent), inactive ones are pruned with all their content. Nodes are not copied: for each section its live
+    children list is calculated once, on first access. Views are returned (and cached) by Node.view(), when tree
+    is changed, view calculates live children again.
+    """
+    def __init__(self, root, modules, defines, version, registry):
+        self.root = root
+        self.modules = modules # set of module ids
+        self.defines = defines # set of define names
+        self.version = version # tuple or None (all <IfVersion> are active)
+        self._live = dict() # id(node) -> list of live children
+        self._vhosts = None # hostname index for yield_vhost()
+        self._registry = registry # dict of views in root memo, it's dropped when tree is changed
+
+    def _check(self):
+        """ Drop calculated live children if tree is changed since they were calculated """
+        memo = self.root._memo
+        if memo is None or memo.get('views') is not self._registry:
+            self._live = dict()
+            self._vhosts = None
+            if self.root._memo is None:
+                self.root._memo = dict()
+            self._registry = self.root._memo.setdefault('views', dict())
+
+    def is_active(self, node):
+        """ Return True if conditional section is active (or node is not conditional section) """
+        return is_active(node, self.modules, self.defines, self.version)
+
+    def content(self, node=None):
+        """ Return list of live children of node (root by default) """
+        self._check()
+        node = self.root if node is None else node
+        live = self._live.get(id(node))
+        if live is None:
+            live = self._live[id(node)] = list()
+            stack = [ iter(node._content or ()) ]
+            while stack:
+                for c in stack[-1]:
+                    section = c._section
+                    if section is not None:
+                        section = section.lower()
+                        if section in CONDITIONAL_SECTIONS or section in TRANSPARENT_SECTIONS:
+                            if c._content and self.is_active(c):
+                                stack.append(iter(c._content))
+                                break
+                            continue
+                    live.append(c)
+                else:
+                    stack.pop()
+        return live
+
+    def children(self, name=None, recursive=False, node=None):
+        """ Same as Node.children(), but only live nodes are returned """
+        name = name.lower() if name else None
+        stack = [ iter(self.content(node)) ]
+        while stack:
+            for c in stack[-1]:
+                if name is None or c.name.lower() == name:
+                    yield c
+                if recursive and c._content:
+                    stack.append(iter(self.content(c)))
+                    break
+            else:
+                stack.pop()
+
+    def first(self, name, recursive=False, node=None):
+        """ Same as Node.first(), but only live nodes are returned """
+        return next(self.children(name, recursive, node), None)
+
+    def yield_vhost(self, hostname, arg=None):
+        """ Yield live vhosts (in live content of root) with hostname in ServerName/ServerAlias """
+        self._check()
+        if self._vhosts is None:
+            self._vhosts = dict()
+            for vhost in self.children('<VirtualHost>'):
+                for h in self.hostnames(vhost):
+                    vhosts = self._vhosts.setdefault(h.lower(), list())
+                    if not vhosts or vhosts[-1] is not vhost:
+                        vhosts.append(vhost)
+
+        for vhost in self._vhosts.get(hostname.lower(), ()):
+            if arg and arg not in vhost.args:
+                continue
+            yield vhost
+
+    def find_vhost(self, hostname, arg=None):
+        from . import VhostNotFound
+        for vhost in self.yield_vhost(hostname, arg):
+            return vhost
+        raise VhostNotFound('Vhost args: {} host: {} not found'.format(arg, hostname))
+
+    def hostnames(self, vhost):
+        """ Live ServerName and ServerAlias names of vhost """
+        names = list()
+        servername = self.first('ServerName', node=vhost)
+        if servername is not None:
+            names.append(servername.args)
+        for alias in self.children('ServerAlias', node=vhost):
+            names.extend(alias.args.split())
+        return names
+
+    def __repr__(self):
+        return '<ConditionalView modules={} defines={} version={}>'.format(len(self.modules), sorted(self.defines),
+                                                                            self.version)
@@ -0,0 +1,6 @@
+"""
+a2conf benchmarks
+
+generator.py writes synthetic apache config trees, run.py runs scenarios against them
+and prints results as JSON. bench_*.py are standalone scripts comparing with old implementations.
+"""
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Load time of config tree without ParseCache, with cold cache and with warm cache
+
+usage: bench_cache.py [NUM_FILES] [VHOSTS_PER_FILE]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import a2conf
+from bench_parse import VHOST
+
+
+def timeit(f, *args, **kwargs):
+    """ best of 5 runs """
+    times = list()
+    for _ in range(5):
+        start = time.perf_counter()
+        f(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    nfiles = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    nvhosts = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    tmpdir = tempfile.mkdtemp(prefix='a2conf-bench-')
+    try:
+        sites = os.path.join(tmpdir, 'sites-enabled')
+        os.mkdir(sites)
+        for f in range(nfiles):
+            with open(os.path.join(sites, 'site{}.conf'.format(f)), 'w') as fh:
+                for n in range(nvhosts):
+                    fh.write(VHOST.format(n=f*nvhosts + n))
+
+        main_conf = os.path.join(tmpdir, 'apache2.conf')
+        with open(main_conf, 'w') as fh:
+            fh.write('ServerRoot {}\nIncludeOptional sites-enabled/*.conf\n'.format(tmpdir))
+
+        cachedir = os.path.join(tmpdir, 'cache')
+
+        def cold():
+            shutil.rmtree(cachedir, ignore_errors=True)
+            a2conf.Node(main_conf, cache=cachedir)
+
+        t_nocache = timeit(a2conf.Node, main_conf)
+        t_cold = timeit(cold)
+        cache = a2conf.ParseCache(cachedir)
+        t_warm = timeit(a2conf.Node, main_conf, cache=cache)
+
+        print("files:       {} ({} vhosts)".format(nfiles + 1, nfiles * nvhosts))
+        print("no cache:    {:.3f}s".format(t_nocache))
+        print("cold cache:  {:.3f}s".format(t_cold))
+        print("warm cache:  {:.3f}s ({:.1f}x faster, {} hits)".format(t_warm, t_nocache / t_warm, cache.hits // 5))
+        print("cache size:  {} bytes".format(cache.size()))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
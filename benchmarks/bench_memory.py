@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Report memory used per Node: old __dict__ based layout vs __slots__ Node
+
+usage: bench_memory.py [NUM_VHOSTS]
+"""
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import a2conf
+from bench_parse import VHOST, legacy_tokenize
+
+
+class LegacyNode(object):
+    """ attribute layout of Node before __slots__ """
+    def __init__(self, raw=None, parent=None, path=None, line=None):
+        name, section, cmd, args, suffix = legacy_tokenize(raw) if raw else ('#root', None, None, None, None)
+        self.raw = raw
+        self.parent = parent
+        self.content = list()
+        self.prefix = ' '*4
+        self.section = section
+        self.cmd = cmd
+        self.args = args
+        self.suffix = suffix
+        self.last_child = None
+        self.includes = True
+        self.path = path
+        self.line = line
+        self.name = name
+
+
+def legacy_load(filename):
+    root = parent = LegacyNode()
+    with open(filename) as fh:
+        for line, l in enumerate(fh, 1):
+            l = l.strip()
+            if not l:
+                continue
+            if l.startswith('</'):
+                parent = parent.parent
+                continue
+            node = LegacyNode(raw=l, parent=parent, path=filename, line=line)
+            parent.content.append(node)
+            if l.startswith('<'):
+                parent = node
+    return root
+
+
+def count(node):
+    return 1 + sum(count(c) for c in node.content)
+
+
+def measure(loader, path):
+    tracemalloc.start()
+    root = loader(path)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, count(root)
+
+
+def main():
+    nvhosts = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    with tempfile.NamedTemporaryFile('w', suffix='.conf', delete=False) as fh:
+        for n in range(nvhosts):
+            fh.write(VHOST.format(n=n))
+        path = fh.name
+
+    try:
+        legacy_size, nodes = measure(legacy_load, path)
+        size, nodes = measure(a2conf.Node, path)
+
+        print("nodes:               {}".format(nodes))
+        print("legacy bytes/node:   {:.0f}".format(legacy_size / nodes))
+        print("Node bytes/node:     {:.0f} ({:.1f}x less)".format(size / nodes, legacy_size / size))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
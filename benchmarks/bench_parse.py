@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Compare single-pass tokenize() with the old per-line parsing done in Node.__init__
+
+usage: bench_parse.py [NUM_VHOSTS]
+"""
+import os
+import re
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import a2conf
+
+
+VHOST = """# vhost {n}
+<VirtualHost *:80 *:443>
+    ServerName site{n}.example.com  # primary name
+    ServerAlias www.site{n}.example.com alias{n}.example.com
+    DocumentRoot /var/www/site{n}
+    CustomLog ${{APACHE_LOG_DIR}}/site{n}-access.log combined
+    ErrorLog ${{APACHE_LOG_DIR}}/site{n}-error.log
+    <Directory /var/www/site{n}>
+        Options -Indexes +FollowSymLinks
+        AllowOverride All
+    </Directory>
+    <IfModule mod_ssl.c>
+        SSLEngine on
+        SSLCertificateFile /etc/letsencrypt/live/site{n}.example.com/fullchain.pem
+        SSLCertificateKeyFile /etc/letsencrypt/live/site{n}.example.com/privkey.pem
+    </IfModule>
+</VirtualHost>
+
+"""
+
+
+def legacy_tokenize(raw):
+    """ what Node.__init__ did for every line before tokenize() """
+    suffix = None
+    section = cmd = args = None
+    match = re.search(r'(\s*#.*)$', raw)
+    if match:
+        suffix = match.group(0)
+    else:
+        suffix = ''
+    name = raw.strip().split(' ')[0]
+    if name.startswith('<') and not name.endswith('>'):
+        name += '>'
+
+    if re.match('^[ \t]*<(?!/)', raw):
+        m = re.match('[ \t]*<([^ >]+)([^>]*)', raw)
+        section = m.group(1)
+        args = m.group(2).strip()
+    elif re.match('[ \t]*</', raw):
+        m = re.match('[ \t]*<(/[^ >]+)([^>]*)', raw)
+        section = m.group(1)
+    else:
+        cmdline = raw.split('#')[0].strip()
+        if cmdline:
+            m = re.match('[ \t]*([^ \t]+)[ \t]*([^#]*)', cmdline)
+            cmd = m.group(1)
+            args = m.group(2).strip()
+
+    # read_file() called is_open() and is_close() once more
+    re.match('^[ \t]*<(?!/)', raw)
+    re.match('[ \t]*</', raw)
+    return (name, section, cmd, args, suffix)
+
+
+def timeit(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    nvhosts = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    with tempfile.NamedTemporaryFile('w', suffix='.conf', delete=False) as fh:
+        for n in range(nvhosts):
+            fh.write(VHOST.format(n=n))
+        path = fh.name
+
+    try:
+        with open(path) as fh:
+            lines = [l.strip() for l in fh if l.strip()]
+
+        t_legacy = timeit(lambda: [legacy_tokenize(l) for l in lines])
+        t_new = timeit(lambda: [a2conf.tokenize(l) for l in lines])
+        t_load = timeit(a2conf.Node, path)
+
+        print("lines:            {}".format(len(lines)))
+        print("legacy tokenize:  {:.3f}s".format(t_legacy))
+        print("tokenize():       {:.3f}s ({:.1f}x)".format(t_new, t_legacy / t_new))
+        print("Node(path) load:  {:.3f}s".format(t_load))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
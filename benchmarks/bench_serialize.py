@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Compare dump() with serialize() on big config, before and after one-line change
+
+usage: bench_serialize.py [NUM_LINES]
+"""
+import io
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import a2conf
+from bench_parse import VHOST
+
+
+def timeit(f, *args):
+    """ best of 3 runs """
+    times = list()
+    for _ in range(3):
+        start = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def dump(root):
+    fh = io.StringIO()
+    root.dump(fh)
+    return fh.getvalue()
+
+
+def main():
+    nlines = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    vhost_lines = VHOST.count('\n')
+
+    with tempfile.NamedTemporaryFile('w', suffix='.conf', delete=False) as fh:
+        for n in range(nlines // vhost_lines):
+            fh.write(VHOST.format(n=n))
+        path = fh.name
+
+    try:
+        with open(path) as fh:
+            text = fh.read()
+        root = a2conf.Node(path)
+
+        t_dump = timeit(dump, root)
+        t_serialize = timeit(root.serialize)
+        same = root.serialize() == text
+
+        root.find_vhost('site1.example.com').first('DocumentRoot').args = '/var/www/changed'
+        changed = sum(1 for a, b in zip(text.split('\n'), root.serialize().split('\n')) if a != b)
+        changed_dump = sum(1 for a, b in zip(text.split('\n'), dump(root).split('\n')) if a != b)
+
+        print("lines:          {}".format(text.count('\n')))
+        print("dump():         {:.3f}s".format(t_dump))
+        print("serialize():    {:.3f}s ({:.1f}x)".format(t_serialize, t_dump / t_serialize))
+        print("round-trip:     {}".format('identical' if same else 'DIFFERENT'))
+        print("lines changed after one edit: serialize() {}, dump() {}".format(changed, changed_dump))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Deterministic generator of realistic apache config trees for benchmarks
+
+usage: python -m benchmarks.generator DIRECTORY [--vhosts N] [--depth D] [--seed S]
+"""
+import os
+import random
+import argparse
+
+
+MODULES = ['ssl', 'rewrite', 'headers', 'proxy', 'proxy_http', 'expires', 'deflate', 'http2']
+
+MAIN = """\
+{comments}
+ServerRoot "/etc/apache2"
+DefaultRuntimeDir ${{APACHE_RUN_DIR}}
+PidFile ${{APACHE_PID_FILE}}
+Timeout 300
+KeepAlive On
+MaxKeepAliveRequests 100
+KeepAliveTimeout 5
+User ${{APACHE_RUN_USER}}
+Group ${{APACHE_RUN_GROUP}}
+HostnameLookups Off
+ErrorLog ${{APACHE_LOG_DIR}}/error.log
+LogLevel warn
+{modules}
+Listen 80
+<IfModule mod_ssl.c>
+    Listen 443
+    SSLProtocol all -SSLv3 -TLSv1 -TLSv1.1
+    <IfModule mod_http2.c>
+        Protocols h2 http/1.1
+    </IfModule>
+</IfModule>
+<Directory />
+    Options FollowSymLinks
+    AllowOverride None
+    Require all denied
+</Directory>
+<Directory /var/www/>
+    Options Indexes FollowSymLinks
+    AllowOverride None
+    Require all granted
+</Directory>
+AccessFileName .htaccess
+LogFormat "%h %l %u %t \\"%r\\" %>s %O \\"%{{Referer}}i\\" \\"%{{User-Agent}}i\\"" combined
+IncludeOptional {confdir}/*.conf
+IncludeOptional {sitesdir}/*.conf
+"""
+
+
+def hostname(n):
+    return 'site{}.example.com'.format(n)
+
+
+def comment_block(rnd, max_lines, indent=''):
+    lines = rnd.randint(0, max_lines)
+    words = ['apache', 'config', 'vhost', 'managed', 'by', 'provisioning', 'do', 'not', 'edit', 'this', 'file']
+    return ''.join('{}# {}\n'.format(indent, ' '.join(rnd.choice(words) for _ in range(rnd.randint(2, 10))))
+                   for _ in range(lines))
+
+
+def vhost(n, rnd, aliases, comment_lines):
+    """ Return text of one (or two, for SSL sites) VirtualHost """
+    name = hostname(n)
+    alias_list = ['www.' + name] + ['alias{}.{}'.format(a, name) for a in range(rnd.randint(0, aliases))]
+    ssl = rnd.random() < 0.5
+
+    body = list()
+    body.append(comment_block(rnd, comment_lines, '    '))
+    body.append('    ServerName {}\n'.format(name))
+    body.append('    ServerAlias {}\n'.format(' '.join(alias_list)))
+    body.append('    ServerAdmin webmaster@{}\n'.format(name))
+    body.append('    DocumentRoot /var/www/{}\n'.format(name))
+    if rnd.random() < 0.7:
+        body.append('    CustomLog ${{APACHE_LOG_DIR}}/{}-access.log combined\n'.format(name))
+    if rnd.random() < 0.7:
+        body.append('    ErrorLog ${{APACHE_LOG_DIR}}/{}-error.log\n'.format(name))
+    body.append('\n')
+    body.append('    <Directory /var/www/{}>\n'.format(name))
+    body.append('        Options -Indexes +FollowSymLinks\n')
+    body.append('        AllowOverride All\n')
+    body.append('        <IfModule mod_rewrite.c>\n')
+    body.append('            RewriteEngine On\n')
+    for r in range(rnd.randint(0, 4)):
+        body.append('            RewriteRule ^/old{}/(.*)$ /new{}/$1 [R=301,L]\n'.format(r, r))
+    body.append('        </IfModule>\n')
+    body.append('    </Directory>\n')
+    for r in range(rnd.randint(0, 2)):
+        body.append('    Redirect permanent /legacy{} https://{}/\n'.format(r, name))
+    body = ''.join(body)
+
+    text = '<VirtualHost *:80>\n{}</VirtualHost>\n\n'.format(body)
+    if ssl:
+        text += ('<IfModule mod_ssl.c>\n<VirtualHost *:443>\n{}'
+                 '    SSLEngine on\n'
+                 '    SSLCertificateFile /etc/letsencrypt/live/{name}/fullchain.pem\n'
+                 '    SSLCertificateKeyFile /etc/letsencrypt/live/{name}/privkey.pem\n'
+                 '    SSLCertificateChainFile /etc/letsencrypt/live/{name}/chain.pem\n'
+                 '</VirtualHost>\n</IfModule>\n\n').format(body, name=name)
+    return text
+
+
+def write_tree(dirpath, ids, depth, options, rnd):
+    """ Write vhost files for ids into dirpath. Until depth is 0, split ids into sub-directories
+    included via IncludeOptional from index files """
+    os.makedirs(dirpath, exist_ok=True)
+
+    if depth == 0 or len(ids) <= options['per_file']:
+        per_file = options['per_file']
+        for i in range(0, len(ids), per_file):
+            with open(os.path.join(dirpath, '{}.conf'.format(hostname(ids[i]))), 'w') as fh:
+                for n in ids[i:i+per_file]:
+                    fh.write(vhost(n, rnd, options['aliases'], options['comments']))
+        return
+
+    fanout = options['fanout']
+    chunk = -(-len(ids) // fanout)
+    for part in range(fanout):
+        part_ids = ids[part*chunk:(part+1)*chunk]
+        if not part_ids:
+            break
+        subdir = os.path.join(dirpath, 'part{:03d}'.format(part))
+        with open(subdir + '.conf', 'w') as fh:
+            fh.write(comment_block(rnd, options['comments']))
+            fh.write('IncludeOptional {}/*.conf\n'.format(subdir))
+        write_tree(subdir, part_ids, depth - 1, options, rnd)
+
+
+def generate(directory, vhosts=1000, depth=2, fanout=10, per_file=5, aliases=5, comments=10, seed=0):
+    """ Write config tree into directory, return path of main config file
+
+    Same arguments give same tree.
+    :param vhosts: number of sites (about half of them also have SSL vhost)
+    :param depth: levels of IncludeOptional directories between main config and vhost files
+    :param fanout: number of sub-directories on each level
+    :param per_file: sites per vhost file
+    :param aliases: max number of extra ServerAlias names per site
+    :param comments: max lines in each comment block
+    """
+    rnd = random.Random(seed)
+    directory = os.path.abspath(directory)
+    confdir = os.path.join(directory, 'conf-enabled')
+    sitesdir = os.path.join(directory, 'sites-enabled')
+    os.makedirs(confdir, exist_ok=True)
+
+    modules = ''.join('LoadModule {0}_module /usr/lib/apache2/modules/mod_{0}.so\n'.format(m) for m in MODULES)
+    main = os.path.join(directory, 'apache2.conf')
+    with open(main, 'w') as fh:
+        fh.write(MAIN.format(comments=comment_block(rnd, 50), modules=modules, confdir=confdir, sitesdir=sitesdir))
+
+    with open(os.path.join(confdir, 'security.conf'), 'w') as fh:
+        fh.write(comment_block(rnd, comments))
+        fh.write('ServerTokens Prod\nServerSignature Off\nTraceEnable Off\n')
+
+    options = dict(fanout=fanout, per_file=per_file, aliases=aliases, comments=comments)
+    write_tree(sitesdir, list(range(vhosts)), depth, options, rnd)
+    return main
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic apache config tree')
+    parser.add_argument('directory')
+    parser.add_argument('--vhosts', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--per-file', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(generate(args.directory, vhosts=args.vhosts, depth=args.depth, fanout=args.fanout,
+                   per_file=args.per_file, seed=args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Run benchmark scenarios on generated configs, print results as JSON
+
+usage: python -m benchmarks.run [--vhosts N [N ...]] [--output FILE] [--compare OLD.json]
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import a2conf
+from benchmarks.generator import generate, hostname
+
+
+def best(f, repeat):
+    """ return (best time, result of last call) """
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def scenario_parse(main, repeat):
+    t, root = best(lambda: a2conf.Node(main), repeat)
+    nodes = sum(1 for _ in root.children(recursive=True))
+    return dict(parse_s=t, nodes=nodes, files=len(root.loaded_files())), root
+
+
+def scenario_memory(main):
+    tracemalloc.start()
+    root = a2conf.Node(main)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    nodes = sum(1 for _ in root.children(recursive=True))
+    return dict(memory_peak_bytes=peak, memory_bytes=current, bytes_per_node=current / nodes)
+
+
+def scenario_lookup(root, vhosts, lookups, repeat):
+    rnd = random.Random(1)
+    names = [hostname(rnd.randrange(vhosts)) for _ in range(lookups)]
+    names += ['www.' + n for n in names[:lookups // 2]]
+
+    # first lookup builds hostname index
+    start = time.perf_counter()
+    root.find_vhost(names[0])
+    t_index = time.perf_counter() - start
+
+    t, _ = best(lambda: [root.find_vhost(n) for n in names], repeat)
+    t_miss, _ = best(lambda: list(root.yield_vhost('missing.example.com')), repeat)
+    t_first, _ = best(lambda: [vh.first('DocumentRoot') for vh in root.children('<VirtualHost>')], repeat)
+    t_scan, found = best(lambda: list(root.children('SSLCertificateFile', recursive=True)), repeat)
+    return dict(lookup_index_s=t_index,
+                lookup_us=t / len(names) * 10**6,
+                lookup_miss_us=t_miss * 10**6,
+                first_all_vhosts_s=t_first,
+                recursive_scan_s=t_scan,
+                recursive_scan_found=len(found))
+
+
+def scenario_serialize(root, repeat):
+    def dump():
+        fh = io.StringIO()
+        root.dump(fh)
+        return fh.getvalue()
+
+    t_dump, _ = best(dump, repeat)
+    t_serialize, text = best(root.serialize, repeat)
+    return dict(dump_s=t_dump, serialize_s=t_serialize, serialize_bytes=len(text))
+
+
+def scenario_mutation(root):
+    """ changes tree, run last """
+    vhosts = list(root.children('<VirtualHost>', recursive=True))
+
+    start = time.perf_counter()
+    for vh in vhosts:
+        vh.insert('Header set X-Benchmark 1')
+        vh.first('DocumentRoot').args = '/srv/www'
+    t_insert = time.perf_counter() - start
+
+    start = time.perf_counter()
+    deleted = 0
+    for vh in vhosts:
+        for c in list(vh.children('Redirect')):
+            c.delete()
+            deleted += 1
+    t_delete = time.perf_counter() - start
+
+    t_serialize, _ = best(root.serialize, 1)
+
+    # delete 10% of top level sections one by one and another 10% via Batch
+    top = [ c for c in root.children() if c.section ]
+    start = time.perf_counter()
+    for c in top[0::20]:
+        c.delete()
+    t_delete_top = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with root.batch() as batch:
+        for c in top[1::20]:
+            batch.delete(c)
+    t_batch = time.perf_counter() - start
+
+    return dict(mutation_insert_s=t_insert, mutation_delete_s=t_delete, mutation_deleted=deleted,
+                mutation_vhosts=len(vhosts), dirty_files=len(root.dirty_files()),
+                serialize_modified_s=t_serialize,
+                mutation_delete_top_s=t_delete_top, mutation_batch_delete_top_s=t_batch,
+                mutation_batch_deleted=batch.summary['deleted'])
+
+
+def run(vhosts, repeat, lookups, depth):
+    directory = tempfile.mkdtemp(prefix='a2conf-bench-')
+    try:
+        start = time.perf_counter()
+        main = generate(directory, vhosts=vhosts, depth=depth)
+        result = dict(vhosts=vhosts, generate_s=time.perf_counter() - start)
+
+        r, root = scenario_parse(main, repeat)
+        result.update(r)
+        result.update(scenario_memory(main))
+        result.update(scenario_lookup(root, vhosts, lookups, repeat))
+        result.update(scenario_serialize(root, repeat))
+        result.update(scenario_mutation(root))
+        return result
+    finally:
+        shutil.rmtree(directory)
+
+
+def compare(old, new, fh=sys.stderr):
+    """ print ratio new/old for each numeric metric of same vhosts count """
+    old = {r['vhosts']: r for r in old['results']}
+    for r in new['results']:
+        base = old.get(r['vhosts'])
+        if base is None:
+            continue
+        print("vhosts: {}".format(r['vhosts']), file=fh)
+        for k, v in r.items():
+            if k == 'vhosts' or not isinstance(v, (int, float)) or not base.get(k):
+                continue
+            print("    {:24} {:>14.6g} {:>14.6g} {:>7.2f}x".format(k, base[k], v, v / base[k]), file=fh)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='a2conf benchmarks')
+    parser.add_argument('--vhosts', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3, help='take best of REPEAT runs')
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=2, help='IncludeOptional directory levels')
+    parser.add_argument('-o', '--output', help='write JSON here instead of stdout')
+    parser.add_argument('--compare', metavar='OLD', help='print ratios against results from previous run')
+    args = parser.parse_args()
+
+    data = dict(
+        meta=dict(python=platform.python_version(), implementation=platform.python_implementation(),
+                  machine=platform.machine(), time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  repeat=args.repeat, lookups=args.lookups, depth=args.depth),
+        results=[run(n, args.repeat, args.lookups, args.depth) for n in args.vhosts])
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(data, fh, indent=4)
+    else:
+        json.dump(data, sys.stdout, indent=4)
+        print()
+
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(json.load(fh), data)
+
+
+if __name__ == '__main__':
+    main()
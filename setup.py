@@ -11,7 +11,9 @@ setup(
     name='a2conf',
     version='0.3.4',
     packages=['a2conf'],
-    # scripts=[ 'bin/a2conf', 'bin/apache2okerr.py', 'bin/apache2-certbot-diag.py' ],
+    entry_points={
+        'console_scripts': [ 'a2conf=a2conf.cli:main' ],
+    },
 
     # install_requires=[],
 
@@ -0,0 +1,28 @@
+import pytest
+import os
+
+
+@pytest.fixture
+def confdir(tmp_path):
+    """ empty directory for config files of test """
+    return str(tmp_path)
+
+
+@pytest.fixture
+def write(confdir):
+    """ write(name, content) - write file (relative to confdir), return its path """
+    def write(name, content):
+        path = os.path.join(confdir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fh:
+            fh.write(content)
+        return path
+    return write
+
+
+@pytest.fixture
+def vhost():
+    """ vhost(hostname) - text of minimal VirtualHost """
+    def vhost(hostname):
+        return "<VirtualHost *:80>\n    ServerName {}\n</VirtualHost>\n".format(hostname)
+    return vhost
@@ -1,7 +1,14 @@
 from a2conf import Node
 import pytest
 from tempfile import mkdtemp
+from concurrent.futures import ProcessPoolExecutor
+import io
+import asyncio
+import threading
 import os
+import sys
+import copy
+import pickle
 
 import a2conf
 
@@ -41,6 +48,72 @@ examples = {
 
 """,
 
+'multiline': """# comment \\
+  continued comment
+<VirtualHost *:80>
+    ServerName example.com
+    ServerAlias www.example.com \\
+        a.example.com
+
+    # comment
+    DocumentRoot /var/www
+</VirtualHost>
+""",
+
+'effective': """Define SITES /var/www
+Define LOGS ${{APACHE_LOG_DIR}}/sites
+ServerAdmin root@example.com
+ErrorLog ${{APACHE_LOG_DIR}}/error.log
+<IfModule mod_ssl.c>
+    SSLProtocol all -SSLv3
+</IfModule>
+<Directory /var/www>
+    Options None
+</Directory>
+<VirtualHost *:443>
+    ServerName example.com
+    DocumentRoot ${{SITES}}/example.com
+    ErrorLog ${{LOGS}}/example.com-error.log
+    <IfModule mod_ssl.c>
+        SSLEngine on
+    </IfModule>
+    <Directory ${{SITES}}/example.com>
+        Options Indexes
+    </Directory>
+</VirtualHost>
+<VirtualHost *:80>
+    ServerName example.net
+</VirtualHost>
+""",
+
+'view': """LoadModule ssl_module /usr/lib/apache2/modules/mod_ssl.so
+Define PROD
+<IfModule mod_ssl.c>
+    Listen 443
+    <IfModule !rewrite_module>
+        Listen 8443
+    </IfModule>
+</IfModule>
+<IfModule mod_php7.c>
+    Listen 9000
+</IfModule>
+<IfDefine !PROD>
+    <VirtualHost *:80>
+        ServerName example.com
+        DocumentRoot /var/www/dev
+    </VirtualHost>
+</IfDefine>
+<IfVersion >= 2.4>
+    <VirtualHost *:80>
+        ServerName example.com
+        <IfDefine DEBUG>
+            ServerAlias debug.example.com
+        </IfDefine>
+        DocumentRoot /var/www/prod
+    </VirtualHost>
+</IfVersion>
+""",
+
 'include': 'Include {confdir}/c1.conf',
 'include_glob': 'Include {confdir}/c*.conf'
 }
@@ -188,3 +261,408 @@ class TestClass:
     
 
 
+
+    def test_tokenize(self):
+        kind, section, cmd, args = a2conf.tokenize('ServerName example.com  # main name')
+        assert kind == a2conf.DIRECTIVE
+        assert (cmd, args) == ('ServerName', 'example.com')
+
+        kind, section, cmd, args = a2conf.tokenize('<VirtualHost *:80 *:443>')
+        assert kind == a2conf.OPEN
+        assert (section, args) == ('VirtualHost', '*:80 *:443')
+
+        # > in args and in comment after section
+        assert a2conf.tokenize('<IfVersion >= 2.4>')[3] == '>= 2.4'
+        assert a2conf.tokenize('<VirtualHost *:80> # see <foo>')[3] == '*:80'
+        assert a2conf.tokenize('<Directory /var/www>  # x > y')[3] == '/var/www'
+        assert Node(raw='<VirtualHost *:80> # see <foo>').format_line() == '<VirtualHost *:80> # see <foo>\n'
+
+        assert a2conf.tokenize('</VirtualHost>')[0] == a2conf.CLOSE
+        assert a2conf.tokenize('# comment')[0] == a2conf.COMMENT
+        assert a2conf.tokenize('')[0] == a2conf.BLANK
+
+        node = Node(raw='SSLEngine on', token=a2conf.tokenize('SSLEngine off'))
+        assert node.args == 'off'
+
+    def test_slots(self):
+        root = Node(files['c1'])
+        vh = root.first('<VirtualHost>')
+        name = vh.first('ServerName')
+
+        assert not hasattr(name, '__dict__')
+        assert name.name == 'ServerName'
+        assert name.suffix == ''
+        assert name.content == []
+        assert vh.path is name.path
+        # root-only data is not in slots of every node
+        assert name._memo is None and name._files is None
+        assert root._files is not None
+
+        name.suffix = ' # main'
+        assert name.suffix == ' # main'
+
+    def test_pickle(self):
+        root = Node(files['c1'])
+        for copied in (pickle.loads(pickle.dumps(root)), copy.deepcopy(root)):
+            vh = copied.first('<VirtualHost>')
+            assert vh.first('ServerName').args == 'example.com'
+            assert vh.first('ServerName').suffix == ''
+            assert copied.find_vhost('x.example.com') is vh
+
+    def test_vhost_index(self):
+        root = Node(files['c2'])
+        vh = root.find_vhost('EXAMPLE.com')
+        assert vh.first('ServerName').args == 'example.com'
+
+        # new vhost
+        new = root.insert('<VirtualHost *:80>')
+        new.insert('ServerName example.net')
+        assert root.find_vhost('example.net') is new
+
+        # edit ServerName
+        new.first('ServerName').args = 'example.org'
+        assert root.find_vhost('example.org') is new
+        with pytest.raises(a2conf.VhostNotFound):
+            root.find_vhost('example.net')
+
+        # new alias
+        new.insert('ServerAlias www.example.org', after='ServerName')
+        assert root.find_vhost('www.example.org', '*:80') is new
+
+        # delete vhost
+        vh.delete()
+        with pytest.raises(a2conf.VhostNotFound):
+            root.find_vhost('example.com')
+        assert root.find_vhost('www.example.com')
+
+    def test_named_index(self):
+        root = Node(files['c1'])
+        vh = root.first('<VirtualHost>')
+
+        assert [c.args for c in vh.children('command1')] == ['first', 'second']
+
+        third = vh.insert('Command1 third')
+        # insert after last node updates index in place
+        names = vh._names
+        vh.insert('Command1 fourth', after='Command1')
+        assert vh._names is names
+        zero = vh.insert('Command1 zero', after='DocumentRoot')
+        assert [c.args for c in vh.children('COMMAND1')] == ['zero', 'first', 'second', 'third', 'fourth']
+
+        # delete while iterating
+        for c in vh.children('Command1'):
+            c.delete()
+        assert vh.first('Command1') is None
+
+        vh.insert('Command1 again')
+        assert vh.first('command1').args == 'again'
+
+        vh.filter('command1')
+        assert vh.first('command1') is None
+        assert vh.first('ServerName').args == 'example.com'
+
+    def test_parallel(self):
+        def dump(root):
+            fh = io.StringIO()
+            root.dump(fh)
+            return fh.getvalue()
+
+        serial = Node(files['include_glob'])
+        paths = [ n.path for n in serial.children(recursive=True) ]
+        assert paths[1:] == sorted(paths[1:])
+
+        assert dump(Node(files['include_glob'], parallel=4)) == dump(serial)
+        with ProcessPoolExecutor(2) as executor:
+            root = Node(files['include_glob'], parallel=executor)
+            assert dump(root) == dump(serial)
+            assert root.find_vhost('www.example.com', '*:443')
+
+    def test_iterparse(self):
+        events = list(a2conf.iterparse(files['include_glob']))
+        starts = [ n for e, n in events if e == 'start' ]
+        ends = [ n for e, n in events if e == 'end' ]
+        assert [ n.name for n in starts ] == ['<VirtualHost>', '<IfModule>', '<VirtualHost>', '<VirtualHost>']
+        assert sorted(map(id, starts)) == sorted(map(id, ends))
+
+        ssl = [ n for e, n in events if e == 'directive' and n.cmd == 'SSLEngine' ][0]
+        assert ssl.path == files['c1'] and ssl.line == 16
+        assert ssl.parent.section == 'IfModule'
+        assert ssl.parent.parent.name == '<VirtualHost>'
+
+        comments = [ n for e, n in a2conf.iterparse(files['c1'], comments=True) if e == 'comment' ]
+        assert comments[0].suffix == '# Test VirtualHost'
+
+    def test_iter_vhosts(self):
+        vhosts = list(a2conf.iter_vhosts(files['include_glob']))
+        assert [ vh.first('ServerName').args for vh in vhosts ] == ['example.com', 'example.com', 'www.example.com']
+        assert vhosts[0].first('SSLEngine', recursive=True).args == 'on'
+        assert len(vhosts[0].hostnames()) == 4
+
+    def test_serialize(self):
+        # trailing spaces are not kept
+        with open(files['c1']) as fh:
+            text = ''.join(l.rstrip() + '\n' for l in fh)
+
+        root = Node(files['c1'])
+        assert root.serialize() == text
+
+        root.first('SSLEngine', recursive=True).args = 'off'
+        vh = root.first('<VirtualHost>')
+        vh.insert('ErrorLog /var/log/apache2/error.log', after='DocumentRoot')
+        vh.first('ServerAdmin').delete()
+
+        expected = text.replace('        SSLEngine on', '        SSLEngine off')
+        expected = expected.replace('    ServerAdmin postmaster@example.com\n', '')
+        expected = expected.replace('/htdocs/example.com\n', '/htdocs/example.com\n    ErrorLog /var/log/apache2/error.log\n')
+        assert root.serialize() == expected
+
+    def test_serialize_deep(self):
+        root = Node()
+        node = root
+        for n in range(5000):
+            node = node.insert('<IfModule mod{}.c>'.format(n))
+        text = root.serialize()
+        assert text.count('</IfModule>') == 5000
+
+    def test_select(self):
+        root = Node(files['include_glob'])
+
+        ssl = list(root.select('//VirtualHost[args~=":443"][ServerName=example.com]/IfModule[args=mod_ssl.c]/SSLCertificateFile'))
+        assert [ n.line for n in ssl ] == [17]
+        assert ssl == list(root.select('<VirtualHost>[ServerAlias=www.example.com]//sslcertificatefile'))
+        assert root.select_first('//*[SSLEngine=on]').name == '<IfModule>'
+
+        # document order, each node once
+        assert [ n.args for n in root.select('//VirtualHost//ServerName') ] == \
+            ['example.com', 'example.com', 'www.example.com']
+        assert [ n.args for n in root.select('//Command1') ] == ['first', 'second', 'nested']
+        assert [ n.args for n in root.select('VirtualHost[!IfModule]/ServerName') ] == ['example.com', 'www.example.com']
+        assert [ n.args for n in root.select('VirtualHost/*[args^=example]') ] == ['example.com', 'example.com']
+        assert list(root.select('//IfModule[args="mod_rewrite.c"]')) == []
+
+        assert a2conf.compile_selector('//ServerName') is a2conf.compile_selector('//ServerName')
+        for bad in ['', '//', 'VirtualHost//', '[args=x]', 'VirtualHost ServerName', 'VirtualHost[!SSLEngine=on]']:
+            with pytest.raises(a2conf.SelectorError):
+                a2conf.compile_selector(bad)
+
+    def test_reader(self):
+        with open(files['multiline']) as fh:
+            text = fh.read()
+
+        for reader in ['text', 'mmap']:
+            root = Node(files['multiline'], reader=reader)
+            assert root.serialize() == text
+            vh = root.find_vhost('a.example.com')
+            assert vh.first('ServerAlias').args.split() == ['www.example.com', 'a.example.com']
+            assert [ (c.line, c.name) for c in vh.children() ] == \
+                [(4, 'ServerName'), (5, 'ServerAlias'), (8, '#'), (9, 'DocumentRoot')]
+
+            root = Node(files['multiline'], reader=reader, comments=False)
+            assert [ c.name for c in root.children(recursive=True) ] == \
+                ['<VirtualHost>', 'ServerName', 'ServerAlias', 'DocumentRoot']
+            with pytest.raises(a2conf.MyException):
+                root.save_all()
+
+        stat, records = a2conf.read_mmap_records(files['include_glob'])
+        assert list(records) == list(a2conf.read_text_records(files['include_glob'])[1])
+
+    def test_aload(self):
+        paths = [files['c1'], files['include_glob'], files['c2']]
+        roots = asyncio.run(a2conf.aload_many(paths, limit=2))
+        assert [ r.serialize() for r in roots ] == [ Node(p).serialize() for p in paths ]
+        assert roots[1].loaded_files() == Node(files['include_glob']).loaded_files()
+
+        root = asyncio.run(a2conf.aload(files['include'], includes=False))
+        assert root.first('Include') and not root.first('<VirtualHost>')
+
+        results = asyncio.run(a2conf.aload_many([files['c1'], '/nonexistent.conf'], return_exceptions=True))
+        assert isinstance(results[1], FileNotFoundError)
+
+        cancel = threading.Event()
+        cancel.set()
+        with pytest.raises(a2conf.LoadCancelled):
+            Node().read_file(files['include_glob'], cancel=cancel)
+
+    def test_effective(self):
+        root = Node(files['effective'])
+        env = {'APACHE_LOG_DIR': '/var/log/apache2'}
+        conf = root.effective('example.com', env=env)
+        assert conf.get('DocumentRoot') == '/var/www/example.com'
+        assert conf.get('errorlog') == '/var/log/apache2/sites/example.com-error.log'
+        assert conf.get('ServerAdmin') == 'root@example.com'
+        assert conf.get('SSLProtocol') == 'all -SSLv3'
+        assert conf.get('SSLEngine') == 'on'
+        assert 'Options' not in conf
+        assert conf.nodes('ServerAdmin')[0].parent is root
+
+        net = root.effective('example.net')
+        assert net.get('ErrorLog') == '${APACHE_LOG_DIR}/error.log'
+        assert net.get('DocumentRoot') is None
+
+        # memoized until changed
+        assert root.effective('example.com', env=env) is conf
+        assert root.effective('example.net') is net
+        root.find_vhost('example.net').insert('DocumentRoot /srv/net')
+        assert root.effective('example.com', env=env) is conf
+        assert root.effective('example.net').get('DocumentRoot') == '/srv/net'
+
+        root.first('Define').args = 'SITES /srv'
+        conf2 = root.effective('example.com', env=env)
+        assert conf2 is not conf
+        assert conf2.get('DocumentRoot') == '/srv/example.com'
+
+        # Define in vhost is global, it's not a directive of vhost
+        net = root.find_vhost('example.net')
+        define = net.insert('Define SITES /opt')
+        conf3 = root.effective('example.com', env=env)
+        assert conf3.get('DocumentRoot') == '/opt/example.com'
+        assert 'Define' not in conf3.as_dict() and 'Define' not in root.effective('example.net').as_dict()
+        define.args = 'SITES /data'
+        assert root.effective('example.com', env=env).get('DocumentRoot') == '/data/example.com'
+        define.delete()
+        assert root.effective('example.com', env=env).get('DocumentRoot') == '/srv/example.com'
+
+    def test_view(self):
+        root = Node(files['view'])
+        view = root.view()
+        assert view.modules == {'ssl'}
+        assert [ c.args for c in view.children('Listen') ] == ['443', '8443']
+        vhost = view.find_vhost('example.com')
+        assert view.first('DocumentRoot', node=vhost).args == '/var/www/prod'
+        assert len(list(view.children('<VirtualHost>'))) == 1
+        with pytest.raises(a2conf.VhostNotFound):
+            view.find_vhost('debug.example.com')
+
+        # nodes are not copied
+        assert vhost in list(root.children('<VirtualHost>', recursive=True))
+
+        dev = root.view(modules=['mod_php7.c', 'rewrite'], defines=['DEBUG'], version='2.2.34')
+        assert [ c.args for c in dev.children('Listen') ] == ['9000']
+        assert list(dev.children('<VirtualHost>')) == []
+
+        debug = root.view(defines=['DEBUG'])
+        assert debug.find_vhost('debug.example.com') is vhost
+        assert debug.first('DocumentRoot', recursive=True).args == '/var/www/prod'
+
+        # cached until changed
+        assert root.view() is view
+        root.insert('LoadModule php7_module mod_php7.so')
+        assert root.view() is not view
+        assert [ c.args for c in root.view().children('Listen') ] == ['443', '8443', '9000']
+        # old view sees changed tree too
+        vhost.insert('ServerAlias www.example.com')
+        assert view.find_vhost('www.example.com') is vhost
+
+        # LoadModule and Define in inactive sections are not used
+        never = root.insert('<IfDefine NEVER>')
+        never.insert(['LoadModule rewrite_module mod_rewrite.so', 'Define DEBUG'])
+        root.insert('UnDefine PROD')
+        view = root.view()
+        assert 'rewrite' not in view.modules and view.defines == set()
+        assert [ c.args for c in view.children('Listen') ] == ['443', '8443', '9000']
+        assert view.first('DocumentRoot', recursive=True).args == '/var/www/dev'
+
+    def test_freeze(self):
+        root = Node(files['effective'])
+        tree = root.freeze()
+        assert len(tree) == 1 + len(list(root.children(recursive=True)))
+        frozen = tree.root
+        assert [ (c.name, c.args, c.line) for c in frozen.children(recursive=True) ] == \
+            [ (c.name, c.args, c.line) for c in root.children(recursive=True) ]
+
+        vhost = frozen.find_vhost('EXAMPLE.COM', arg=':443')
+        assert vhost.section == 'VirtualHost'
+        assert vhost.first('DocumentRoot').args == '${SITES}/example.com'
+        assert vhost.first('SSLEngine', recursive=True).parent.section == 'IfModule'
+        assert vhost.parent == frozen
+        assert frozen.first('NoSuchDirective') is None
+        with pytest.raises(a2conf.VhostNotFound):
+            frozen.find_vhost('example.com', arg=':80')
+
+        path = os.path.join(confdir, 'tree.frozen')
+        tree.save(path)
+        try:
+            with a2conf.FrozenTree.load(path) as loaded:
+                assert loaded.root.find_vhost('example.net').first('ServerName').path == files['effective']
+                assert loaded.tobytes() == tree.tobytes()
+        finally:
+            os.unlink(path)
+
+        with pytest.raises(a2conf.FrozenError):
+            a2conf.FrozenTree(tree.tobytes()[:-1])
+
+    def test_diff(self):
+        old = Node(files['effective'])
+        new = Node(files['effective'])
+        assert old.digest() == new.digest()
+        assert old.diff(new) == []
+
+        vhost = new.find_vhost('example.com')
+        digest = vhost.digest()
+        vhost.first('DocumentRoot').args = '/srv/example.com'
+        assert vhost.digest() != digest
+        new.first('<IfModule>').insert('SSLHonorCipherOrder on')
+        new.first('<Directory>').delete()
+        new.insert(Node(raw='<VirtualHost *:80>'))
+        # comments are not part of digest
+        new.first('ServerAdmin').suffix = ' # admin'
+        new.insert(Node(raw='# new comment'), after='ServerAdmin')
+
+        changes = dict(((c.kind, c.node.name), c) for c in old.diff(new))
+        assert sorted(changes) == [('added', '<VirtualHost>'), ('added', 'SSLHonorCipherOrder'),
+                                   ('modified', 'DocumentRoot'), ('removed', '<Directory>')]
+        modified = changes[('modified', 'DocumentRoot')]
+        assert modified.old.args == '${SITES}/example.com'
+        assert modified.vhost is vhost
+        assert modified.line == vhost.first('DocumentRoot').line
+        assert modified.path == files['effective']
+        assert changes[('removed', '<Directory>')].vhost is None
+
+        # unchanged subtrees keep memoized digest
+        net = new.find_vhost('example.net')
+        assert net._memo['digest'] == old.find_vhost('example.net').digest()
+
+    def test_walk(self):
+        root = Node(files['effective'])
+        visited = list()
+        closed = list()
+        root.walk(lambda node, depth: visited.append((node.name, depth)),
+                  lambda node, depth: closed.append(node.name))
+        assert visited == [ (c.name, visited[i][1]) for i, c in enumerate(root.children(recursive=True)) ]
+        assert ('SSLEngine', 2) in visited
+        # section is closed after its content
+        assert closed[closed.index('SSLEngine') + 1] == '<IfModule>'
+        assert closed[-2:] == ['ServerName', '<VirtualHost>']
+
+        # skip content of vhosts, stop on second vhost
+        seen = list()
+        def pre(node, depth):
+            seen.append(node.name)
+            if node.name == '<VirtualHost>':
+                return a2conf.STOP if node.args == '*:80' else a2conf.SKIP
+        assert root.walk(pre) is True
+        assert seen[-3:] == ['Options', '<VirtualHost>', '<VirtualHost>']
+        assert root.walk(lambda node, depth: None) is False
+
+        # deep nesting is not limited by recursion limit
+        deep = Node()
+        node = deep
+        for i in range(sys.getrecursionlimit() + 100):
+            node = node.insert('<IfDefine D{}>'.format(i))
+        node.insert('ServerName deep.example.com')
+        assert deep.first('ServerName', recursive=True).args == 'deep.example.com'
+        fh = io.StringIO()
+        deep.dump(fh)
+        assert fh.getvalue().count('</IfDefine>') == sys.getrecursionlimit() + 100
+        deep.filter('servername')
+        assert deep.first('ServerName', recursive=True) is None
+
+        # content set directly, without parent links
+        root = Node()
+        vh = Node(raw='<VirtualHost *:80>')
+        root.content = [ vh ]
+        vh.content.append(Node(raw='ServerName example.com'))
+        vh.content.append(Node(raw='DocumentRoot /var/www'))
+        root.filter('servername')
+        assert [ c.name for c in vh.children() ] == ['DocumentRoot']
+        assert vh.parent is root
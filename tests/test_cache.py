@@ -0,0 +1,60 @@
+from a2conf import Node, ParseCache
+from tempfile import mkdtemp
+import shutil
+import os
+
+confdir = None
+
+def setup_module(module):
+    global confdir
+    confdir = mkdtemp(prefix='a2conf-test-', dir='/tmp')
+    with open(os.path.join(confdir, 'main.conf'), 'w') as fh:
+        fh.write("ServerAdmin root@example.com\nInclude {}/site*.conf\n".format(confdir))
+    for n in range(3):
+        with open(os.path.join(confdir, 'site{}.conf'.format(n)), 'w') as fh:
+            fh.write("<VirtualHost *:80>\n    ServerName site{}.example.com\n</VirtualHost>\n".format(n))
+
+
+def teardown_module(module):
+    shutil.rmtree(confdir)
+
+
+class TestClass:
+
+    def test_cache_hit(self):
+        cachedir = os.path.join(confdir, 'cache1')
+        main = os.path.join(confdir, 'main.conf')
+
+        cache = ParseCache(cachedir)
+        root = Node(main, cache=cache)
+        assert (cache.hits, cache.misses) == (0, 4)
+
+        cache = ParseCache(cachedir)
+        root2 = Node(main, cache=cache)
+        assert (cache.hits, cache.misses) == (4, 0)
+
+        for hostname in ['site0.example.com', 'site1.example.com', 'site2.example.com']:
+            vh = root.find_vhost(hostname)
+            vh2 = root2.find_vhost(hostname)
+            assert (vh.path, vh.line, vh.args) == (vh2.path, vh2.line, vh2.args)
+            assert vh2.first('ServerName').raw == '    ServerName ' + hostname
+
+    def test_cache_modified(self):
+        cachedir = os.path.join(confdir, 'cache2')
+        path = os.path.join(confdir, 'site1.conf')
+
+        Node(path, cache=cachedir)
+
+        with open(path, 'w') as fh:
+            fh.write("<VirtualHost *:80>\n    ServerName changed.example.com\n</VirtualHost>\n")
+
+        cache = ParseCache(cachedir)
+        root = Node(path, cache=cache)
+        assert cache.misses == 1
+        assert root.find_vhost('changed.example.com')
+
+    def test_cache_evict(self):
+        cachedir = os.path.join(confdir, 'cache3')
+        cache = ParseCache(cachedir, max_size=1)
+        Node(os.path.join(confdir, 'main.conf'), cache=cache)
+        assert cache.size() <= 1
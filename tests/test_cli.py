@@ -0,0 +1,105 @@
+from a2conf.cli import main
+from tempfile import mkdtemp
+import shutil
+import json
+import io
+import os
+
+confdir = None
+config = None
+
+example = """ServerAdmin root@example.com
+<VirtualHost *:80>
+    ServerName example.com
+    ServerAlias www.example.com
+    DocumentRoot /var/www/example
+</VirtualHost>
+<VirtualHost *:443>
+    ServerName example.com
+    SSLEngine on
+</VirtualHost>
+"""
+
+
+def run(*argv, stdin=''):
+    out = io.StringIO()
+    code = main([config] + list(argv), stdin=io.StringIO(stdin), stdout=out)
+    return code, out.getvalue()
+
+
+class TestClass:
+
+    def setup_method(self, method):
+        global confdir, config
+        confdir = mkdtemp(prefix='a2conf-test-', dir='/tmp')
+        config = os.path.join(confdir, 'apache2.conf')
+        with open(config, 'w') as fh:
+            fh.write(example)
+
+    def teardown_method(self, method):
+        shutil.rmtree(confdir)
+
+    def test_command(self):
+        code, out = run('find_vhost', 'www.example.com')
+        assert code == 0
+        vhost = json.loads(out)
+        assert vhost['args'] == '*:80'
+        assert vhost['line'] == 2
+        assert vhost['hostnames'] == ['example.com', 'www.example.com']
+
+        code, out = run('first', 'SSLEngine', '-r')
+        assert json.loads(out)['args'] == 'on'
+
+        code, out = run('dump', '--vhost', 'www.example.com')
+        assert json.loads(out) == {'ServerName': 'example.com', 'ServerAlias': 'www.example.com',
+                                   'DocumentRoot': '/var/www/example'}
+
+        assert run('find_vhost', 'example.org')[0] == 1
+
+        code, out = run('set', 'DocumentRoot', '/srv/example', '--vhost', 'www.example.com', '--save')
+        assert code == 0
+        with open(config) as fh:
+            assert '    DocumentRoot /srv/example\n' in fh.read()
+
+    def test_batch(self):
+        requests = [
+            dict(id=1, cmd='children', name='<VirtualHost>'),
+            dict(id=2, cmd='first', name='DocumentRoot', target='//VirtualHost[SSLEngine]'),
+            dict(id=3, cmd='nosuchcommand'),
+            dict(id=4, cmd='set', name='DocumentRoot', args='/var/www/ssl', target='//VirtualHost[SSLEngine]'),
+            dict(id=5, cmd='delete', name='ServerAlias', vhost='www.example.com'),
+            dict(id=6, cmd='first', name='DocumentRoot', target='/VirtualHost[args=*:443]'),
+            dict(id=7, cmd='find_vhost', hostname='www.example.com'),
+            dict(id=8, cmd='effective', hostname='example.com', bad=1),
+            dict(id=9, cmd='save'),
+        ]
+        stdin = '\n'.join(json.dumps(r) for r in requests) + '\nnot json\n'
+        code, out = run('--batch', stdin=stdin)
+        assert code == 0
+        responses = [ json.loads(line) for line in out.splitlines() ]
+        assert [ r.get('id') for r in responses ] == list(range(1, 10)) + [None]
+
+        assert [ n['args'] for n in responses[0]['result'] ] == ['*:80', '*:443']
+        assert responses[1]['result'] is None
+        assert 'unknown command' in responses[2]['error']
+        assert responses[3]['result']['args'] == '/var/www/ssl'
+        assert responses[4]['result'] == 1
+        assert responses[5]['result']['args'] == '/var/www/ssl'
+        assert 'VhostNotFound' in responses[6]['error']
+        assert 'bad' in responses[7]['error']
+        assert responses[8]['result'] == [config]
+        assert 'error' in responses[9]
+
+    def test_batch_wrong_types(self):
+        requests = [
+            dict(id=1, cmd='children', name=5),
+            dict(id=2, cmd='effective', hostname='example.com', env=[1]),
+            dict(id=3, cmd='first', name='ServerName', vhost='www.example.com'),
+        ]
+        code, out = run('--batch', stdin='\n'.join(json.dumps(r) for r in requests) + '\n')
+        assert code == 0
+        responses = [ json.loads(line) for line in out.splitlines() ]
+        assert [ r['id'] for r in responses ] == [1, 2, 3]
+        assert 'error' in responses[0]
+        assert 'error' in responses[1]
+        assert responses[2]['result']['args'] == 'example.com'
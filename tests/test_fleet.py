@@ -0,0 +1,71 @@
+from a2conf.fleet import run_fleet, iter_fleet, extract
+import pytest
+import tarfile
+import shutil
+import time
+import os
+
+
+def hostnames(root):
+    return sorted(h for vh in root.select('//VirtualHost') for h in vh.hostnames())
+
+
+def slow(root):
+    if root.first('ServerAdmin').args == 'slow':
+        time.sleep(5)
+    return 1
+
+
+class TestClass:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, confdir, write):
+        for n in range(3):
+            write('web{}/apache2/apache2.conf'.format(n), "ServerAdmin root\nIncludeOptional sites/*.conf\n")
+            write('web{}/apache2/sites/site.conf'.format(n),
+                  "<VirtualHost *:80>\n    ServerName site{}.example.com\n</VirtualHost>\n".format(n))
+        with tarfile.open(os.path.join(confdir, 'web2.tar.gz'), 'w:gz') as tar:
+            tar.add(os.path.join(confdir, 'web2'), arcname='etc')
+        shutil.rmtree(os.path.join(confdir, 'web2'))
+        os.mkdir(os.path.join(confdir, 'empty'))
+
+    def test_fleet(self, confdir):
+        roots = [ os.path.join(confdir, name) for name in ['web0', 'web1', 'web2.tar.gz', 'empty'] ]
+        report = run_fleet(roots, hostnames, workers=2, combine=lambda total, root, value: total + len(value),
+                           initial=0)
+        assert report.results == {roots[0]: ['site0.example.com'], roots[1]: ['site1.example.com'],
+                                  roots[2]: ['site2.example.com']}
+        assert list(report.errors) == [roots[3]]
+        assert 'FileNotFoundError' in report.errors[roots[3]]
+        assert report.value == 3
+
+    def test_fleet_timeout(self, confdir, write):
+        write('web0/apache2/apache2.conf', "ServerAdmin slow\n")
+        roots = [ os.path.join(confdir, name) for name in ['web0', 'web1'] ]
+        start = time.time()
+        results = dict((r.root, r) for r in iter_fleet(roots, slow, workers=2, timeout=0.5))
+        assert time.time() - start < 4
+        assert 'FleetTimeout' in results[roots[0]].error
+        assert results[roots[1]].value == 1 and results[roots[1]].tree is None
+
+    def test_symlinks(self, confdir, write):
+        web = os.path.join(confdir, 'web3')
+        write('web3/apache2/apache2.conf', "ServerAdmin root\nIncludeOptional sites-enabled/*.conf\n")
+        write('web3/apache2/sites-available/a.conf', "<VirtualHost *:80>\n    ServerName a.com\n</VirtualHost>\n")
+        os.mkdir(os.path.join(web, 'apache2/sites-enabled'))
+        os.symlink('../sites-available/a.conf', os.path.join(web, 'apache2/sites-enabled/a.conf'))
+        # outside of archive: skipped
+        os.symlink('/etc/passwd', os.path.join(web, 'apache2/sites-enabled/passwd.conf'))
+        os.symlink('../../../../outside.conf', os.path.join(web, 'apache2/sites-enabled/outside.conf'))
+        with tarfile.open(os.path.join(confdir, 'web3.tar'), 'w') as tar:
+            tar.add(web, arcname='etc')
+
+        roots = [ web, os.path.join(confdir, 'web3.tar') ]
+        os.unlink(os.path.join(web, 'apache2/sites-enabled/passwd.conf'))
+        os.unlink(os.path.join(web, 'apache2/sites-enabled/outside.conf'))
+        report = run_fleet(roots, hostnames, workers=2)
+        assert report.results == {roots[0]: ['a.com'], roots[1]: ['a.com']}
+
+        out = os.path.join(confdir, 'out')
+        extract(roots[1], out)
+        assert sorted(os.listdir(os.path.join(out, 'etc/apache2/sites-enabled'))) == ['a.conf']
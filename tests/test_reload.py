@@ -0,0 +1,145 @@
+from a2conf import Node, MyException
+import pytest
+import threading
+import os
+
+
+def hostnames(root):
+    return [ vh.first('ServerName').args for vh in root.children('<VirtualHost>') ]
+
+
+class TestClass:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, write, vhost):
+        write('main.conf', "ServerAdmin root@example.com\nIncludeOptional sites/*.conf\nListen 80\n")
+        for n in range(3):
+            write('sites/site{}.conf'.format(n), vhost('site{}.example.com'.format(n)))
+
+    def test_reload(self, confdir, write, vhost):
+        root = Node(os.path.join(confdir, 'main.conf'))
+        assert len(root.loaded_files()) == 4
+        site0 = root.find_vhost('site0.example.com')
+        site2 = root.find_vhost('site2.example.com')
+
+        assert root.reload() == []
+
+        path1 = write('sites/site1.conf', vhost('changed.example.com'))
+        os.utime(path1, ns=(0, 10**9))
+        path3 = write('sites/site3.conf', vhost('site3.example.com'))
+        path0 = os.path.join(confdir, 'sites/site0.conf')
+        os.unlink(path0)
+
+        assert sorted(root.reload()) == sorted([path0, path1, path3])
+        assert hostnames(root) == ['changed.example.com', 'site2.example.com', 'site3.example.com']
+        # unchanged file is not parsed again
+        assert root.find_vhost('site2.example.com') is site2
+        assert root.find_vhost('site3.example.com').parent is root
+        assert [ c.name for c in root.children() ][-1] == 'Listen'
+        assert sorted(root.loaded_files())[-1] == path3
+
+    def test_reload_main(self, confdir, write):
+        main = os.path.join(confdir, 'main.conf')
+        root = Node(main)
+        write('main.conf', "ServerAdmin webmaster@example.com\nIncludeOptional sites/site1.conf\n")
+        assert root.reload() == [main]
+        assert root.first('ServerAdmin').args == 'webmaster@example.com'
+        assert hostnames(root) == ['site1.example.com']
+
+    def test_reload_main_options(self, confdir, write):
+        main = os.path.join(confdir, 'main.conf')
+        root = Node(main, comments=False, reader='mmap')
+        write('main.conf', "# admin\nServerAdmin webmaster@example.com\n")
+        assert root.reload() == [main]
+        assert [ c.name for c in root.children() ] == ['ServerAdmin']
+        with pytest.raises(MyException):
+            root.save_all()
+
+    def test_include_in_section(self, confdir, write):
+        write('main.conf', "<VirtualHost *:80>\n    ServerName example.com\n    Include inc.conf\n"
+                           "    DocumentRoot /var/www\n</VirtualHost>\n")
+        path = write('inc.conf', "ServerAlias www.example.com\n")
+        root = Node(os.path.join(confdir, 'main.conf'))
+        vh = root.find_vhost('www.example.com')
+        assert [ c.name for c in vh.children() ] == ['ServerName', 'Include', 'ServerAlias', 'DocumentRoot']
+
+        write('inc.conf', "ServerAlias example.net\n")
+        os.utime(path, ns=(0, 10**9))
+        assert root.reload() == [path]
+        assert root.find_vhost('example.net') is vh
+        assert [ c.args for c in vh.children() ][1:3] == ['inc.conf', 'example.net']
+
+    def test_deleted_include(self, confdir, write, vhost):
+        root = Node(os.path.join(confdir, 'main.conf'))
+        root.first('IncludeOptional').delete()
+
+        path1 = write('sites/site1.conf', vhost('changed.example.com'))
+        os.utime(path1, ns=(0, 10**9))
+        assert root.reload() == [path1]
+        assert hostnames(root) == ['site0.example.com', 'changed.example.com', 'site2.example.com']
+        assert [ c.name for c in root.children() ][0] == 'ServerAdmin'
+        assert root.find_vhost('changed.example.com').parent is root
+
+    def test_watch(self, confdir, write, vhost):
+        root = Node(os.path.join(confdir, 'main.conf'))
+        stop = threading.Event()
+        reloaded = list()
+
+        def callback(node, changed):
+            reloaded.extend(changed)
+            stop.set()
+
+        write('sites/site9.conf', vhost('site9.example.com'))
+        watcher = threading.Thread(target=root.watch, kwargs=dict(interval=0.01, callback=callback, stop=stop))
+        watcher.start()
+        watcher.join(5)
+        assert not watcher.is_alive()
+        assert reloaded == [os.path.join(confdir, 'sites/site9.conf')]
+        assert root.find_vhost('site9.example.com')
+
+    def test_locate(self, confdir, write, vhost):
+        main = os.path.join(confdir, 'main.conf')
+        site1 = os.path.join(confdir, 'sites/site1.conf')
+        write('sites/site1.conf', "# site 1\n<VirtualHost *:80>\n    ServerName site1.example.com\n\n"
+                                  "    <Directory /var/www>\n        Options None\n    </Directory>\n"
+                                  "    DocumentRoot /var/www\n</VirtualHost>\n")
+        root = Node(main)
+        site = root.find_vhost('site1.example.com')
+
+        assert root.locate(main, 3).name == 'Listen'
+        assert root.locate(site1, 3).args == 'site1.example.com'
+        assert root.locate(site1, 3).get_vhost() is site
+        # blank line, closing tag and comment-only line: innermost section
+        assert root.locate(site1, 4) is site
+        assert root.locate(site1, 7).name == '<Directory>'
+        assert root.locate(site1, 9) is site
+        assert root.locate(site1, 1).name == '#'
+        assert root.locate(site1, 100) is None
+        assert root.locate(os.path.join(confdir, 'nosuchfile.conf'), 1) is None
+        # relative path
+        assert root.locate(os.path.relpath(site1), 8).name == 'DocumentRoot'
+
+        message = "AH00526: Syntax error on line 6 of {}:\nInvalid command 'Options'".format(site1)
+        assert [ (path, line, node.name) for path, line, node in root.locate_message(message) ] == \
+            [ (site1, 6, 'Options') ]
+
+        # changes
+        site.first('<Directory>').delete()
+        assert root.locate(site1, 6) is site
+        # first node of file is deleted, new node is inserted after last one
+        root.locate(site1, 1).delete()
+        root.insert('ServerTokens Prod', after=site)
+        assert root.locate(site1, 1) is None
+        assert root.locate(site1, 3).get_vhost() is site
+        assert root.locate(site1, 8).name == 'DocumentRoot'
+        root.find_vhost('site2.example.com').delete()
+        assert root.locate(os.path.join(confdir, 'sites/site2.conf'), 2) is None
+        with root.batch() as batch:
+            batch.delete(root.first('Listen'))
+        assert root.locate(main, 3) is None
+
+        # reload: new lines of changed file
+        write('sites/site1.conf', "\n\n" + vhost("site1.example.com"))
+        root.reload()
+        assert root.locate(site1, 3).name == '<VirtualHost>'
+        assert root.locate(site1, 4).args == 'site1.example.com'
@@ -0,0 +1,176 @@
+from a2conf import Node, ArgumentError, VhostNotFound
+import pytest
+import stat
+import os
+
+
+class TestClass:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, write, vhost):
+        write('main.conf', "# main config\nServerAdmin root@example.com\nIncludeOptional sites/*.conf\nListen 80\n")
+        for n in range(3):
+            write('sites/site{}.conf'.format(n), vhost('site{}.example.com'.format(n)))
+
+    def test_dirty(self, confdir):
+        root = Node(os.path.join(confdir, 'main.conf'))
+        assert root.dirty_files() == []
+
+        site1 = os.path.join(confdir, 'sites/site1.conf')
+        root.find_vhost('site1.example.com').first('ServerName').args = 'www.example.com'
+        assert root.dirty_files() == [site1]
+
+        site2 = os.path.join(confdir, 'sites/site2.conf')
+        root.find_vhost('site2.example.com').insert('DocumentRoot /var/www/site2')
+        assert root.dirty_files() == [site1, site2]
+
+    def test_save_all(self, confdir):
+        main = os.path.join(confdir, 'main.conf')
+        site0 = os.path.join(confdir, 'sites/site0.conf')
+        site1 = os.path.join(confdir, 'sites/site1.conf')
+        site2 = os.path.join(confdir, 'sites/site2.conf')
+        os.chmod(site1, 0o640)
+        os.utime(site0, ns=(0, 10**9))
+
+        root = Node(main)
+        root.find_vhost('site1.example.com').insert('DocumentRoot /var/www/site1')
+        root.find_vhost('site2.example.com').delete()
+        root.first('ServerAdmin').args = 'webmaster@example.com'
+
+        assert root.save_all() == [main, site1, site2]
+        assert root.dirty_files() == []
+        assert root.reload() == []
+
+        # unchanged file is not written
+        assert os.stat(site0).st_mtime_ns == 10**9
+        assert stat.S_IMODE(os.stat(site1).st_mode) == 0o640
+
+        with open(main) as fh:
+            assert fh.read() == "# main config\nServerAdmin webmaster@example.com\nIncludeOptional sites/*.conf\nListen 80\n"
+        with open(site1) as fh:
+            assert fh.read() == ("<VirtualHost *:80>\n    ServerName site1.example.com\n"
+                                 "    DocumentRoot /var/www/site1\n</VirtualHost>\n")
+        with open(site2) as fh:
+            assert fh.read() == ""
+
+        root2 = Node(main)
+        assert root2.find_vhost('site1.example.com').first('DocumentRoot').args == '/var/www/site1'
+        assert len(list(root2.children('<VirtualHost>'))) == 2
+
+    def test_trailing_blank_lines(self, write, vhost):
+        main = write('main.conf', "ServerAdmin root@example.com\nIncludeOptional sites/*.conf\n\n\n")
+        site0 = write('sites/site0.conf', vhost('site0.example.com') + "\n")
+        site1 = write('sites/site1.conf', "\n\n")
+        texts = dict()
+        for path in (main, site0, site1):
+            with open(path) as fh:
+                texts[path] = fh.read()
+
+        for reader in ('text', 'mmap'):
+            root = Node(main, reader=reader)
+            assert root.serialize(main) == texts[main]
+            assert root.save_all([main, site0, site1]) == [main, site0, site1]
+            for path in (main, site0, site1):
+                with open(path) as fh:
+                    assert fh.read() == texts[path]
+
+    def test_included_top_level(self, confdir, write, vhost):
+        main = os.path.join(confdir, 'main.conf')
+        site0 = write('sites/site0.conf', "Listen 8080\n" + vhost('site0.example.com'))
+
+        root = Node(main)
+        with root.batch() as b:
+            b.insert(root, 'Listen 9090', after=root.first('Listen'))
+        root.save_all()
+        with open(site0) as fh:
+            assert fh.read() == "Listen 8080\nListen 9090\n" + vhost('site0.example.com')
+
+        root = Node(main)
+        with root.batch() as b:
+            b.replace(root.first('Listen'), 'Listen 9999')
+        assert root.save_all() == [site0]
+        with open(site0) as fh:
+            assert fh.read() == "Listen 9999\nListen 9090\n" + vhost('site0.example.com')
+
+    def test_insert_after_included(self, confdir, vhost):
+        main = os.path.join(confdir, 'main.conf')
+        site0 = os.path.join(confdir, 'sites/site0.conf')
+        root = Node(main)
+        vh = root.find_vhost('site0.example.com')
+        # same rule as batch insert: new node belongs to file of anchor
+        root.insert('Listen 8080', after=vh)
+        assert root.dirty_files() == [site0]
+        root.save_all()
+        with open(site0) as fh:
+            assert fh.read() == vhost('site0.example.com') + "Listen 8080\n"
+        with open(main) as fh:
+            assert 'Listen 8080' not in fh.read()
+
+    def test_new_file_mode(self, confdir):
+        root = Node(os.path.join(confdir, 'main.conf'))
+        new = os.path.join(confdir, 'new.conf')
+        umask = os.umask(0o27)
+        try:
+            root.write_file(new)
+        finally:
+            os.umask(umask)
+        assert stat.S_IMODE(os.stat(new).st_mode) == 0o640
+        assert sorted(os.listdir(confdir)) == ['main.conf', 'new.conf', 'sites']
+
+    def test_save_file(self, confdir):
+        main = os.path.join(confdir, 'main.conf')
+        root = Node(main)
+        vh = root.find_vhost('site0.example.com')
+        vh.insert('ServerAlias www.site0.example.com')
+        vh.save_file()
+        assert root.dirty_files() == []
+
+        with open(main) as fh:
+            assert 'VirtualHost' not in fh.read()
+        assert Node(main).find_vhost('www.site0.example.com')
+
+    def test_batch(self, confdir, write):
+        main = os.path.join(confdir, 'main.conf')
+        site0 = os.path.join(confdir, 'sites/site0.conf')
+        site2 = os.path.join(confdir, 'sites/site2.conf')
+        write('sites/site0.conf', "<VirtualHost *:80>\n    ServerName site0.example.com\n    Redirect / /a\n"
+                                  "    Redirect /b /c\n    DocumentRoot /var/www\n</VirtualHost>\n")
+        root = Node(main)
+
+        with root.batch() as b:
+            for vh in root.children('<VirtualHost>', recursive=True):
+                b.insert(vh, 'CustomLog /var/log/access.log combined', after=['ServerName', 'DocumentRoot'])
+                for n in vh.children(recursive=True):
+                    if n.name == 'Redirect':
+                        b.delete(n)
+            vh2 = root.find_vhost('site2.example.com')
+            b.replace(vh2.first('ServerName'), ['ServerName www.example.com', 'ServerAlias example.com'])
+            b.insert(root, 'Listen 443', after=root.first('Listen'))
+            # nothing is changed before apply
+            assert root.find_vhost('site2.example.com') is vh2
+
+        assert b.summary == dict(inserted=4, deleted=2, replaced=1, parents=4, files=[main, site0,
+            os.path.join(confdir, 'sites/site1.conf'), site2])
+        assert root.dirty_files() == b.summary['files']
+        assert root.find_vhost('www.example.com') is vh2
+        assert root.find_vhost('example.com') is vh2
+
+        root.save_all()
+        with open(site0) as fh:
+            assert fh.read() == ("<VirtualHost *:80>\n    ServerName site0.example.com\n    DocumentRoot /var/www\n"
+                                 "    CustomLog /var/log/access.log combined\n</VirtualHost>\n")
+        with open(site2) as fh:
+            assert fh.read() == ("<VirtualHost *:80>\n    ServerName www.example.com\n    ServerAlias example.com\n"
+                                 "    CustomLog /var/log/access.log combined\n</VirtualHost>\n")
+        with open(main) as fh:
+            assert fh.read().endswith("Listen 80\nListen 443\n")
+
+        b = root.batch()
+        b.delete(vh2)
+        with pytest.raises(ArgumentError):
+            b.delete(vh2)
+        with pytest.raises(ArgumentError):
+            b.delete(root)
+        b.apply()
+        with pytest.raises(VhostNotFound):
+            root.find_vhost('www.example.com')
@@ -0,0 +1,44 @@
+from a2conf import Node, LoadStats
+import pytest
+import os
+
+
+class TestClass:
+
+    @pytest.fixture(autouse=True)
+    def setup(self, write):
+        write('main.conf', "ServerAdmin root@example.com\nIncludeOptional sites/*.conf\nInclude missing.conf\n")
+        for n in range(2):
+            write('sites/site{}.conf'.format(n),
+                  "<VirtualHost *:80>\n    ServerName site{}.example.com\n</VirtualHost>\n\n".format(n))
+
+    def test_stats(self, confdir):
+        records = list()
+        stats = LoadStats(callback=records.append)
+        root = Node(os.path.join(confdir, 'main.conf'), stats=stats)
+        assert root.load_stats() is stats
+
+        site0 = os.path.join(confdir, 'sites/site0.conf')
+        assert [ (os.path.relpath(fs.path, confdir), fs.depth, fs.error is None) for fs in stats.files ] == \
+            [('sites/site0.conf', 1, True), ('sites/site1.conf', 1, True), ('main.conf', 0, True)]
+        fs = stats.files[0]
+        assert (fs.path, fs.lines, fs.nodes, fs.bytes) == (site0, 3, 2, os.path.getsize(site0))
+        assert fs.include == 'IncludeOptional sites/*.conf'
+        assert stats.files[-1].total_time >= sum(fs.total_time for fs in stats.files[:-1])
+
+        assert [ (gs.pattern, gs.line, gs.matches) for gs in stats.globs ] == \
+            [('sites/*.conf', 2, 2), ('missing.conf', 3, 0)]
+        assert records == [stats.globs[0]] + stats.files[:2] + [stats.globs[1], stats.files[2]]
+
+        summary = stats.summary()
+        assert (summary['files'], summary['missing'], summary['nodes'], summary['max_depth']) == (3, 0, 7, 1)
+        assert stats.as_dict()['summary'] == summary
+
+    def test_stats_cache(self, confdir):
+        main = os.path.join(confdir, 'main.conf')
+        cachedir = os.path.join(confdir, 'cache')
+        Node(main, cache=cachedir)
+        root = Node(main, cache=cachedir, stats=True)
+        stats = root.load_stats()
+        assert (stats.cache_hits, stats.cache_misses) == (3, 0)
+        assert Node(main).load_stats() is None
@@ -0,0 +1,72 @@
+from a2conf import Node
+from a2conf.validate import StatCache
+from tempfile import mkdtemp
+import shutil
+import os
+
+confdir = None
+
+example = """ServerRoot {confdir}
+Define CERTS {confdir}/certs
+ErrorLog ${{APACHE_LOG_DIR}}/error.log
+<VirtualHost *:80>
+    ServerName example.com
+    ServerAlias www.example.com
+    DocumentRoot www/example
+    CustomLog "|/usr/bin/rotatelogs /var/log/access.%Y" combined
+</VirtualHost>
+<VirtualHost *:443>
+    ServerName example.com
+    DocumentRoot www/missing
+    SSLCertificateFile ${{CERTS}}/example.pem
+    SSLCertificateKeyFile ${{CERTS}}/example.key
+    SSLCertificateChainFile ${{UNKNOWN}}/chain.pem
+    ErrorLog logs/example-error.log
+    CustomLog "logs/example access.log" combined
+</VirtualHost>
+<IfModule mod_ssl.c>
+    <VirtualHost *:80>
+        ServerName www.example.com
+        DocumentRoot {confdir}/certs/example.pem
+        SSLCertificateFile {confdir}/certs
+    </VirtualHost>
+</IfModule>
+"""
+
+
+class TestClass:
+
+    def setup_method(self, method):
+        global confdir
+        confdir = mkdtemp(prefix='a2conf-test-', dir='/tmp')
+        os.makedirs(os.path.join(confdir, 'www/example'))
+        os.makedirs(os.path.join(confdir, 'certs'))
+        os.makedirs(os.path.join(confdir, 'logs'))
+        with open(os.path.join(confdir, 'certs/example.pem'), 'w') as fh:
+            fh.write('cert')
+        with open(os.path.join(confdir, 'apache2.conf'), 'w') as fh:
+            fh.write(example.format(confdir=confdir))
+
+    def teardown_method(self, method):
+        shutil.rmtree(confdir)
+
+    def test_validate(self):
+        root = Node(os.path.join(confdir, 'apache2.conf'))
+        stats = StatCache()
+        findings = root.validate(env={'APACHE_LOG_DIR': os.path.join(confdir, 'logs')}, workers=4, stats=stats)
+        assert [ (f.line, f.code) for f in findings ] == [
+            (12, 'missing'),
+            (14, 'missing'),
+            (15, 'undefined'),
+            (21, 'duplicate_hostname'),
+            (22, 'not_dir'),
+            (23, 'not_file'),
+        ]
+        assert all(f.path == root.path for f in findings)
+        assert findings[0].message == 'DocumentRoot: {}/www/missing does not exist'.format(confdir)
+        assert 'www.example.com *:80' in findings[3].message
+        # logs directory is stat'ed once for all log files
+        assert os.path.join(confdir, 'logs') in stats._stats
+
+        findings = root.validate()
+        assert (3, 'undefined') in [ (f.line, f.code) for f in findings ]